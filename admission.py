@@ -0,0 +1,269 @@
+# admission.py
+"""
+Admission control in front of the transcription backends.
+
+At most ADMISSION_MAX_CONCURRENT transcriptions per worker process talk to
+the upstream at once; the rest wait in a bounded queue ordered by estimated
+audio duration, so a short clip is not stuck behind long transcribe-2step
+jobs. Waiting also earns priority (ADMISSION_AGING: seconds of audio per
+second waited) so long clips still get through under sustained load.
+
+A full queue fails fast with 429, and a request that waits longer than
+ADMISSION_QUEUE_TIMEOUT_SEC gives up with 503; both carry a Retry-After
+estimate. Patient callers (job workers, whose client already got a 202)
+skip both: they join the queue past its cap and wait for as long as it
+takes. Threads and asyncio tasks share one controller: a waiter is woken
+through its own callback (Event.set or a future on its loop).
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from audio import wav_info
+from metrics import Counter, Gauge, Histogram
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "4"))    # 0 = no limit
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT_SEC = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SEC", "30"))
+ADMISSION_AGING = float(os.getenv("ADMISSION_AGING", "1.0"))
+ADMISSION_MAX_RETRY_AFTER_SEC = 120
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Transcriptions holding an upstream slot")
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Transcriptions waiting for an upstream slot")
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds", "Time spent waiting for an upstream slot", ("outcome",))
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests turned away by admission control (queue_full/timeout)",
+    ("reason",))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def body(self):
+        if self.status == 429:
+            error = "Transcription queue is full, try again later"
+        else:
+            error = "Timed out waiting for a transcription slot, try again later"
+        return {"error": error, "retry_after": self.retry_after}
+
+
+class _Waiter:
+    __slots__ = ("key", "seq", "wake", "granted", "abandoned")
+
+    def __init__(self, key, seq, wake):
+        self.key = key
+        self.seq = seq
+        self.wake = wake
+        self.granted = False
+        self.abandoned = False
+
+    def __lt__(self, other):
+        return (self.key, self.seq) < (other.key, other.seq)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout_sec=ADMISSION_QUEUE_TIMEOUT_SEC, aging=ADMISSION_AGING):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout_sec = queue_timeout_sec
+        self.aging = aging
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self.in_flight = 0
+        self.queued = 0
+        self._hold_ewma = None          # seconds a slot is held, for Retry-After
+        self.counters = {"admitted": 0, "enqueued": 0, "queue_full": 0, "timeout": 0}
+
+    @property
+    def enabled(self):
+        return self.max_concurrent > 0
+
+    # ---------------- queueing ----------------
+    def retry_after(self):
+        """
+        Seconds until a slot is likely free for a new arrival.
+        """
+        hold = self._hold_ewma or 5.0
+        rounds = (self.queued + 1) / float(max(self.max_concurrent, 1))
+        return int(min(max(math.ceil(hold * rounds), 1), ADMISSION_MAX_RETRY_AFTER_SEC))
+
+    def check(self):
+        """
+        AdmissionRejected (counted, not raised) when a new request would be
+        turned away outright, else None -- a cheap check a route can make
+        before reading the upload.
+        """
+        with self._lock:
+            if not (self.enabled and self.in_flight >= self.max_concurrent
+                    and self.queued >= self.max_queue):
+                return None
+            self.counters["queue_full"] += 1
+            retry_after = self.retry_after()
+        ADMISSION_REJECTED.inc(reason="queue_full")
+        return AdmissionRejected(429, "queue_full", retry_after)
+
+    def _enter(self, estimated_sec, wake, patient=False):
+        """
+        None when a slot was taken at once, else the queued _Waiter.
+        Raises AdmissionRejected when the queue is full (never if patient).
+        """
+        with self._lock:
+            if self.in_flight < self.max_concurrent and not self.queued:
+                self.in_flight += 1
+                self.counters["admitted"] += 1
+                return None
+            if self.queued >= self.max_queue and not patient:
+                self.counters["queue_full"] += 1
+                retry_after = self.retry_after()
+            else:
+                # Static key: aging every waiter at the same rate is the same as
+                # crediting the enqueue time once
+                key = estimated_sec + self.aging * time.monotonic()
+                waiter = _Waiter(key, next(self._seq), wake)
+                heapq.heappush(self._heap, waiter)
+                self.queued += 1
+                self.counters["enqueued"] += 1
+                return waiter
+        ADMISSION_REJECTED.inc(reason="queue_full")
+        ADMISSION_WAIT.observe(0.0, outcome="queue_full")
+        raise AdmissionRejected(429, "queue_full", retry_after)
+
+    def _abandon(self, waiter, waited):
+        """
+        Give up on a queued waiter after its timeout. Returns True if it was
+        granted a slot in the meantime (the caller then owns that slot).
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.abandoned = True
+            self.queued -= 1
+            self.counters["timeout"] += 1
+            retry_after = self.retry_after()
+        ADMISSION_REJECTED.inc(reason="timeout")
+        ADMISSION_WAIT.observe(waited, outcome="timeout")
+        raise AdmissionRejected(503, "timeout", retry_after)
+
+    def release(self, held_sec=None):
+        wake = None
+        with self._lock:
+            if held_sec is not None:
+                prev = self._hold_ewma
+                self._hold_ewma = held_sec if prev is None else 0.8 * prev + 0.2 * held_sec
+            self.in_flight -= 1
+            while self._heap:
+                waiter = heapq.heappop(self._heap)
+                if waiter.abandoned:
+                    continue
+                waiter.granted = True
+                self.queued -= 1
+                self.in_flight += 1
+                self.counters["admitted"] += 1
+                wake = waiter.wake
+                break
+        if wake is not None:
+            wake()
+
+    # ---------------- callers ----------------
+    @contextmanager
+    def slot(self, estimated_sec, patient=False):
+        """
+        Hold an upstream slot for the with-block (blocking thread version).
+        patient: no queue cap and no queue timeout.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.monotonic()
+        event = threading.Event()
+        waiter = self._enter(estimated_sec, event.set, patient)
+        timeout = None if patient else self.queue_timeout_sec
+        if waiter is not None and not event.wait(timeout):
+            self._abandon(waiter, time.monotonic() - started)
+        admitted = time.monotonic()
+        ADMISSION_WAIT.observe(admitted - started, outcome="admitted")
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - admitted)
+
+    @asynccontextmanager
+    async def slot_async(self, estimated_sec, patient=False):
+        """
+        Same as slot() for coroutines; waiting costs no thread.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(None))
+
+        waiter = self._enter(estimated_sec, wake, patient)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), None if patient else self.queue_timeout_sec)
+            except asyncio.TimeoutError:
+                self._abandon(waiter, time.monotonic() - started)
+            except asyncio.CancelledError:
+                # Cancelled while queued: hand back a slot granted meanwhile
+                if self._release_if_granted(waiter):
+                    self.release()
+                raise
+        admitted = time.monotonic()
+        ADMISSION_WAIT.observe(admitted - started, outcome="admitted")
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - admitted)
+
+    def _release_if_granted(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.abandoned = True
+            self.queued -= 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, in_flight=self.in_flight, queued=self.queued,
+                        max_concurrent=self.max_concurrent, max_queue=self.max_queue,
+                        queue_timeout_sec=self.queue_timeout_sec,
+                        hold_ewma_sec=round(self._hold_ewma, 3) if self._hold_ewma else None)
+
+
+def estimate_audio_sec(upload):
+    """
+    Rough clip duration for prioritizing: exact for PCM WAV, else assume
+    ~16 KB/s (typical MediaRecorder opus/webm).
+    """
+    info = wav_info(upload)
+    if info is not None:
+        return info.duration_sec
+    return upload.size / 16000.0
+
+
+admission = AdmissionController()
+ADMISSION_IN_FLIGHT.set_function(lambda: admission.in_flight)
+ADMISSION_QUEUE_DEPTH.set_function(lambda: admission.queued)
@@ -0,0 +1,493 @@
+# audio.py
+"""
+Audio helpers for the webapp: PCM WAV inspection, overlapping-window
+slicing, normalization to 16 kHz mono and silence trimming. Windows and
+processing blocks are read straight from the spooled upload, so only one
+block per worker thread is ever held in memory.
+"""
+import io
+import os
+import struct
+import wave
+
+try:
+    import numpy as np
+except ImportError:  # normalization is skipped without numpy
+    np = None
+
+from uploads import Spooler
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+NORMALIZE_ENABLED = os.getenv("NORMALIZE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+NORMALIZE_SAMPLE_RATE = int(os.getenv("NORMALIZE_SAMPLE_RATE", "16000"))
+NORMALIZE_BLOCK_SEC = float(os.getenv("NORMALIZE_BLOCK_SEC", "10"))
+NORMALIZE_FILTER_TAPS = 101   # odd; anti-alias low-pass before downsampling
+
+# Voice-activity trimming (energy + zero-crossing rate per frame)
+VAD_FRAME_MS = float(os.getenv("VAD_FRAME_MS", "30"))
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "12"))        # above the estimated noise floor
+VAD_MIN_DB = float(os.getenv("VAD_MIN_DB", "-55"))             # never call quieter frames speech
+VAD_PAD_SEC = float(os.getenv("VAD_PAD_SEC", "0.25"))          # kept around every speech frame
+VAD_MIN_REMOVED_SEC = float(os.getenv("VAD_MIN_REMOVED_SEC", "0.5"))   # else send the clip as is
+
+
+class WavInfo:
+    def __init__(self, channels, sample_width, sample_rate, n_frames):
+        self.channels = channels
+        self.sample_width = sample_width
+        self.sample_rate = sample_rate
+        self.n_frames = n_frames
+
+    @property
+    def duration_sec(self):
+        return self.n_frames / float(self.sample_rate) if self.sample_rate else 0.0
+
+
+def wav_info(upload):
+    """
+    WavInfo for a PCM WAV upload, or None for anything else (webm/ogg from
+    MediaRecorder, mp3, compressed WAV, ...).
+    """
+    upload.file.seek(0)
+    if upload.file.read(4) != b"RIFF":
+        return None
+    upload.file.seek(0)
+    try:
+        with wave.open(upload.file, "rb") as w:
+            return WavInfo(w.getnchannels(), w.getsampwidth(), w.getframerate(), w.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+
+def plan_windows(n_frames, sample_rate, window_sec, overlap_sec):
+    """
+    (start_frame, end_frame) pairs covering the clip; consecutive windows
+    share overlap_sec of audio.
+    """
+    size = int(round(window_sec * sample_rate))
+    overlap = int(round(overlap_sec * sample_rate))
+    if size <= 0 or n_frames <= size:
+        return [(0, n_frames)]
+    step = max(size - overlap, 1)
+    windows = []
+    start = 0
+    while True:
+        end = min(start + size, n_frames)
+        windows.append((start, end))
+        if end >= n_frames:
+            return windows
+        start += step
+
+
+def read_window_wav(upload, start_frame, end_frame):
+    """
+    Frames [start_frame, end_frame) of a PCM WAV upload as a standalone WAV.
+    """
+    upload.file.seek(0)
+    with wave.open(upload.file, "rb") as src:
+        params = src.getparams()
+        src.setpos(start_frame)
+        frames = src.readframes(end_frame - start_frame)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as dst:
+        dst.setnchannels(params.nchannels)
+        dst.setsampwidth(params.sampwidth)
+        dst.setframerate(params.framerate)
+        dst.writeframes(frames)
+    return out.getvalue()
+
+
+# -----------------------------------------------------------------------------
+# Container detection
+# -----------------------------------------------------------------------------
+_CONTAINERS = (
+    ("wav", "audio/wav", lambda h: h[:4] in (b"RIFF", b"RF64") and h[8:12] == b"WAVE"),
+    ("webm", "audio/webm", lambda h: h[:4] == b"\x1a\x45\xdf\xa3"),
+    ("ogg", "audio/ogg", lambda h: h[:4] == b"OggS"),
+    ("flac", "audio/flac", lambda h: h[:4] == b"fLaC"),
+    ("mp4", "audio/mp4", lambda h: h[4:8] == b"ftyp"),
+    ("mp3", "audio/mpeg", lambda h: h[:3] == b"ID3" or (h[:1] == b"\xff" and h[1:2] >= b"\xe0")),
+)
+
+
+def detect_container(upload):
+    """
+    (name, mime) from the file's magic bytes; the browser's label (e.g.
+    MediaRecorder webm sent as audio/wav) is not trusted.
+    """
+    upload.file.seek(0)
+    head = upload.file.read(16)
+    for name, mime, match in _CONTAINERS:
+        if match(head):
+            return name, mime
+    return "unknown", upload.content_type or "application/octet-stream"
+
+
+# -----------------------------------------------------------------------------
+# WAV decoding
+# -----------------------------------------------------------------------------
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavLayout:
+    def __init__(self, fmt, channels, sample_rate, bits, data_offset, data_size):
+        self.format = fmt
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.bits = bits
+        self.block_align = channels * (bits // 8)
+        self.data_offset = data_offset
+        self.n_frames = data_size // self.block_align if self.block_align else 0
+
+
+def parse_wav(upload):
+    """
+    WavLayout of a PCM (8/16/24/32-bit) or IEEE float WAV, including
+    WAVE_FORMAT_EXTENSIBLE, or None. Unlike the wave module this accepts
+    float and extensible files, which browsers and DAWs commonly write.
+    """
+    f = upload.file
+    f.seek(0)
+    head = f.read(12)
+    if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return None
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        cid, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+        if cid == b"fmt ":
+            raw = f.read(size + (size & 1))
+            if len(raw) < 16:
+                return None
+            code, channels, rate, _byte_rate, _align, bits = struct.unpack("<HHIIHH", raw[:16])
+            if code == _WAVE_FORMAT_EXTENSIBLE and len(raw) >= 26:
+                code = struct.unpack("<H", raw[24:26])[0]
+            fmt = (code, channels, rate, bits)
+        elif cid == b"data":
+            if fmt is None:
+                return None
+            offset = f.tell()
+            # Streaming writers leave the size at 0 or 0xFFFFFFFF
+            available = upload.size - offset
+            if size in (0, 0xFFFFFFFF) or size > available:
+                size = available
+            code, channels, rate, bits = fmt
+            ok = ((code == _WAVE_FORMAT_PCM and bits in (8, 16, 24, 32))
+                  or (code == _WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64)))
+            if not ok or channels < 1 or rate < 1:
+                return None
+            return WavLayout(code, channels, rate, bits, offset, size)
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def _to_float(raw, layout):
+    """
+    Interleaved sample bytes -> float32 array in [-1, 1], shape (frames, channels).
+    """
+    bits = layout.bits
+    if layout.format == _WAVE_FORMAT_IEEE_FLOAT:
+        x = np.frombuffer(raw, dtype="<f4" if bits == 32 else "<f8").astype(np.float32)
+    elif bits == 8:
+        x = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif bits == 16:
+        x = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif bits == 24:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        v = np.where(v & 0x800000, v - 0x1000000, v)
+        x = v.astype(np.float32) / 8388608.0
+    else:
+        x = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    return x.reshape(-1, layout.channels)
+
+
+def _lowpass(src_rate, dst_rate, taps=NORMALIZE_FILTER_TAPS):
+    """
+    Windowed-sinc FIR for downsampling (cutoff a little under the new
+    Nyquist), or None when no filtering is needed.
+    """
+    if dst_rate >= src_rate:
+        return None
+    cutoff = 0.45 * dst_rate / src_rate        # in cycles/sample of the source
+    n = np.arange(taps) - (taps - 1) / 2.0
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+def _wav_header(n_frames, sample_rate, channels=1, bits=16, fmt=_WAVE_FORMAT_PCM):
+    align = channels * (bits // 8)
+    data_size = n_frames * align
+    return (b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, fmt, channels, sample_rate, sample_rate * align, align, bits)
+            + b"data" + struct.pack("<I", data_size))
+
+
+# -----------------------------------------------------------------------------
+# Normalization
+# -----------------------------------------------------------------------------
+def normalize_upload(upload, target_rate=NORMALIZE_SAMPLE_RATE, block_sec=NORMALIZE_BLOCK_SEC):
+    """
+    Re-encode a WAV upload as 16-bit mono PCM at target_rate (never
+    upsampling), block by block: downmix, anti-alias filter, then linear
+    interpolation onto the new sample grid, all vectorized.
+
+    Returns (upload_to_send, report). upload_to_send is a new spooled
+    upload (the caller closes it) or the original when there is nothing to
+    gain: other containers, already 16-bit mono at <= target_rate, or no
+    numpy.
+    """
+    container, mime = detect_container(upload)
+    report = {"container": container, "original_bytes": upload.size,
+              "sent_bytes": upload.size, "bytes_saved": 0}
+    if container != "wav":
+        report["action"] = "passthrough"
+        return upload, report
+    if np is None:
+        report["action"] = "no_numpy"
+        return upload, report
+    layout = parse_wav(upload)
+    if layout is None:
+        report["action"] = "unsupported_wav"
+        return upload, report
+
+    src_rate, channels = layout.sample_rate, layout.channels
+    dst_rate = min(src_rate, target_rate)
+    report.update(sample_rate_in=src_rate, channels_in=channels, bits_in=layout.bits,
+                  sample_rate_out=dst_rate)
+    if (channels == 1 and src_rate == dst_rate and layout.bits == 16
+            and layout.format == _WAVE_FORMAT_PCM):
+        report["action"] = "already_normalized"
+        return upload, report
+
+    n_in = layout.n_frames
+    n_out = (n_in - 1) * dst_rate // src_rate + 1 if n_in else 0
+    if 44 + 2 * n_out >= upload.size:
+        report["action"] = "no_gain"
+        return upload, report
+
+    h = _lowpass(src_rate, dst_rate)
+    delay = (len(h) - 1) // 2 if h is not None else 0
+    history = np.zeros(len(h) - 1 if h is not None else 0, dtype=np.float32)
+    pending = np.zeros(0, dtype=np.float32)   # filtered samples not yet interpolated past
+    pending_pos = -delay                       # source position of pending[0]
+    next_k = 0
+    block_frames = max(int(block_sec * src_rate), 1)
+
+    out = Spooler(content_type="audio/wav", filename=upload.filename)
+    try:
+        out.write(_wav_header(n_out, dst_rate))
+
+        def emit(filtered, last_pos):
+            nonlocal pending, pending_pos, next_k
+            buf = np.concatenate([pending, filtered])
+            k_max = min((last_pos * dst_rate) // src_rate if last_pos >= 0 else -1, n_out - 1)
+            if k_max >= next_k:
+                t = np.arange(next_k, k_max + 1, dtype=np.float64) * (src_rate / dst_rate)
+                y = np.interp(t, pending_pos + np.arange(len(buf)), buf)
+                pcm = np.clip(np.round(y * 32767.0), -32768, 32767).astype("<i2")
+                out.write(pcm.tobytes())
+                next_k = k_max + 1
+            # The next output position is past last_pos; keep one sample to its left
+            pending = buf[-1:]
+            pending_pos = last_pos
+
+        read = 0
+        upload.file.seek(layout.data_offset)
+        while read < n_in:
+            frames = min(block_frames, n_in - read)
+            raw = upload.file.read(frames * layout.block_align)
+            frames = len(raw) // layout.block_align
+            if frames == 0:
+                break
+            mono = _to_float(raw[:frames * layout.block_align], layout).mean(axis=1)
+            if h is not None:
+                filtered = np.convolve(np.concatenate([history, mono]), h, mode="valid")
+                history = np.concatenate([history, mono])[-(len(h) - 1):]
+            else:
+                filtered = mono
+            read += frames
+            emit(filtered.astype(np.float32), read - 1 - delay)
+        if h is not None and delay:
+            # Flush the filter so the last source samples are reached
+            tail = np.convolve(np.concatenate([history, np.zeros(delay, np.float32)]), h, mode="valid")
+            emit(tail.astype(np.float32), read - 1)
+        if next_k < n_out:
+            # Truncated data chunk: pad with silence to the promised length
+            out.write(b"\x00\x00" * (n_out - next_k))
+    except Exception:
+        out.abort()
+        raise
+
+    normalized = out.finish()
+    report.update(action="normalized", sent_bytes=normalized.size,
+                  bytes_saved=upload.size - normalized.size)
+    return normalized, report
+
+
+# -----------------------------------------------------------------------------
+# Voice-activity trimming
+# -----------------------------------------------------------------------------
+def _frame_features(upload, layout, frame_len, block_sec=NORMALIZE_BLOCK_SEC):
+    """
+    Per-frame energy (dBFS) and zero-crossing rate of the downmixed signal,
+    computed block by block with whole-array operations.
+    """
+    frames_per_block = max(int(block_sec * layout.sample_rate) // frame_len, 1)
+    energy, zcr = [], []
+    upload.file.seek(layout.data_offset)
+    remaining = layout.n_frames
+    while remaining > 0:
+        want = min(frames_per_block * frame_len, remaining)
+        raw = upload.file.read(want * layout.block_align)
+        got = len(raw) // layout.block_align
+        if got == 0:
+            break
+        remaining -= got
+        mono = _to_float(raw[:got * layout.block_align], layout).mean(axis=1)
+        if len(mono) % frame_len:
+            mono = np.concatenate([mono, np.zeros(frame_len - len(mono) % frame_len, np.float32)])
+        x = mono.reshape(-1, frame_len)
+        energy.append(10.0 * np.log10(np.mean(x * x, axis=1) + 1e-12))
+        zcr.append(np.count_nonzero(np.diff(np.signbit(x), axis=1), axis=1) / float(frame_len))
+    if not energy:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(energy), np.concatenate(zcr)
+
+
+def speech_mask(energy, zcr, frame_sec, margin_db=VAD_MARGIN_DB, min_db=VAD_MIN_DB, pad_sec=VAD_PAD_SEC):
+    """
+    Boolean speech/non-speech per frame. The threshold sits margin_db above
+    the noise floor (10th percentile energy) but at least 25 dB under the
+    peak; quieter frames with a high zero-crossing rate (fricatives like
+    "s" and "f") still count. Speech is then widened by pad_sec each side.
+    """
+    if len(energy) == 0:
+        return np.zeros(0, dtype=bool)
+    floor = np.percentile(energy, 10)
+    threshold = max(min(floor + margin_db, energy.max() - 25.0), min_db)
+    speech = (energy > threshold) | ((energy > threshold - 6.0) & (zcr > 0.25))
+    pad = int(round(pad_sec / frame_sec))
+    if pad > 0:
+        # int32: window sums past 127 would wrap negative in int8
+        speech = np.convolve(speech.astype(np.int32), np.ones(2 * pad + 1, np.int32), mode="same") > 0
+    return speech
+
+
+def _runs(mask):
+    """
+    (start, end) index pairs of the True runs in a boolean array.
+    """
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return list(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+
+
+def plan_kept_spans(speech, frame_len, n_frames, max_gap_sec=None, keep_gap_sec=0.0, sample_rate=16000):
+    """
+    Sample ranges to keep: everything from the first to the last speech
+    frame, except that internal silences longer than max_gap_sec (None =
+    keep them all) are cut down to keep_gap_sec.
+    """
+    runs = _runs(speech)
+    if not runs:
+        return []
+    spans = [[runs[0][0] * frame_len, min(runs[0][1] * frame_len, n_frames)]]
+    max_gap = None if max_gap_sec is None else int(max_gap_sec * sample_rate)
+    keep_half = int(keep_gap_sec * sample_rate) // 2
+    for start, end in runs[1:]:
+        start, end = start * frame_len, min(end * frame_len, n_frames)
+        gap = start - spans[-1][1]
+        if max_gap is None or gap <= max_gap:
+            spans[-1][1] = end
+        else:
+            # Never keep more than the gap itself, or samples would repeat
+            half = min(keep_half, gap // 2)
+            spans[-1][1] += half
+            spans.append([start - half, end])
+    return [tuple(s) for s in spans]
+
+
+def map_time(timemap, t, end=False):
+    """
+    Map a time in the trimmed audio back to the original recording.
+    timemap: [(trimmed_start_sec, original_start_sec, duration_sec), ...].
+    With end=True a time on a cut maps to the end of the span before it.
+    """
+    for out_start, orig_start, duration in timemap:
+        if t < out_start + duration or (end and t <= out_start + duration):
+            return orig_start + max(t - out_start, 0.0)
+    if not timemap:
+        return t
+    out_start, orig_start, duration = timemap[-1]
+    return orig_start + (t - out_start)
+
+
+def trim_silence(upload, max_gap_sec=None, keep_gap_sec=0.3, frame_ms=VAD_FRAME_MS,
+                 margin_db=VAD_MARGIN_DB, pad_sec=VAD_PAD_SEC, min_removed_sec=VAD_MIN_REMOVED_SEC):
+    """
+    Drop leading and trailing silence (and, with max_gap_sec, long pauses)
+    from a WAV upload. Kept sample ranges are copied byte for byte, so the
+    format is unchanged.
+
+    Returns (upload_to_send, report). report["timemap"] maps the trimmed
+    timeline back to the original (see map_time). The original upload is
+    returned when it is not WAV, has no detectable speech (sent whole rather
+    than guessing), or less than min_removed_sec would be cut.
+    """
+    report = {"seconds_in": None, "seconds_removed": 0.0}
+    if np is None:
+        report["action"] = "no_numpy"
+        return upload, report
+    layout = parse_wav(upload)
+    if layout is None:
+        report["action"] = "unsupported"
+        return upload, report
+
+    rate = layout.sample_rate
+    seconds_in = layout.n_frames / float(rate)
+    report["seconds_in"] = round(seconds_in, 3)
+    frame_len = max(int(rate * frame_ms / 1000.0), 1)
+    energy, zcr = _frame_features(upload, layout, frame_len)
+    speech = speech_mask(energy, zcr, frame_len / float(rate), margin_db=margin_db, pad_sec=pad_sec)
+    spans = plan_kept_spans(speech, frame_len, layout.n_frames, max_gap_sec, keep_gap_sec, rate)
+    if not spans:
+        report["action"] = "no_speech"
+        return upload, report
+    kept = sum(end - start for start, end in spans)
+    removed = (layout.n_frames - kept) / float(rate)
+    if removed < min_removed_sec:
+        report["action"] = "no_gain"
+        return upload, report
+
+    out = Spooler(content_type="audio/wav", filename=upload.filename)
+    timemap = []
+    try:
+        out.write(_wav_header(kept, rate, layout.channels, layout.bits, layout.format))
+        position = 0
+        for start, end in spans:
+            upload.file.seek(layout.data_offset + start * layout.block_align)
+            remaining = (end - start) * layout.block_align
+            while remaining > 0:
+                chunk = upload.file.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                out.write(chunk)
+                remaining -= len(chunk)
+            if remaining > 0:
+                out.write(b"\x00" * remaining)
+            timemap.append((round(position / float(rate), 3), round(start / float(rate), 3),
+                            round((end - start) / float(rate), 3)))
+            position += end - start
+    except Exception:
+        out.abort()
+        raise
+
+    report.update(action="trimmed", seconds_removed=round(removed, 3),
+                  seconds_out=round(kept / float(rate), 3), timemap=timemap)
+    return out.finish(), report
@@ -0,0 +1,280 @@
+# backends.py
+"""
+Transcription backend pool for the webapp.
+
+Backends come from dbapi's registry (GET /backends, polled with
+If-None-Match) plus the legacy single tunnel URL from /get_ngrok_url, which
+is kept as backend "default". Each call goes to the least-loaded healthy
+backend that serves the model; every backend has a circuit breaker fed by
+passive health (connection errors, timeouts and 5xx answers), and a
+backend whose tunnel URL changes starts over with a closed breaker.
+"""
+import os
+import random
+import threading
+import time
+
+from metrics import Counter, Gauge
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+BACKENDS_FETCH_URL = os.getenv("BACKENDS_FETCH_URL", "").strip()   # empty = derive from NGROK_FETCH_URL
+BACKENDS_REFRESH_SEC = float(os.getenv("BACKENDS_REFRESH_SEC", "10"))
+BACKEND_DEFAULT_CAPACITY = int(os.getenv("BACKEND_DEFAULT_CAPACITY", "4"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))   # consecutive failures
+BREAKER_OPEN_SEC = float(os.getenv("BREAKER_OPEN_SEC", "30"))                  # before a trial request
+BACKEND_FAILOVER_ATTEMPTS = int(os.getenv("BACKEND_FAILOVER_ATTEMPTS", "1"))   # retries on another backend
+
+DEFAULT_BACKEND_ID = "default"
+ALL_MODELS = ("transcribe", "transcribe-2step")
+
+# Breaker states
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Upstream statuses that count against a backend (the box or tunnel is unwell)
+UNHEALTHY_STATUSES = (500, 502, 503, 504)
+
+BACKEND_IN_FLIGHT = Gauge(
+    "backend_in_flight", "Upstream calls in progress per backend", ("backend",))
+BACKEND_CIRCUIT_OPEN = Gauge(
+    "backend_circuit_open", "1 while the backend's circuit breaker is open", ("backend",), mode="max")
+BACKEND_CALLS = Counter(
+    "backend_calls_total", "Upstream calls per backend by outcome (ok/failure/neutral)",
+    ("backend", "outcome"))
+BACKEND_NONE_AVAILABLE = Counter(
+    "backend_unavailable_total", "Calls that found no healthy backend for the model", ("model",))
+
+
+def _with_scheme(url):
+    base = url.strip().rstrip("/")
+    if not base.startswith(("http://", "https://")):
+        base = "https://" + base
+    return base
+
+
+class Backend:
+    def __init__(self, backend_id, url, capacity=BACKEND_DEFAULT_CAPACITY, models=ALL_MODELS):
+        self.id = backend_id
+        self.url = _with_scheme(url)
+        self.capacity = max(int(capacity or 1), 1)
+        self.models = frozenset(models or ALL_MODELS)
+        self.reported_load = 0.0       # utilization from the backend's own heartbeat, 0..1
+        self.in_flight = 0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.ewma_latency = None
+        self.counters = {"requests": 0, "ok": 0, "failures": 0, "neutral": 0, "trips": 0}
+
+    def load(self):
+        return self.in_flight / float(self.capacity)
+
+    def view(self):
+        return {
+            "id": self.id,
+            "url": self.url,
+            "capacity": self.capacity,
+            "models": sorted(self.models),
+            "in_flight": self.in_flight,
+            "reported_load": self.reported_load,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency else None,
+            **self.counters,
+        }
+
+
+class BackendPool:
+    """
+    Thread-safe routing table shared by all request threads of a worker.
+    on_change(urls) is called with every backend URL when membership or a
+    URL changes (the webapp re-targets its HTTP pool and protocol memory).
+    """
+
+    def __init__(self, on_change=None, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 open_sec=BREAKER_OPEN_SEC):
+        self.on_change = on_change
+        self.failure_threshold = failure_threshold
+        self.open_sec = open_sec
+        self._lock = threading.Lock()
+        self._backends = {}
+        self._registry = {}            # id -> (url, capacity, models, load) from dbapi
+        self._default_url = None
+        self.etag = None
+        self.counters = {"registry_fetches": 0, "registry_not_modified": 0,
+                         "registry_errors": 0, "url_changes": 0, "unavailable": 0}
+
+    # ---------------- membership ----------------
+    def set_default(self, url):
+        """
+        The legacy single tunnel URL (ngrok_url) as backend "default",
+        unless a registry entry already points at the same URL.
+        """
+        with self._lock:
+            self._default_url = url
+        self._sync()
+
+    def set_registry(self, entries):
+        """
+        Replace the registry part from dbapi's /backends answer.
+        """
+        registry = {}
+        for e in entries:
+            if not e.get("url") or not e.get("backend_id"):
+                continue
+            registry[e["backend_id"]] = (
+                e["url"], e.get("capacity") or BACKEND_DEFAULT_CAPACITY,
+                tuple(e.get("models") or ALL_MODELS), float(e.get("load") or 0.0),
+            )
+        with self._lock:
+            self._registry = registry
+        self._sync()
+
+    def _sync(self):
+        with self._lock:
+            wanted = dict(self._registry)
+            # A box that registered itself is not also the legacy "default"
+            registered = {_with_scheme(url) for url, _, _, _ in wanted.values()}
+            if (self._default_url and DEFAULT_BACKEND_ID not in wanted
+                    and _with_scheme(self._default_url) not in registered):
+                wanted[DEFAULT_BACKEND_ID] = (self._default_url, BACKEND_DEFAULT_CAPACITY, ALL_MODELS, 0.0)
+            changed = False
+            for backend_id in list(self._backends):
+                if backend_id not in wanted:
+                    # In-flight calls keep their Backend object and finish normally
+                    del self._backends[backend_id]
+                    BACKEND_CIRCUIT_OPEN.set(0, backend=backend_id)
+                    changed = True
+            for backend_id, (url, capacity, models, load) in wanted.items():
+                b = self._backends.get(backend_id)
+                if b is None:
+                    self._backends[backend_id] = b = Backend(backend_id, url, capacity, models)
+                    changed = True
+                elif b.url != _with_scheme(url):
+                    # Tunnel moved: old failures say nothing about the new URL
+                    b.url = _with_scheme(url)
+                    self._close(b)
+                    self.counters["url_changes"] += 1
+                    changed = True
+                b.capacity = max(int(capacity), 1)
+                b.models = frozenset(models)
+                b.reported_load = load
+            urls = [b.url for b in self._backends.values()]
+        if changed and self.on_change is not None:
+            self.on_change(urls)
+
+    def has_backends(self):
+        with self._lock:
+            return bool(self._backends)
+
+    # ---------------- routing ----------------
+    def _available(self, b, now):
+        if b.state == CLOSED:
+            return True
+        if b.state == OPEN and now - b.opened_at >= self.open_sec:
+            b.state = HALF_OPEN
+            b.trial_in_flight = False
+        # Half-open lets exactly one trial call through
+        return b.state == HALF_OPEN and not b.trial_in_flight
+
+    def acquire(self, model, exclude=()):
+        """
+        Least-loaded healthy backend serving model (in-flight / capacity,
+        then the backend's own reported load, then latency), or None.
+        The caller must release() it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self._backends.values()
+                          if model in b.models and b.id not in exclude and self._available(b, now)]
+            if not candidates:
+                self.counters["unavailable"] += 1
+                BACKEND_NONE_AVAILABLE.inc(model=model)
+                return None
+            random.shuffle(candidates)
+            best = min(candidates, key=lambda b: (b.load(), b.reported_load, b.ewma_latency or 0.0))
+            if best.state == HALF_OPEN:
+                best.trial_in_flight = True
+            best.in_flight += 1
+            best.counters["requests"] += 1
+        BACKEND_IN_FLIGHT.inc(backend=best.id)
+        return best
+
+    def release(self, backend, outcome, latency=None):
+        """
+        outcome: "ok", "failure" (counts toward the breaker) or "neutral"
+        (e.g. a 4xx caused by the request itself).
+        """
+        with self._lock:
+            backend.in_flight -= 1
+            backend.counters["ok" if outcome == "ok" else "failures" if outcome == "failure" else "neutral"] += 1
+            if outcome == "failure":
+                backend.consecutive_failures += 1
+                if backend.state == HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+                    if backend.state != OPEN:
+                        backend.counters["trips"] += 1
+                        print(f"Circuit open for backend {backend.id} ({backend.url})")
+                    backend.state = OPEN
+                    backend.opened_at = time.monotonic()
+                    backend.trial_in_flight = False
+            elif outcome == "ok":
+                if backend.state != CLOSED:
+                    print(f"Circuit closed for backend {backend.id}")
+                self._close(backend)
+                if latency is not None:
+                    prev = backend.ewma_latency
+                    backend.ewma_latency = latency if prev is None else 0.8 * prev + 0.2 * latency
+            elif backend.state == HALF_OPEN:
+                # The trial told us nothing; let another one through
+                backend.trial_in_flight = False
+            state = backend.state
+        BACKEND_IN_FLIGHT.dec(backend=backend.id)
+        BACKEND_CIRCUIT_OPEN.set(1 if state == OPEN else 0, backend=backend.id)
+        BACKEND_CALLS.inc(backend=backend.id, outcome=outcome)
+
+    @staticmethod
+    def _close(backend):
+        backend.state = CLOSED
+        backend.consecutive_failures = 0
+        backend.trial_in_flight = False
+
+    # ---------------- registry polling ----------------
+    def refresh(self, session, fetch_url):
+        """
+        One conditional GET of dbapi's /backends. Returns True on success.
+        """
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        with self._lock:
+            self.counters["registry_fetches"] += 1
+        try:
+            resp = session.get(fetch_url, headers=headers)
+            if resp.status_code == 304:
+                with self._lock:
+                    self.counters["registry_not_modified"] += 1
+                return True
+            resp.raise_for_status()
+            entries = resp.json().get("backends") or []
+        except Exception as e:
+            with self._lock:
+                self.counters["registry_errors"] += 1
+            print(f"Failed to fetch backend registry: {e}")
+            return False
+        self.etag = resp.headers.get("ETag")
+        self.set_registry(entries)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, backends=[b.view() for b in self._backends.values()])
+
+
+def registry_url(ngrok_fetch_url):
+    """
+    dbapi's /backends next to its /get_ngrok_url, unless BACKENDS_FETCH_URL is set.
+    """
+    if BACKENDS_FETCH_URL:
+        return BACKENDS_FETCH_URL
+    base = ngrok_fetch_url.rsplit("/get_ngrok_url", 1)[0]
+    return base.rstrip("/") + "/backends"
@@ -0,0 +1,214 @@
+# batch.py
+"""
+Bulk transcription: many clips in one call, per-item results streamed back
+as each finishes.
+
+Items come from a multipart body (one 'audio' part per clip) or from a JSON
+manifest of paths on the server, which must resolve under BATCH_ROOT_DIR
+(unset = manifests disabled). At most BATCH_CONCURRENCY items are in flight
+per batch; an item that fails with a retryable status (or a connection
+error) is retried up to BATCH_RETRIES times with exponential backoff, and a
+failed item never aborts the rest of the batch.
+"""
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from uploads import AudioUpload, MAX_UPLOAD_BYTES
+from metrics import Counter
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+BATCH_ROOT_DIR = os.getenv("BATCH_ROOT_DIR", "").strip()          # manifest paths must live here
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))       # items in flight per batch
+BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", "2"))               # extra attempts per item
+BATCH_RETRY_BACKOFF_SEC = float(os.getenv("BATCH_RETRY_BACKOFF_SEC", "1.0"))
+
+# Upstream trouble worth another attempt; 4xx answers are the item's own fault
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+BATCH_ITEMS = Counter(
+    "batch_items_total", "Batch items by final outcome (ok/failed/cancelled)", ("outcome",))
+BATCH_RETRIES_TOTAL = Counter(
+    "batch_item_retries_total", "Extra upstream attempts made for batch items", ("model",))
+
+
+class ManifestError(Exception):
+    pass
+
+
+class BatchItem:
+    """
+    One clip of a batch: an upload the batch owns, or a server-local path
+    opened only when a worker picks the item up.
+    """
+
+    def __init__(self, index, name, model, upload=None, path=None, error=None):
+        self.index = index
+        self.name = name
+        self.model = model
+        self.upload = upload
+        self.path = path
+        self.error = error           # (body, status) known before any upstream call
+
+    def open(self):
+        if self.upload is None:
+            size = os.path.getsize(self.path)
+            if size > MAX_UPLOAD_BYTES:
+                raise ManifestError(f"file exceeds {MAX_UPLOAD_BYTES} bytes")
+            self.upload = AudioUpload(open(self.path, "rb"), size, filename=os.path.basename(self.path))
+        return self.upload
+
+    def close(self):
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+
+
+def resolve_manifest_path(path, root=BATCH_ROOT_DIR):
+    """
+    Absolute path of a manifest entry, refusing anything outside root
+    (including via '..' or symlinks).
+    """
+    if not root:
+        raise ManifestError("server-local manifests are disabled (BATCH_ROOT_DIR is not set)")
+    base = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, full]) != base:
+        raise ManifestError("path is outside BATCH_ROOT_DIR")
+    if not os.path.isfile(full):
+        raise ManifestError("no such file")
+    return full
+
+
+def manifest_items(entries, model, models, root=BATCH_ROOT_DIR):
+    """
+    BatchItems for a manifest: each entry is a path or {"path", "model"}.
+    Bad entries become items that fail on their own.
+    """
+    items = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, dict):
+            path, item_model = entry.get("path"), entry.get("model") or model
+        else:
+            path, item_model = entry, model
+        name = path if isinstance(path, str) else None
+        if not isinstance(path, str) or not path:
+            items.append(BatchItem(i, name, item_model, error=({"error": "Missing path"}, 400)))
+            continue
+        if item_model not in models:
+            items.append(BatchItem(i, name, item_model, error=({"error": "Invalid model selected"}, 400)))
+            continue
+        try:
+            items.append(BatchItem(i, name, item_model, path=resolve_manifest_path(path, root)))
+        except ManifestError as e:
+            status = 404 if str(e) == "no such file" else 403
+            items.append(BatchItem(i, name, item_model, error=({"error": str(e)}, status)))
+    return items
+
+
+class BatchRun:
+    """
+    Runs handler(upload, model, options) -> (body, status) over the items
+    with bounded concurrency. Iterating yields one event dict per finished
+    item (completion order), a heartbeat after heartbeat_sec of silence,
+    and a final summary. close() (or abandoning the iterator) cancels items
+    that have not started.
+    """
+
+    def __init__(self, items, handler, options=None, concurrency=BATCH_CONCURRENCY,
+                 retries=BATCH_RETRIES, backoff_sec=BATCH_RETRY_BACKOFF_SEC, heartbeat_sec=15.0):
+        self.items = items
+        self.handler = handler
+        self.options = options or {}
+        self.retries = max(retries, 0)
+        self.backoff_sec = backoff_sec
+        self.heartbeat_sec = heartbeat_sec
+        self.cancelled = threading.Event()
+        self._events = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items) or 1)),
+                                        thread_name_prefix="batch")
+        self._futures = []
+        self.counts = {"ok": 0, "failed": 0, "cancelled": 0}
+
+    def _attempts(self, item):
+        """
+        (body, status, attempts) for one item, retrying retryable failures.
+        """
+        if item.error is not None:
+            return item.error[0], item.error[1], 0
+        try:
+            upload = item.open()
+        except (OSError, ManifestError) as e:
+            return {"error": f"Cannot read {item.name}: {e}"}, 400, 0
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                body, status = self.handler(upload, item.model, self.options)
+            except Exception as e:
+                body, status = {"error": f"Unexpected server error: {e}"}, 500
+            if status not in RETRYABLE_STATUSES or attempt > self.retries:
+                return body, status, attempt
+            BATCH_RETRIES_TOTAL.inc(model=item.model)
+            delay = self.backoff_sec * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            if isinstance(body, dict) and body.get("retry_after"):
+                # Admission control said when a slot is likely free
+                delay = max(delay, float(body["retry_after"]))
+            if self.cancelled.wait(delay):
+                return body, status, attempt
+
+    def _run(self, item):
+        started = time.monotonic()
+        try:
+            if self.cancelled.is_set():
+                body, status, attempts = {"error": "Batch cancelled"}, 499, 0
+            else:
+                body, status, attempts = self._attempts(item)
+        finally:
+            item.close()
+        event = {
+            "event": "item",
+            "index": item.index,
+            "name": item.name,
+            "model": item.model,
+            "status": status,
+            "attempts": attempts,
+            "elapsed_ms": int((time.monotonic() - started) * 1000),
+        }
+        event.update(body)
+        self._events.put(event)
+
+    def __iter__(self):
+        started = time.monotonic()
+        try:
+            for item in self.items:
+                self._futures.append(self._pool.submit(self._run, item))
+            for _ in range(len(self.items)):
+                while True:
+                    try:
+                        event = self._events.get(timeout=self.heartbeat_sec)
+                        break
+                    except queue.Empty:
+                        yield {"event": "heartbeat"}
+                outcome = "ok" if event["status"] < 400 else "cancelled" if event["status"] == 499 else "failed"
+                self.counts[outcome] += 1
+                BATCH_ITEMS.inc(outcome=outcome)
+                yield event
+            yield dict(self.counts, event="summary", total=len(self.items),
+                       elapsed_ms=int((time.monotonic() - started) * 1000))
+        finally:
+            self.close()
+
+    def close(self):
+        self.cancelled.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        # Items whose worker never ran still own an upload
+        for i, item in enumerate(self.items):
+            if i >= len(self._futures) or self._futures[i].cancelled():
+                item.close()
@@ -0,0 +1,158 @@
+"""
+Concurrency vs memory: Flask (thread per waiting request) against the
+asyncio mode (webapp_async, one coroutine per waiting request).
+
+Starts fake_backend.py with a fixed upstream latency, then for each server
+mode and each concurrency level fires that many simultaneous
+/transcribe-audio calls and records completion rate, latency, peak RSS and
+peak thread count of the server process tree.
+
+    python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --levels 50,200,800 --latency 5 --flask gunicorn
+
+Needs: aiohttp, uvicorn (async mode), gunicorn (only for --flask gunicorn).
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, HERE)
+
+from loadgen import MemorySampler, free_port, make_wav, percentile, wait_ready  # noqa: E402
+
+
+def _threads(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class ThreadSampler(MemorySampler):
+    """
+    MemorySampler that also keeps the peak thread count of the tree.
+    """
+
+    def __init__(self, pids, interval=0.2):
+        super().__init__(pids, interval)
+        self.peak_threads = 0
+
+    def sample(self):
+        super().sample()
+        threads = sum(_threads(p) for pid in self.pids for p in self._tree(pid))
+        self.peak_threads = max(self.peak_threads, threads)
+
+
+def start_server(mode, port, backend_url, args):
+    env = dict(os.environ, NGROK_URL=backend_url, PORT=str(port), RESULT_CACHE_ENABLED="0",
+               UPSTREAM_POOL_MAXSIZE=str(max(args.levels)))
+    if mode == "async":
+        cmd = [sys.executable, "-m", "uvicorn", "webapp_async:app", "--port", str(port),
+               "--log-level", "warning", "--backlog", "4096"]
+    elif args.flask == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-k", "gthread", "-w", str(args.workers),
+               "--threads", str(args.threads), "--backlog", "4096", "-b", f"127.0.0.1:{port}", "webapp:app"]
+    else:
+        cmd = [sys.executable, "webapp.py"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_ready(f"http://127.0.0.1:{port}/get_ngrok_url")
+    return proc
+
+
+async def burst(url, n, clip, timeout):
+    connector = aiohttp.TCPConnector(limit=n)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as client:
+        async def one(i):
+            # Distinct bytes per request so nothing is coalesced
+            form = aiohttp.FormData()
+            form.add_field("model", "transcribe")
+            form.add_field("audio", clip[:44] + i.to_bytes(8, "little") + clip[52:],
+                           filename="clip.wav", content_type="audio/wav")
+            t0 = time.perf_counter()
+            try:
+                async with client.post(url, data=form) as r:
+                    await r.read()
+                    status = r.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            return status, time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(n)))
+        return results, time.perf_counter() - t0
+
+
+def run_level(url, pid, n, clip, timeout):
+    sampler = ThreadSampler([pid]).start()
+    results, elapsed = asyncio.run(burst(url, n, clip, timeout))
+    sampler.stop()
+    ok = sorted(lat for status, lat in results if status == 200)
+    return {
+        "ok": len(ok),
+        "elapsed": elapsed,
+        "p50": percentile(ok, 50),
+        "p99": percentile(ok, 99),
+        "rss_mb": sampler.peak[pid] / 1024.0,
+        "threads": sampler.peak_threads,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--levels", default="25,100,200,400", help="concurrency levels")
+    ap.add_argument("--latency", type=float, default=2.0, help="fake upstream latency (s)")
+    ap.add_argument("--clip-sec", type=float, default=2.0)
+    ap.add_argument("--modes", default="flask,async")
+    ap.add_argument("--flask", choices=("werkzeug", "gunicorn"), default="werkzeug")
+    ap.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    ap.add_argument("--threads", type=int, default=32, help="gunicorn threads per worker")
+    ap.add_argument("--timeout", type=float, default=300.0)
+    args = ap.parse_args()
+    args.levels = [int(x) for x in args.levels.split(",")]
+
+    backend_port = free_port()
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    backend = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_backend.py"),
+                                "--port", str(backend_port), "--latency", f"fixed:{args.latency}"],
+                               stderr=subprocess.DEVNULL)
+    clip = make_wav(args.clip_sec)
+    rows = []
+    try:
+        wait_ready(f"{backend_url}/stats")
+        for mode in args.modes.split(","):
+            port = free_port()
+            server = start_server(mode, port, backend_url, args)
+            try:
+                url = f"http://127.0.0.1:{port}/transcribe-audio"
+                run_level(url, server.pid, 4, clip, args.timeout)      # warm-up
+                for n in args.levels:
+                    rows.append((mode, n, run_level(url, server.pid, n, clip, args.timeout)))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        backend.terminate()
+        backend.wait()
+
+    flask_label = "flask" if args.flask == "werkzeug" else f"flask/gunicorn {args.workers}x{args.threads}"
+    print(f"upstream latency {args.latency}s, clip {args.clip_sec}s")
+    print(f"  {'mode':<24}{'conc':>6}{'ok':>6}{'wall s':>8}{'p50 ms':>9}{'p99 ms':>9}{'peak MiB':>10}{'threads':>9}")
+    for mode, n, r in rows:
+        label = flask_label if mode == "flask" else "async (uvicorn)"
+        print(f"  {label:<24}{n:>6}{r['ok']:>6}{r['elapsed']:>8.2f}{r['p50'] * 1000:>9.0f}"
+              f"{r['p99'] * 1000:>9.0f}{r['rss_mb']:>10.1f}{r['threads']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Requests/sec of dbapi's /get_ngrok_url, before and after the pooled client.
+
+"before" rebuilds a MongoClient and pings on every call (the old
+get_collection()); "after" uses the pooled client plus the TTL cache.
+
+    python benchmarks/bench_dbapi.py                      # mongomock stand-in
+    python benchmarks/bench_dbapi.py --mongo-uri mongodb://localhost:27017
+
+Needs: httpx (FastAPI TestClient) and, without --mongo-uri, mongomock.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def run(client, requests_total, concurrency):
+    def one(_):
+        r = client.get("/get_ngrok_url")
+        assert r.status_code == 200, r.text
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_total)))
+    return requests_total / (time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mongo-uri", help="local mongod URI; omit to use mongomock")
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    os.environ.setdefault("MONGODB_HEALTH_CHECK_SEC", "0")
+    os.environ["MONGODB_URI"] = args.mongo_uri or "mongodb://localhost:27017"
+    os.environ.setdefault("MONGODB_DB", "bench_dbapi")
+
+    import dbapi
+    from fastapi import HTTPException
+    from fastapi.testclient import TestClient
+
+    if not args.mongo_uri:
+        import functools
+        import mongomock
+        from mongomock.store import ServerStore
+        # Share one in-memory server between the per-call clients of "before"
+        dbapi.MongoClient = functools.partial(mongomock.MongoClient, _store=ServerStore())
+
+    pooled_get_collection = dbapi.get_collection
+
+    def legacy_get_collection():
+        # Verbatim behaviour of the pre-pooling helper
+        try:
+            client = dbapi.MongoClient(dbapi.MONGODB_URI, serverSelectionTimeoutMS=5000)
+            _ = client.admin.command("ping")
+            return client[dbapi.DB_NAME][dbapi.COLL_NAME]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Mongo connection failed: {e}")
+
+    with TestClient(dbapi.app) as client:
+        client.post("/set_ngrok_url", json={"ngrok_url": "https://bench.ngrok-free.app"})
+
+        dbapi.get_collection = legacy_get_collection
+        dbapi.NGROK_CACHE_TTL_SEC = 0
+        before = run(client, args.requests, args.concurrency)
+
+        dbapi.get_collection = pooled_get_collection
+        dbapi.invalidate_ngrok_url_cache()
+        pooled = run(client, args.requests, args.concurrency)
+
+        dbapi.NGROK_CACHE_TTL_SEC = float(os.getenv("NGROK_CACHE_TTL_SEC", "5"))
+        cached = run(client, args.requests, args.concurrency)
+
+    backend = args.mongo_uri or "mongomock"
+    print(f"backend={backend} requests={args.requests} concurrency={args.concurrency}")
+    print(f"  before (client+ping per call): {before:9.1f} req/s")
+    print(f"  after  (pooled client)       : {pooled:9.1f} req/s")
+    print(f"  after  (pooled + TTL cache)  : {cached:9.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Requests/sec and bytes per response of the UI page (/), before and after
+the precompiled, precompressed page.
+
+"before" is the old index(): render_template_string(HTML_TEMPLATE) on
+every request, uncompressed. "after" is the cached page for several
+clients: no compression, gzip, br, and a revalidation with If-None-Match
+(304).
+
+    python benchmarks/bench_ui.py                     # in-process (Flask test client)
+    python benchmarks/bench_ui.py --url http://127.0.0.1:5000   # a running server over HTTP
+
+Needs: flask (and requests for --url).
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCENARIOS = (
+    # (label, path, headers, needs etag)
+    ("after, identity", "/", {"Accept-Encoding": "identity"}, False),
+    ("after, gzip", "/", {"Accept-Encoding": "gzip, deflate"}, False),
+    ("after, br", "/", {"Accept-Encoding": "gzip, deflate, br"}, False),
+    ("after, 304 revalidate", "/", {"Accept-Encoding": "gzip, deflate, br"}, True),
+)
+
+
+def run(get, path, headers, requests_total, concurrency):
+    """
+    (requests/sec, body bytes per response, status) for one scenario.
+    """
+    sizes = []
+
+    def one(_):
+        status, body = get(path, headers)
+        sizes.append(len(body))
+        return status
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = set(pool.map(one, range(requests_total)))
+    rps = requests_total / (time.perf_counter() - t0)
+    return rps, sum(sizes) / float(len(sizes)), ",".join(str(s) for s in sorted(statuses))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="base URL of a running webapp; omit to run in-process")
+    ap.add_argument("--requests", type=int, default=3000)
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    scenarios = list(SCENARIOS)
+    if args.url:
+        import threading
+        import requests
+        local = threading.local()
+
+        def get(path, headers):
+            session = getattr(local, "session", None)
+            if session is None:
+                session = local.session = requests.Session()
+            # stream + raw read: measure the bytes on the wire, undecoded
+            r = session.get(args.url.rstrip("/") + path, headers=headers, stream=True)
+            return r.status_code, r.raw.read(decode_content=False)
+
+        etag_headers = {"Accept-Encoding": "gzip, deflate, br"}
+        etag = requests.get(args.url.rstrip("/") + "/", headers=etag_headers).headers.get("ETag")
+    else:
+        os.environ.setdefault("NGROK_URL", "http://127.0.0.1:9")
+        os.environ.setdefault("BACKENDS_REFRESH_SEC", "0")
+        import webapp
+        from flask import render_template_string
+
+        def legacy_index():
+            return render_template_string(webapp.HTML_TEMPLATE)
+        webapp.app.add_url_rule("/__legacy_index", "legacy_index", legacy_index)
+        client = webapp.app.test_client()
+
+        def get(path, headers):
+            r = client.get(path, headers=headers)
+            return r.status_code, r.data
+
+        scenarios.insert(0, ("before, render per request", "/__legacy_index", {}, False))
+        etag = client.get("/", headers={"Accept-Encoding": "gzip, deflate, br"}).headers.get("ETag")
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"{'HTTP ' + args.url if args.url else 'in-process'}")
+    print(f"  {'scenario':<30}{'req/s':>10}{'bytes/resp':>12}{'status':>8}")
+    for label, path, headers, conditional in scenarios:
+        headers = dict(headers, **({"If-None-Match": etag} if conditional else {}))
+        rps, size, status = run(get, path, headers, args.requests, args.concurrency)
+        print(f"  {label:<30}{rps:>10.0f}{size:>12.0f}{status:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Stand-in for the GPU transcription box and the ngrok URL service, so the
+webapp proxy path can be load-tested on a plain Linux machine.
+
+Serves POST /transcribe and /transcribe-2step (JSON and/or form bodies with
+audio_base64, same as the real service), GET /get_ngrok_url (with ETag /
+304 like dbapi) and GET /stats.
+
+    python benchmarks/fake_backend.py --port 8765
+    python benchmarks/fake_backend.py --latency lognormal:0.4,0.5 \\
+        --latency transcribe-2step=lognormal:1.5,0.4 --per-audio-sec 0.02 \\
+        --error-rate 0.01 --accept form
+
+Latency specs: fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA
+(seconds). --per-audio-sec adds that many seconds per second of PCM WAV
+audio (other containers count as 1 s per 32 KiB). Stdlib only.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import math
+import random
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+MODELS = {"/transcribe": "transcribe", "/transcribe-2step": "transcribe-2step"}
+
+
+def parse_latency(spec):
+    """
+    "lognormal:0.4,0.5" -> zero-argument sampler returning seconds.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise argparse.ArgumentTypeError(f"unknown latency distribution {spec!r}")
+
+
+def audio_seconds(raw):
+    if raw[:4] == b"RIFF":
+        try:
+            with wave.open(io.BytesIO(raw), "rb") as w:
+                return w.getnframes() / float(w.getframerate())
+        except (wave.Error, EOFError):
+            pass
+    return len(raw) / 32768.0
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def bump(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def view(self):
+        with self.lock:
+            return dict(counts=dict(self.counts), in_flight=self.in_flight,
+                        max_in_flight=self.max_in_flight)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default listen backlog of 5 drops connection bursts
+    request_queue_size = 1024
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    config = None   # argparse namespace, set in main()
+    stats = None
+
+    def log_message(self, *args):
+        if self.config.verbose:
+            super().log_message(*args)
+
+    def _send_json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(status)
+        if obj is not None:
+            self.send_header("Content-Type", "application/json")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(parts)
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/get_ngrok_url":
+            self.stats.bump("get_ngrok_url")
+            url = self.config.ngrok_url or f"http://{self.config.host}:{self.config.port}"
+            etag = '"' + hashlib.sha1(url.encode()).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self._send_json(304, None, {"ETag": etag})
+            else:
+                self._send_json(200, {"ngrok_url": url}, {"ETag": etag})
+        elif path == "/stats":
+            self._send_json(200, self.stats.view())
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        model = MODELS.get(path)
+        body = self._read_body()
+        if model is None:
+            self._send_json(404, {"detail": "Not Found"})
+            return
+
+        ctype = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        encoding = "json" if ctype == "application/json" else "form"
+        if self.config.accept != "both" and encoding != self.config.accept:
+            self.stats.bump(f"{model}:rejected_{encoding}")
+            self._send_json(415, {"detail": f"{encoding} bodies not accepted"})
+            return
+        try:
+            if encoding == "json":
+                params = json.loads(body)
+            else:
+                params = {k: v[0] for k, v in parse_qs(body.decode("ascii")).items()}
+            raw = base64.b64decode(params.get("audio_base64") or "")
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"detail": f"bad body: {e}"})
+            return
+
+        self.stats.enter()
+        try:
+            seconds = audio_seconds(raw)
+            sampler = self.config.latency.get(model) or self.config.latency[None]
+            time.sleep(sampler() + seconds * self.config.per_audio_sec)
+            if random.random() < self.config.error_rate:
+                self.stats.bump(f"{model}:error")
+                self._send_json(self.config.error_status, {"detail": "injected failure"})
+                return
+            self.stats.bump(f"{model}:ok")
+            digest = hashlib.md5(raw).hexdigest()[:12]
+            words = max(1, int(seconds * self.config.words_per_sec))
+            text = " ".join(f"w{digest}-{i}" for i in range(words))
+            if model == "transcribe":
+                self._send_json(200, {"text": text})
+            else:
+                segments = [{"text": f"en{digest}-{i}"} for i in range(words)]
+                self._send_json(200, {"text": text, "segments": segments})
+        finally:
+            self.stats.leave()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", action="append", default=[],
+                    help="[MODEL=]SPEC, repeatable (default fixed:0.2 for every model)")
+    ap.add_argument("--per-audio-sec", type=float, default=0.0,
+                    help="extra seconds of latency per second of audio")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=500)
+    ap.add_argument("--accept", choices=("both", "json", "form"), default="both",
+                    help="body encodings accepted; the other gets a 415")
+    ap.add_argument("--words-per-sec", type=float, default=2.5)
+    ap.add_argument("--ngrok-url", help="URL served by /get_ngrok_url (default: this server)")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    latency = {None: parse_latency("fixed:0.2")}
+    for item in args.latency:
+        model, sep, spec = item.rpartition("=")
+        latency[model if sep else None] = parse_latency(spec)
+    args.latency = latency
+
+    Handler.config = args
+    Handler.stats = Stats()
+    server = Server((args.host, args.port), Handler)
+    print(f"fake backend on http://{args.host}:{args.port} (accept={args.accept})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
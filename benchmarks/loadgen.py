@@ -0,0 +1,393 @@
+"""
+Load generator for webapp.py (and dbapi.py's /get_ngrok_url).
+
+Replays a weighted mix of models and clip lengths at a fixed concurrency
+and reports p50/p95/p99 latency, throughput, error rates and the resident
+memory of the server processes.
+
+    # everything local: spawns fake_backend.py + webapp.py on free ports
+    python benchmarks/loadgen.py --spawn --concurrency 16 --duration 30
+
+    # an already running webapp (memory of every process matching "webapp")
+    python benchmarks/loadgen.py --target http://127.0.0.1:5000 --pid-match webapp \\
+        --mix transcribe:5:3,transcribe-2step:60:1 --mode stream
+
+    # dbapi URL lookups
+    python benchmarks/loadgen.py --target http://127.0.0.1:8000 --scenario ngrok-url
+
+--mix is MODEL:CLIP_SECONDS:WEIGHT,... Clips are 16 kHz mono PCM WAV noise,
+made unique per request so the result cache does not hide the upstream path
+(--repeat to allow cache hits). Needs: requests.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+
+# -----------------------------------------------------------------------------
+# Workload
+# -----------------------------------------------------------------------------
+def parse_mix(spec):
+    mix = []
+    for item in spec.split(","):
+        model, seconds, weight = (item.split(":") + ["1"])[:3]
+        mix.append((model, float(seconds), float(weight)))
+    return mix
+
+
+def make_wav(seconds, sample_rate=16000):
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(os.urandom(int(seconds * sample_rate) * 2))
+    return out.getvalue()
+
+
+class Workload:
+    def __init__(self, mix, unique=True):
+        self.mix = mix
+        self.weights = [w for _, _, w in mix]
+        self.clips = {seconds: make_wav(seconds) for _, seconds, _ in mix}
+        self.unique = unique
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        model, seconds, _ = random.choices(self.mix, weights=self.weights)[0]
+        clip = self.clips[seconds]
+        if self.unique:
+            with self._lock:
+                self._seq += 1
+                seq = self._seq
+            # Overwrite the first samples after the 44-byte header with a counter
+            clip = clip[:44] + seq.to_bytes(8, "little") + clip[52:]
+        return model, seconds, clip
+
+
+# -----------------------------------------------------------------------------
+# Process memory (Linux /proc)
+# -----------------------------------------------------------------------------
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _children(pid):
+    kids = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                kids.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return kids
+
+
+def find_pids(pattern):
+    own = os.getpid()
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit() or int(name) == own:
+            continue
+        try:
+            with open(f"/proc/{name}/cmdline", "rb") as f:
+                cmd = f.read().replace(b"\0", b" ").decode(errors="replace")
+        except OSError:
+            continue
+        if pattern in cmd and "loadgen.py" not in cmd:
+            pids.append(int(name))
+    return pids
+
+
+class MemorySampler:
+    """
+    Samples VmRSS of the given pids and their children (gunicorn workers)
+    every interval seconds; keeps the peak and the last total per root pid.
+    """
+
+    def __init__(self, pids, interval=0.5):
+        self.pids = list(pids)
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _tree(self, pid):
+        seen, todo = [], [pid]
+        while todo:
+            p = todo.pop()
+            seen.append(p)
+            todo.extend(_children(p))
+        return seen
+
+    def sample(self):
+        for pid in self.pids:
+            procs = self._tree(pid)
+            total = sum(_rss_kb(p) or 0 for p in procs)
+            self.last[pid] = (total, len(procs))
+            self.peak[pid] = max(self.peak.get(pid, 0), total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self.pids:
+            self.sample()
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self.pids:
+            self.sample()
+
+
+# -----------------------------------------------------------------------------
+# Requests
+# -----------------------------------------------------------------------------
+def transcribe_call(session, target, mode, timeout):
+    def call(model, clip):
+        files = {"audio": ("clip.wav", clip, "audio/wav")}
+        r = session.post(f"{target}/transcribe-audio", params={"mode": mode},
+                         data={"model": model}, files=files, timeout=timeout, stream=(mode == "stream"))
+        if mode != "stream":
+            return r.status_code, len(r.content)
+        # The stream always answers 200; the final event carries the real status
+        status, size = r.status_code, 0
+        for line in r.iter_lines():
+            size += len(line)
+            if line:
+                event = json.loads(line)
+                if event.get("event") in ("final", "error"):
+                    status = event.get("status", 200)
+        return status, size
+    return call
+
+
+def ngrok_url_call(session, target, timeout):
+    def call(_model, _clip):
+        r = session.get(f"{target}/get_ngrok_url", timeout=timeout)
+        return r.status_code, len(r.content)
+    return call
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float("nan")
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_load(call, workload, concurrency, total_requests, duration, scenario):
+    results = []                      # (model, clip_seconds, status, latency)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration if duration else None
+    issued = [0]
+
+    def worker():
+        session_results = []
+        while True:
+            with lock:
+                if total_requests and issued[0] >= total_requests:
+                    break
+                issued[0] += 1
+            if deadline and time.perf_counter() >= deadline:
+                break
+            if scenario == "ngrok-url":
+                model, seconds, clip = "get_ngrok_url", 0.0, None
+            else:
+                model, seconds, clip = workload.next()
+            t0 = time.perf_counter()
+            try:
+                status, _size = call(model, clip)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            session_results.append((model, seconds, status, time.perf_counter() - t0))
+        with lock:
+            results.extend(session_results)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return results, time.perf_counter() - t0
+
+
+def summarize(results, elapsed):
+    groups = {"all": results}
+    for r in results:
+        groups.setdefault(r[0], []).append(r)
+    summary = {}
+    for name, rows in groups.items():
+        ok = sorted(lat for _, _, status, lat in rows if status == 200)
+        errors = {}
+        for _, _, status, _ in rows:
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        summary[name] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "error_rate": round(1 - len(ok) / len(rows), 4) if rows else 0.0,
+            "errors": errors,
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "audio_sec_per_sec": round(sum(s for _, s, st, _ in rows if st == 200) / elapsed, 2),
+            "p50_ms": round(percentile(ok, 50) * 1000, 1),
+            "p95_ms": round(percentile(ok, 95) * 1000, 1),
+            "p99_ms": round(percentile(ok, 99) * 1000, 1),
+            "max_ms": round(ok[-1] * 1000, 1) if ok else float("nan"),
+        }
+    return summary
+
+
+# -----------------------------------------------------------------------------
+# Local stack (--spawn)
+# -----------------------------------------------------------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} did not come up within {timeout}s")
+
+
+def spawn_stack(args):
+    backend_port, web_port = free_port(), free_port()
+    backend = f"http://127.0.0.1:{backend_port}"
+    backend_cmd = [sys.executable, os.path.join(HERE, "fake_backend.py"), "--port", str(backend_port),
+                   "--accept", args.backend_accept, "--error-rate", str(args.backend_error_rate)]
+    for spec in args.backend_latency:
+        backend_cmd += ["--latency", spec]
+    procs = [subprocess.Popen(backend_cmd)]
+    wait_ready(f"{backend}/stats")
+
+    env = dict(os.environ, PORT=str(web_port), NGROK_FETCH_URL=f"{backend}/get_ngrok_url")
+    env.pop("NGROK_URL", None)
+    if args.workers > 1:
+        web_cmd = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "--threads", "8",
+                   "-b", f"127.0.0.1:{web_port}", "webapp:app"]
+    else:
+        web_cmd = [sys.executable, "webapp.py"]
+    quiet = None if args.verbose else subprocess.DEVNULL
+    web = subprocess.Popen(web_cmd, cwd=ROOT, env=env, stdout=quiet, stderr=quiet)
+    procs.append(web)
+    target = f"http://127.0.0.1:{web_port}"
+    wait_ready(f"{target}/get_ngrok_url")
+    return target, web.pid, procs
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--target", default="http://127.0.0.1:5000", help="base URL of webapp or dbapi")
+    ap.add_argument("--scenario", choices=("transcribe", "ngrok-url"), default="transcribe")
+    ap.add_argument("--mode", choices=("sync", "stream"), default="sync",
+                    help="/transcribe-audio response mode")
+    ap.add_argument("--mix", default="transcribe:5:3,transcribe-2step:20:1")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=0, help="stop after N requests")
+    ap.add_argument("--duration", type=float, default=20.0, help="stop after N seconds (0 = no limit)")
+    ap.add_argument("--timeout", type=float, default=300.0)
+    ap.add_argument("--repeat", action="store_true", help="reuse identical clips (exercises the result cache)")
+    ap.add_argument("--pid", type=int, action="append", default=[], help="server pid to sample RSS of")
+    ap.add_argument("--pid-match", help="sample RSS of processes whose command line contains this")
+    ap.add_argument("--json", action="store_true", help="print the summary as JSON")
+    spawn = ap.add_argument_group("--spawn (local fake backend + webapp)")
+    spawn.add_argument("--spawn", action="store_true")
+    spawn.add_argument("--workers", type=int, default=1, help=">1 runs webapp under gunicorn")
+    spawn.add_argument("--backend-latency", action="append", default=[], help="passed to fake_backend --latency")
+    spawn.add_argument("--backend-accept", choices=("both", "json", "form"), default="both")
+    spawn.add_argument("--backend-error-rate", type=float, default=0.0)
+    spawn.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+    if not args.requests and not args.duration:
+        ap.error("set --requests and/or --duration")
+
+    procs = []
+    pids = list(args.pid)
+    if args.spawn:
+        args.target, web_pid, procs = spawn_stack(args)
+        pids.append(web_pid)
+    if args.pid_match:
+        pids.extend(find_pids(args.pid_match))
+
+    try:
+        workload = Workload(parse_mix(args.mix), unique=not args.repeat)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if args.scenario == "ngrok-url":
+            call = ngrok_url_call(session, args.target, args.timeout)
+        else:
+            call = transcribe_call(session, args.target, args.mode, args.timeout)
+
+        sampler = MemorySampler(pids).start()
+        results, elapsed = run_load(call, workload, args.concurrency, args.requests,
+                                    args.duration, args.scenario)
+        sampler.stop()
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+
+    summary = summarize(results, elapsed)
+    memory = {str(pid): {"rss_peak_mb": round(sampler.peak[pid] / 1024, 1),
+                         "rss_last_mb": round(sampler.last[pid][0] / 1024, 1),
+                         "processes": sampler.last[pid][1]}
+              for pid in sampler.peak}
+    if args.json:
+        print(json.dumps({"target": args.target, "concurrency": args.concurrency,
+                          "elapsed_sec": round(elapsed, 2), "results": summary, "memory": memory}, indent=2))
+        return
+
+    print(f"target={args.target} scenario={args.scenario} mode={args.mode} "
+          f"concurrency={args.concurrency} elapsed={elapsed:.1f}s")
+    print(f"  {'group':<18}{'reqs':>7}{'err%':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in summary.items():
+        print(f"  {name:<18}{s['requests']:>7}{s['error_rate'] * 100:>7.1f}{s['throughput_rps']:>9.2f}"
+              f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+        if s["errors"]:
+            print(f"  {'':<18}errors: {s['errors']}")
+    for pid, m in memory.items():
+        print(f"  memory pid={pid} ({m['processes']} procs): peak {m['rss_peak_mb']} MiB, "
+              f"last {m['rss_last_mb']} MiB")
+
+
+if __name__ == "__main__":
+    main()
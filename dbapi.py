@@ -1,12 +1,27 @@
+import asyncio
+import base64
+import hashlib
+import json
 import os
-from typing import Optional
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
 
 import requests  # only if you later proxy calls; safe to keep/remove
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, AnyHttpUrl
-from pymongo import MongoClient
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, AnyHttpUrl, Field
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument
 from pymongo.collection import Collection
+from pymongo.errors import OperationFailure, PyMongoError
+
+import metrics
+from metrics import Counter, Gauge, Histogram
 
 # -------------------- Config --------------------
 MONGODB_URI = os.getenv(
@@ -15,9 +30,116 @@ MONGODB_URI = os.getenv(
 )
 DB_NAME = os.getenv("MONGODB_DB", "my_database")
 COLL_NAME = os.getenv("MONGODB_COLL", "ngrok_tunnels")
+BACKENDS_COLL_NAME = os.getenv("MONGODB_BACKENDS_COLL", "transcription_backends")
+HISTORY_COLL_NAME = os.getenv("MONGODB_HISTORY_COLL", "transcription_history")
+
+# One MongoClient per process; its connection pool is shared by all requests
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+# Background ping interval in seconds (0 disables the health checker)
+MONGODB_HEALTH_CHECK_SEC = float(os.getenv("MONGODB_HEALTH_CHECK_SEC", "30"))
+# How long fetch_ngrok_url() may answer from memory (0 disables the cache)
+NGROK_CACHE_TTL_SEC = float(os.getenv("NGROK_CACHE_TTL_SEC", "5"))
+# Backends without a heartbeat for this long are not listed...
+BACKEND_TTL_SEC = float(os.getenv("BACKEND_TTL_SEC", "60"))
+# ...and Mongo deletes their record (TTL index) after this long
+BACKEND_EXPIRE_SEC = int(os.getenv("BACKEND_EXPIRE_SEC", "3600"))
+DEFAULT_MODELS = ["transcribe", "transcribe-2step"]
+# Transcription history: records per bulk insert, items per page
+HISTORY_MAX_BATCH = int(os.getenv("HISTORY_MAX_BATCH", "500"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "200"))
+# /watch_ngrok_url: longest a long-poll is held, and the SSE keep-alive
+NGROK_WATCH_MAX_SEC = float(os.getenv("NGROK_WATCH_MAX_SEC", "60"))
+NGROK_WATCH_HEARTBEAT_SEC = float(os.getenv("NGROK_WATCH_HEARTBEAT_SEC", "15"))
+# Without change streams (standalone Mongo), writes made by other dbapi
+# processes are picked up by polling this often (0 = this process's own only)
+NGROK_WATCH_POLL_SEC = float(os.getenv("NGROK_WATCH_POLL_SEC", "5"))
+
+# -------------------- Metrics -------------------
+HTTP_LATENCY = Histogram(
+    "dbapi_request_duration_seconds", "Request latency by route", ("route", "method", "status"))
+HTTP_IN_FLIGHT = Gauge(
+    "dbapi_requests_in_flight", "Requests currently being handled")
+NGROK_URL_LOOKUPS = Counter(
+    "dbapi_ngrok_url_lookups_total", "fetch_ngrok_url() answers by source", ("source",))
+MONGO_UP = Gauge(
+    "dbapi_mongo_up", "1 if the last background Mongo ping succeeded", mode="min")
+MONGO_UP.set_function(lambda: None if mongo_health["ok"] is None else float(mongo_health["ok"]))
+NGROK_WATCHERS = Gauge(
+    "dbapi_ngrok_url_watchers", "Long-polls and SSE streams waiting on /watch_ngrok_url")
+NGROK_VERSIONS_SEEN = Counter(
+    "dbapi_ngrok_url_versions_total", "Newer tunnel versions learned, by source (local/change_stream/poll/read)",
+    ("source",))
+HISTORY_INSERTED = Counter(
+    "dbapi_history_records_total", "Transcription history records inserted")
+
+# -------------------- Mongo client --------------
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+# Result of the last background ping, reported by the health route
+mongo_health = {"ok": None, "checked_at": 0.0, "error": None}
+_health_stop = threading.Event()
+
+def get_client() -> MongoClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGODB_URI,
+                    serverSelectionTimeoutMS=5000,
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                )
+    return _client
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def check_mongo_health() -> bool:
+    try:
+        get_client().admin.command("ping")
+        mongo_health.update(ok=True, checked_at=time.time(), error=None)
+    except Exception as e:
+        mongo_health.update(ok=False, checked_at=time.time(), error=str(e))
+        print(f"Mongo health check failed: {e}")
+    return bool(mongo_health["ok"])
+
+def _health_check_loop():
+    while not _health_stop.wait(MONGODB_HEALTH_CHECK_SEC):
+        check_mongo_health()
+
+def start_health_checker():
+    if MONGODB_HEALTH_CHECK_SEC <= 0:
+        return
+    _health_stop.clear()
+    threading.Thread(target=_health_check_loop, daemon=True).start()
 
 # -------------------- App -----------------------
-app = FastAPI(title="Ngrok URL Service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Build the pooled client once at startup instead of per request
+    try:
+        get_client()
+        check_mongo_health()
+        ensure_backend_indexes()
+        ensure_history_indexes()
+    except Exception as e:
+        print(f"Mongo client init failed: {e}")
+    start_health_checker()
+    start_tunnel_watcher()
+    metrics.start_flusher()
+    yield
+    _health_stop.set()
+    _tunnel_watch_stop.set()
+    close_client()
+
+app = FastAPI(title="Ngrok URL Service", version="1.0.0", lifespan=lifespan)
 
 # CORS: open for dev; restrict to your Netlify domain in prod
 app.add_middleware(
@@ -28,43 +150,529 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route is only resolved once the router has run
+        route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+        HTTP_IN_FLIGHT.dec()
+        HTTP_LATENCY.observe(time.perf_counter() - started,
+                             route=route, method=request.method, status=status)
+
 # -------------------- Models --------------------
 class NgrokDoc(BaseModel):
     ngrok_url: AnyHttpUrl  # validates it's a valid http/https URL string
 
+class BackendRegistration(BaseModel):
+    backend_id: str = Field(min_length=1, max_length=128)
+    url: AnyHttpUrl
+    capacity: int = Field(1, ge=1)               # concurrent requests the box handles well
+    models: List[str] = Field(default_factory=lambda: list(DEFAULT_MODELS))
+
+class HistoryRecord(BaseModel):
+    key: str = Field(min_length=1, max_length=128)             # result cache key: hash + model + params
+    audio_sha256: str = Field(min_length=64, max_length=64)
+    model: str = Field(min_length=1, max_length=64)
+    params: Dict[str, Any] = Field(default_factory=dict)
+    transcription: Optional[str] = None
+    translation_en: Optional[str] = None
+    preprocess: Optional[Dict[str, Any]] = None
+    timings: Dict[str, Any] = Field(default_factory=dict)
+    audio_bytes: Optional[int] = None
+    created_at: float                                           # epoch seconds, set by the webapp
+
+class HistoryBatch(BaseModel):
+    records: List[HistoryRecord]
+
+class BackendHeartbeat(BaseModel):
+    load: Optional[float] = Field(None, ge=0)    # the backend's own utilization, 0..1
+    capacity: Optional[int] = Field(None, ge=1)
+    url: Optional[AnyHttpUrl] = None             # tunnel moved
+
 # -------------------- DB helpers ----------------
 def get_collection() -> Collection:
     try:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        # Try a cheap server check once (optional)
-        _ = client.admin.command("ping")
-        return client[DB_NAME][COLL_NAME]
+        return get_client()[DB_NAME][COLL_NAME]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Mongo connection failed: {e}")
 
+# In-process TTL cache for fetch_ngrok_url(). The generation counter stops a
+# slow read that started before an upsert from re-caching the old value.
+_url_cache = {"value": None, "expires": 0.0, "generation": 0}
+_url_cache_lock = threading.Lock()
+
+def invalidate_ngrok_url_cache():
+    with _url_cache_lock:
+        _url_cache["expires"] = 0.0
+        _url_cache["generation"] += 1
+
+def _tunnel_record(doc) -> Optional[dict]:
+    if not doc or not doc.get("ngrok_url"):
+        return None
+    # Records written before versioning count as version 0
+    return {"ngrok_url": doc["ngrok_url"], "version": int(doc.get("version") or 0)}
+
+def read_ngrok_record() -> Optional[dict]:
+    doc = get_collection().find_one({}, projection={"_id": False, "ngrok_url": True, "version": True})
+    return _tunnel_record(doc)
+
+def fetch_ngrok_record() -> Optional[dict]:
+    """
+    {"ngrok_url", "version"} of the tunnel record, or None.
+    """
+    now = time.monotonic()
+    with _url_cache_lock:
+        if now < _url_cache["expires"]:
+            NGROK_URL_LOOKUPS.inc(source="cache")
+            return _url_cache["value"]
+        generation = _url_cache["generation"]
+
+    record = read_ngrok_record()
+    NGROK_URL_LOOKUPS.inc(source="mongo")
+    if record is not None:
+        tunnel_notifier.publish(record, source="read")
+
+    if NGROK_CACHE_TTL_SEC > 0:
+        with _url_cache_lock:
+            if _url_cache["generation"] == generation:
+                _url_cache["value"] = record
+                _url_cache["expires"] = time.monotonic() + NGROK_CACHE_TTL_SEC
+    return record
+
 def fetch_ngrok_url() -> Optional[str]:
-    coll = get_collection()
-    doc = coll.find_one({}, projection={"_id": False, "ngrok_url": True})
-    return doc.get("ngrok_url") if doc else None
+    record = fetch_ngrok_record()
+    return record["ngrok_url"] if record else None
+
+def get_backends_collection() -> Collection:
+    try:
+        return get_client()[DB_NAME][BACKENDS_COLL_NAME]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Mongo connection failed: {e}")
+
+def ensure_backend_indexes():
+    try:
+        get_backends_collection().create_index("heartbeat_at", expireAfterSeconds=BACKEND_EXPIRE_SEC)
+    except Exception as e:
+        print(f"Backend index creation failed: {e}")
+
+# Same TTL/generation scheme as the URL cache; every registry write invalidates it
+_backends_cache = {"value": None, "expires": 0.0, "generation": 0}
 
-def upsert_ngrok_url(url: str) -> str:
-    coll = get_collection()
-    coll.update_one({}, {"$set": {"ngrok_url": url}}, upsert=True)
-    return url
+def invalidate_backends_cache():
+    with _url_cache_lock:
+        _backends_cache["expires"] = 0.0
+        _backends_cache["generation"] += 1
+
+def list_backends() -> list:
+    """
+    Backends with a heartbeat in the last BACKEND_TTL_SEC, ordered by id.
+    """
+    now = time.monotonic()
+    with _url_cache_lock:
+        if now < _backends_cache["expires"]:
+            return _backends_cache["value"]
+        generation = _backends_cache["generation"]
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=BACKEND_TTL_SEC)
+    docs = get_backends_collection().find({"heartbeat_at": {"$gte": cutoff}}).sort("_id", 1)
+    backends = [{
+        "backend_id": d["_id"],
+        "url": d["url"],
+        "capacity": d.get("capacity", 1),
+        "models": d.get("models") or DEFAULT_MODELS,
+        "load": d.get("load"),
+    } for d in docs]
+
+    if NGROK_CACHE_TTL_SEC > 0:
+        with _url_cache_lock:
+            if _backends_cache["generation"] == generation:
+                _backends_cache["value"] = backends
+                _backends_cache["expires"] = time.monotonic() + NGROK_CACHE_TTL_SEC
+    return backends
+
+def get_history_collection() -> Collection:
+    try:
+        return get_client()[DB_NAME][HISTORY_COLL_NAME]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Mongo connection failed: {e}")
+
+def ensure_history_indexes():
+    try:
+        coll = get_history_collection()
+        coll.create_index([("audio_sha256", ASCENDING), ("created_at", DESCENDING)])
+        coll.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+        coll.create_index([("model", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    except Exception as e:
+        print(f"History index creation failed: {e}")
+
+def _history_view(doc: dict) -> dict:
+    doc = dict(doc)
+    doc["id"] = str(doc.pop("_id"))
+    doc["created_at"] = doc["created_at"].replace(tzinfo=timezone.utc).timestamp()
+    return doc
+
+def encode_history_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"].replace(tzinfo=timezone.utc).isoformat(), str(doc["_id"])])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> dict:
+    """
+    Filter for the items after a cursor in (created_at, _id) descending order.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, oid = json.loads(raw)
+        created_at, oid = datetime.fromisoformat(created_at), ObjectId(oid)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {"$or": [{"created_at": {"$lt": created_at}},
+                    {"created_at": created_at, "_id": {"$lt": oid}}]}
+
+def backends_etag(backends: list) -> str:
+    # Load is rounded so heartbeats that barely move it still answer 304
+    view = [dict(b, load=round(b["load"], 1) if b["load"] is not None else None) for b in backends]
+    raw = json.dumps(view, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:16] + '"'
+
+def upsert_ngrok_url(url: str) -> dict:
+    """
+    Store a new tunnel URL; every write bumps the record's version.
+    """
+    doc = get_collection().find_one_and_update(
+        {},
+        {"$set": {"ngrok_url": url, "updated_at": datetime.now(timezone.utc)}, "$inc": {"version": 1}},
+        projection={"_id": False, "ngrok_url": True, "version": True},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    invalidate_ngrok_url_cache()
+    record = _tunnel_record(doc)
+    tunnel_notifier.publish(record, source="local")
+    return record
+
+def ngrok_url_etag(record: dict) -> str:
+    raw = f"{record['version']}:{record['ngrok_url']}"
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:16] + '"'
+
+# -------------------- Tunnel watch --------------
+class TunnelNotifier:
+    """
+    Newest tunnel record this process knows of, and the /watch_ngrok_url
+    requests waiting for a newer one. Writes arrive on worker threads (our
+    own set_ngrok_url, the change stream, the fallback poll) and wake the
+    waiting coroutines on their event loops.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.record = None
+        self._waiters = set()          # (loop, future)
+
+    def current(self) -> Optional[dict]:
+        with self._lock:
+            return self.record
+
+    def publish(self, record: dict, source: str):
+        with self._lock:
+            if self.record is not None and record["version"] <= self.record["version"]:
+                return
+            self.record = record
+            waiters, self._waiters = self._waiters, set()
+        NGROK_VERSIONS_SEEN.inc(source=source)
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result(None))
+
+    def newer(self, version: Optional[int]) -> Optional[dict]:
+        record = self.current()
+        if record is not None and (version is None or record["version"] > version):
+            return record
+        return None
+
+    async def wait_newer(self, version: Optional[int], timeout: float) -> Optional[dict]:
+        """
+        The record once its version exceeds version, or None after timeout.
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        entry = (loop, fut)
+        with self._lock:
+            self._waiters.add(entry)
+        try:
+            record = self.newer(version)
+            if record is not None:
+                return record
+            try:
+                await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                return None
+            return self.newer(version)
+        finally:
+            with self._lock:
+                self._waiters.discard(entry)
+
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiters)
+
+tunnel_notifier = TunnelNotifier()
+NGROK_WATCHERS.set_function(lambda: tunnel_notifier.waiting())
+
+# Which feed keeps tunnel_notifier current: "change_stream", "poll" or "local"
+tunnel_watch_state = {"source": None, "error": None}
+_tunnel_watch_stop = threading.Event()
+
+def _watch_change_stream() -> bool:
+    """
+    Publish every write to the tunnel collection as it happens. Returns
+    False when the deployment has no change streams (standalone server).
+    """
+    resume_token = None
+    backoff = 1.0
+    while not _tunnel_watch_stop.is_set():
+        try:
+            with get_collection().watch(full_document="updateLookup", resume_after=resume_token,
+                                        max_await_time_ms=1000) as stream:
+                tunnel_watch_state.update(source="change_stream", error=None)
+                # Anything written before the stream opened
+                record = read_ngrok_record()
+                if record is not None:
+                    tunnel_notifier.publish(record, source="change_stream")
+                backoff = 1.0
+                while not _tunnel_watch_stop.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+                    resume_token = stream.resume_token
+                    record = _tunnel_record(change.get("fullDocument"))
+                    if record is not None:
+                        tunnel_notifier.publish(record, source="change_stream")
+        except OperationFailure as e:
+            # 40573: "The $changeStream stage is only supported on replica sets"
+            if e.code in (40573, 40324) or "replica set" in str(e):
+                return False
+            tunnel_watch_state["error"] = str(e)
+            print(f"Tunnel change stream failed: {e} (retry in {backoff:.0f}s)")
+        except (PyMongoError, HTTPException) as e:
+            tunnel_watch_state["error"] = str(e)
+            print(f"Tunnel change stream failed: {e} (retry in {backoff:.0f}s)")
+        except NotImplementedError:
+            return False
+        except Exception as e:
+            # Drivers/mocks without working change streams fail in other ways
+            tunnel_watch_state["error"] = str(e)
+            print(f"Tunnel change stream unusable: {e!r}")
+            return False
+        if _tunnel_watch_stop.wait(backoff):
+            break
+        backoff = min(backoff * 2, 30.0)
+    return True
+
+def _poll_tunnel_record():
+    tunnel_watch_state.update(source="poll" if NGROK_WATCH_POLL_SEC > 0 else "local")
+    if NGROK_WATCH_POLL_SEC <= 0:
+        return
+    while not _tunnel_watch_stop.wait(NGROK_WATCH_POLL_SEC):
+        try:
+            record = read_ngrok_record()
+            if record is not None:
+                tunnel_notifier.publish(record, source="poll")
+            tunnel_watch_state["error"] = None
+        except Exception as e:
+            # Keep polling whatever went wrong; this loop is the last feed
+            tunnel_watch_state["error"] = str(e)
+
+def _tunnel_watch_loop():
+    try:
+        streamed = _watch_change_stream()
+    except Exception as e:
+        print(f"Tunnel change stream failed: {e!r}")
+        streamed = False
+    if not streamed:
+        print("Mongo change streams unavailable; /watch_ngrok_url falls back to polling")
+        _poll_tunnel_record()
+
+def start_tunnel_watcher():
+    _tunnel_watch_stop.clear()
+    threading.Thread(target=_tunnel_watch_loop, name="tunnel-watch", daemon=True).start()
 
 # -------------------- Routes --------------------
 @app.get("/", tags=["health"])
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "mongo_ok": mongo_health["ok"], "tunnel_watch": tunnel_watch_state["source"]}
 
 @app.get("/get_ngrok_url", tags=["ngrok"])
-def get_ngrok_url():
-    url = fetch_ngrok_url()
-    if not url:
+def get_ngrok_url(request: Request, response: Response):
+    record = fetch_ngrok_record()
+    if not record:
         raise HTTPException(status_code=404, detail="ngrok_url not found")
-    return {"ngrok_url": url}
+    # Conditional GET: pollers send If-None-Match and get an empty 304 back
+    etag = ngrok_url_etag(record)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return record
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/watch_ngrok_url", tags=["ngrok"])
+async def watch_ngrok_url(request: Request, version: Optional[int] = None, timeout: float = 30.0,
+                          format: Optional[str] = None):
+    """
+    Long-poll: answers with the record as soon as its version is newer than
+    ?version= (at once if it already is, or if no version is given), or an
+    empty 304 after ?timeout= seconds. With Accept: text/event-stream (or
+    ?format=sse) it is an SSE stream of every newer version instead.
+    """
+    timeout = min(max(timeout, 0.0), NGROK_WATCH_MAX_SEC)
+    if tunnel_notifier.current() is None:
+        # Nothing learned yet (e.g. first request before the watcher read Mongo)
+        try:
+            await asyncio.to_thread(fetch_ngrok_record)
+        except (HTTPException, PyMongoError):
+            pass    # the long-poll still answers once a write arrives
+
+    if format == "sse" or "text/event-stream" in request.headers.get("accept", ""):
+        async def events():
+            seen = version
+            while not await request.is_disconnected():
+                record = await tunnel_notifier.wait_newer(seen, NGROK_WATCH_HEARTBEAT_SEC)
+                if record is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                seen = record["version"]
+                yield _sse("tunnel", record)
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    record = await tunnel_notifier.wait_newer(version, timeout)
+    if record is None:
+        return Response(status_code=304)
+    return record
+
+@app.get("/metrics", tags=["health"])
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.post("/set_ngrok_url", tags=["ngrok"])
 def set_ngrok_url(payload: NgrokDoc):
     saved = upsert_ngrok_url(str(payload.ngrok_url))
-    return {"ngrok_url": saved, "status": "updated"}
+    return dict(saved, status="updated")
+
+@app.post("/history/bulk", tags=["history"])
+def add_history(payload: HistoryBatch):
+    """
+    Bulk insert from the webapps' write-behind queues.
+    """
+    if len(payload.records) > HISTORY_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"at most {HISTORY_MAX_BATCH} records per batch")
+    if not payload.records:
+        return {"inserted": 0}
+    docs = []
+    for record in payload.records:
+        doc = record.model_dump()
+        doc["created_at"] = datetime.fromtimestamp(record.created_at, timezone.utc)
+        docs.append(doc)
+    result = get_history_collection().insert_many(docs, ordered=False)
+    HISTORY_INSERTED.inc(len(result.inserted_ids))
+    return {"inserted": len(result.inserted_ids)}
+
+@app.get("/history", tags=["history"])
+def query_history(model: Optional[str] = None, audio_sha256: Optional[str] = None,
+                  limit: int = 50, cursor: Optional[str] = None):
+    """
+    Newest first. Pass next_cursor back as ?cursor= for the following page.
+    """
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    clauses = []
+    if model:
+        clauses.append({"model": model})
+    if audio_sha256:
+        clauses.append({"audio_sha256": audio_sha256})
+    if cursor:
+        clauses.append(decode_history_cursor(cursor))
+    query = {"$and": clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+    docs = list(get_history_collection().find(query)
+                .sort([("created_at", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1))
+    more = len(docs) > limit
+    docs = docs[:limit]
+    return {
+        "items": [_history_view(d) for d in docs],
+        "next_cursor": encode_history_cursor(docs[-1]) if more else None,
+    }
+
+@app.get("/history/by-hash/{audio_sha256}", tags=["history"])
+def history_by_hash(audio_sha256: str, model: Optional[str] = None, key: Optional[str] = None):
+    """
+    Latest record for an audio hash (optionally exactly this model/params key).
+    """
+    query = {"audio_sha256": audio_sha256}
+    if model:
+        query["model"] = model
+    if key:
+        query["key"] = key
+    doc = get_history_collection().find_one(query, sort=[("created_at", DESCENDING)])
+    if doc is None:
+        raise HTTPException(status_code=404, detail="no history for this audio")
+    return _history_view(doc)
+
+@app.get("/backends", tags=["backends"])
+def get_backends(request: Request, response: Response):
+    backends = list_backends()
+    etag = backends_etag(backends)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return {"backends": backends, "heartbeat_ttl_sec": BACKEND_TTL_SEC}
+
+@app.post("/backends/register", tags=["backends"])
+def register_backend(payload: BackendRegistration):
+    now = datetime.now(timezone.utc)
+    get_backends_collection().update_one(
+        {"_id": payload.backend_id},
+        {
+            "$set": {
+                "url": str(payload.url),
+                "capacity": payload.capacity,
+                "models": payload.models,
+                "heartbeat_at": now,
+            },
+            "$setOnInsert": {"registered_at": now},
+        },
+        upsert=True,
+    )
+    invalidate_backends_cache()
+    return {"backend_id": payload.backend_id, "status": "registered", "heartbeat_ttl_sec": BACKEND_TTL_SEC}
+
+@app.post("/backends/{backend_id}/heartbeat", tags=["backends"])
+def backend_heartbeat(backend_id: str, payload: Optional[BackendHeartbeat] = None):
+    update = {"heartbeat_at": datetime.now(timezone.utc)}
+    if payload is not None:
+        if payload.load is not None:
+            update["load"] = payload.load
+        if payload.capacity is not None:
+            update["capacity"] = payload.capacity
+        if payload.url is not None:
+            update["url"] = str(payload.url)
+    result = get_backends_collection().update_one({"_id": backend_id}, {"$set": update})
+    if result.matched_count == 0:
+        # Expired or never registered: the backend should register again
+        raise HTTPException(status_code=404, detail="backend not registered")
+    invalidate_backends_cache()
+    return {"backend_id": backend_id, "status": "ok"}
+
+@app.delete("/backends/{backend_id}", tags=["backends"])
+def deregister_backend(backend_id: str):
+    result = get_backends_collection().delete_one({"_id": backend_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="backend not registered")
+    invalidate_backends_cache()
+    return {"backend_id": backend_id, "status": "deregistered"}
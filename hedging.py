@@ -0,0 +1,278 @@
+# hedging.py
+"""
+Hedged upstream requests: cut the tail that a stalled tunnel connection
+adds to an otherwise quick transcription.
+
+Each model keeps a live latency sketch per clip-length class (a 3 s clip
+and a 10 minute one are not comparable). A call still unanswered at the
+HEDGE_PERCENTILE latency of its class gets a duplicate, which the backend
+pool sends to the least-loaded backend -- another box when there is one,
+else a fresh pooled connection to the same one. The first good answer
+wins; the other call is cancelled (asyncio) or abandoned and its answer
+discarded (threads cannot interrupt a blocking request).
+
+Hedges are paid from a budget: every call earns HEDGE_BUDGET of a hedge
+(0.05 = at most ~5% extra upstream requests), banked up to HEDGE_BURST.
+
+The sketches learn from primary attempts only, by one rule in every path
+(unhedged, threaded, asyncio): a primary that answers successfully adds
+its latency; one that loses to a hedge adds the time it had been running
+when the hedge won -- a lower bound, but leaving it out would teach the
+sketch that the slow tail does not exist. Failed primaries add nothing.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import queue
+import threading
+import time
+
+from metrics import Counter
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))            # hedges earned per call
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", "10"))                # most hedges banked
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "30"))      # per sketch before hedging
+HEDGE_MIN_DELAY_SEC = float(os.getenv("HEDGE_MIN_DELAY_SEC", "0.05"))
+HEDGE_SKETCH_HALF_LIFE = int(os.getenv("HEDGE_SKETCH_HALF_LIFE", "500"))   # samples
+
+# Clip-length classes (seconds of audio) that get their own sketch
+HEDGE_LENGTH_CLASSES = (5, 15, 60, 300)
+
+UPSTREAM_HEDGES = Counter(
+    "upstream_hedges_total",
+    "Upstream calls past the hedge delay by outcome (won/lost/failed/budget_exhausted)",
+    ("model", "outcome"))
+
+
+class LatencySketch:
+    """
+    Log-bucketed latency histogram (buckets 4% wide, so quantiles are
+    within ~4%) whose counts halve every half_life samples: quantiles
+    follow recent traffic in O(buckets) memory.
+    """
+    GAMMA = 1.04
+    _LOG_GAMMA = math.log(GAMMA)
+
+    def __init__(self, half_life=HEDGE_SKETCH_HALF_LIFE):
+        self.half_life = max(half_life, 1)
+        self.counts = {}
+        self.total = 0.0
+        self.samples = 0
+
+    def add(self, seconds):
+        i = int(math.ceil(math.log(max(seconds, 1e-4)) / self._LOG_GAMMA))
+        self.counts[i] = self.counts.get(i, 0.0) + 1.0
+        self.total += 1.0
+        self.samples += 1
+        if self.samples % self.half_life == 0:
+            self.counts = {k: v / 2.0 for k, v in self.counts.items() if v >= 0.02}
+            self.total = sum(self.counts.values())
+
+    def quantile(self, q):
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0.0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                return self.GAMMA ** i
+        return self.GAMMA ** max(self.counts)
+
+
+class Hedger:
+    def __init__(self, enabled=HEDGE_ENABLED, percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET,
+                 burst=HEDGE_BURST, min_samples=HEDGE_MIN_SAMPLES, min_delay_sec=HEDGE_MIN_DELAY_SEC):
+        self.enabled = enabled
+        self.quantile = percentile / 100.0
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay_sec = min_delay_sec
+        self._lock = threading.Lock()
+        self._sketches = {}
+        self._tokens = 0.0
+        self.counters = {"calls": 0, "armed": 0, "hedged": 0, "won": 0, "lost": 0, "failed": 0,
+                         "budget_exhausted": 0}
+
+    # ---------------- sketches and budget ----------------
+    @staticmethod
+    def key(model, audio_sec):
+        for bound in HEDGE_LENGTH_CLASSES:
+            if audio_sec < bound:
+                return f"{model}/<{bound}s"
+        return f"{model}/{HEDGE_LENGTH_CLASSES[-1]}s+"
+
+    def observe(self, key, seconds):
+        with self._lock:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = LatencySketch()
+            sketch.add(seconds)
+
+    def plan(self, key):
+        """
+        Hedge delay for a new call, or None when it will not be hedged
+        (hedging off, or too few samples yet). Every call earns budget.
+        """
+        with self._lock:
+            self.counters["calls"] += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+            if not self.enabled:
+                return None
+            sketch = self._sketches.get(key)
+            if sketch is None or sketch.samples < self.min_samples:
+                return None
+            self.counters["armed"] += 1
+            return max(self.min_delay_sec, sketch.quantile(self.quantile))
+
+    def _spend(self, model):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.counters["hedged"] += 1
+                return True
+            self.counters["budget_exhausted"] += 1
+        UPSTREAM_HEDGES.inc(model=model, outcome="budget_exhausted")
+        return False
+
+    def _settled(self, model, outcome):
+        with self._lock:
+            self.counters[outcome] += 1
+        UPSTREAM_HEDGES.inc(model=model, outcome=outcome)
+
+    # ---------------- callers ----------------
+    def run(self, key, model, delay, attempt, upload, succeeded):
+        """
+        attempt(view) -> result on a thread, with a duplicate attempt on a
+        second thread if the first has not answered after delay. Each
+        attempt reads its own clone of upload. Returns the first result
+        for which succeeded(result) holds, else the primary's result (or
+        raises its exception). With delay None (not hedged) the attempt
+        runs inline on upload itself.
+        """
+        started = time.perf_counter()
+        if delay is None:
+            result = attempt(upload)
+            if succeeded(result):
+                self.observe(key, time.perf_counter() - started)
+            return result
+        results = queue.Queue()
+
+        def run_one(kind, view):
+            try:
+                outcome = (True, attempt(view))
+            except Exception as e:
+                outcome = (False, e)
+            finally:
+                view.close()
+            results.put((kind, outcome))
+
+        def start(kind):
+            # In a copy of the caller's context, so tracing spans follow the request
+            threading.Thread(target=contextvars.copy_context().run, args=(run_one, kind, upload.clone()),
+                             daemon=True).start()
+
+        start("primary")
+        pending, hedged, timeout = 1, False, delay
+        failures = {}
+        while True:
+            try:
+                kind, (ok, value) = results.get(timeout=timeout)
+            except queue.Empty:
+                timeout = None
+                if self._spend(model):
+                    hedged = True
+                    pending += 1
+                    start("hedge")
+                continue
+            pending -= 1
+            if ok and succeeded(value):
+                if "primary" not in failures:
+                    # The primary's answer, or how long it had run when the hedge won
+                    self.observe(key, time.perf_counter() - started)
+                if hedged:
+                    self._settled(model, "won" if kind == "hedge" else "lost")
+                return value
+            failures[kind] = (ok, value)
+            if pending == 0:
+                if hedged:
+                    self._settled(model, "failed")
+                ok, value = failures.get("primary", failures.get("hedge"))
+                if ok:
+                    return value
+                raise value
+
+    async def run_async(self, key, model, delay, attempt, upload, succeeded):
+        """
+        Coroutine version of run(): the losing attempt is cancelled.
+        """
+        started = time.perf_counter()
+        if delay is None:
+            result = await attempt(upload)
+            if succeeded(result):
+                self.observe(key, time.perf_counter() - started)
+            return result
+        views = [upload.clone()]
+        tasks = {asyncio.ensure_future(attempt(views[0])): "primary"}
+        hedged = False
+        failures = {}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._spend(model):
+                hedged = True
+                views.append(upload.clone())
+                tasks[asyncio.ensure_future(attempt(views[1]))] = "hedge"
+            running = set(tasks)
+            while running:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    kind = tasks[task]
+                    if task.exception() is None and succeeded(task.result()):
+                        if "primary" not in failures:
+                            # The primary's answer, or how long it had run before being cancelled
+                            self.observe(key, time.perf_counter() - started)
+                        if hedged:
+                            self._settled(model, "won" if kind == "hedge" else "lost")
+                        return task.result()
+                    failures[kind] = task
+            if hedged:
+                self._settled(model, "failed")
+            return failures.get("primary", failures.get("hedge")).result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for view in views:
+                view.close()
+
+    def stats(self):
+        with self._lock:
+            sketches = {
+                key: {
+                    "samples": s.samples,
+                    "p50_sec": round(s.quantile(0.5), 3),
+                    "hedge_delay_sec": round(max(self.min_delay_sec, s.quantile(self.quantile)), 3),
+                }
+                for key, s in self._sketches.items() if s.total
+            }
+            hedged = self.counters["hedged"]
+            return dict(
+                self.counters,
+                enabled=self.enabled,
+                percentile=self.quantile * 100,
+                budget=self.budget,
+                tokens=round(self._tokens, 2),
+                extra_load=round(hedged / self.counters["calls"], 4) if self.counters["calls"] else None,
+                hedge_win_rate=round(self.counters["won"] / hedged, 4) if hedged else None,
+                sketches=sketches,
+            )
+
+
+hedger = Hedger()
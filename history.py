@@ -0,0 +1,234 @@
+# history.py
+"""
+Transcription history, written behind the request path.
+
+Every transcription that reached the upstream is recorded in dbapi's history
+collection (audio hash, model, params, text, translation_en, timings), so
+old audio never has to be transcribed twice. record() only appends to an
+in-memory queue; a background thread posts the queue to dbapi's
+/history/bulk every HISTORY_FLUSH_SEC (or as soon as HISTORY_BATCH_MAX
+records are waiting), and a failed flush keeps the records for the next
+one. When the queue is full the oldest records are dropped, never the
+request.
+
+lookup() asks /history/by-hash for an earlier result with the same cache
+key; the webapp uses it after a local result-cache miss to skip the
+upstream entirely. It sits on the request path, so it gets one small
+budget (HISTORY_LOOKUP_TIMEOUT_SEC for connect and read together) and is
+skipped outright while dbapi is failing: while flushes fail, and for a
+backoff after a lookup error.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import Counter, Histogram
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+HISTORY_URL = os.getenv("HISTORY_URL", "").strip()               # dbapi base; default: next to NGROK_FETCH_URL
+HISTORY_FLUSH_SEC = float(os.getenv("HISTORY_FLUSH_SEC", "2"))
+HISTORY_BATCH_MAX = int(os.getenv("HISTORY_BATCH_MAX", "200"))    # records per bulk insert
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "10000"))  # oldest dropped beyond this
+HISTORY_LOOKUP_ENABLED = os.getenv("HISTORY_LOOKUP", "1").strip().lower() in ("1", "true", "yes")
+HISTORY_LOOKUP_TIMEOUT_SEC = float(os.getenv("HISTORY_LOOKUP_TIMEOUT_SEC", "0.2"))  # connect + read
+HISTORY_BACKOFF_MAX_SEC = 60.0
+
+HISTORY_RECORDS = Counter(
+    "history_records_total", "History records by outcome (queued/flushed/dropped/failed)", ("outcome",))
+HISTORY_LOOKUPS = Counter(
+    "history_lookups_total", "History lookups by audio hash (hit/miss/error/skipped)", ("outcome",))
+HISTORY_FLUSH_LATENCY = Histogram(
+    "history_flush_seconds", "Bulk insert round trip to dbapi")
+
+
+def history_base_url(ngrok_fetch_url):
+    """
+    dbapi's base URL (the service that also serves /get_ngrok_url).
+    """
+    if HISTORY_URL:
+        return HISTORY_URL.rstrip("/")
+    return ngrok_fetch_url.rsplit("/get_ngrok_url", 1)[0].rstrip("/")
+
+
+class HistoryWriter:
+    def __init__(self, session, base_url, enabled=HISTORY_ENABLED, flush_sec=HISTORY_FLUSH_SEC,
+                 batch_max=HISTORY_BATCH_MAX, queue_max=HISTORY_QUEUE_MAX,
+                 lookup_enabled=HISTORY_LOOKUP_ENABLED, lookup_timeout_sec=HISTORY_LOOKUP_TIMEOUT_SEC):
+        self.session = session
+        self.base_url = base_url
+        self.enabled = enabled and bool(base_url)
+        self.flush_sec = flush_sec
+        self.batch_max = batch_max
+        self.lookup_enabled = self.enabled and lookup_enabled
+        self.lookup_timeout_sec = lookup_timeout_sec
+        self._queue = deque(maxlen=queue_max)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._started = False
+        self.failures = 0
+        self.lookup_failures = 0
+        self._lookup_retry_at = 0.0    # monotonic; lookups are skipped before this
+        self.counters = {"queued": 0, "flushed": 0, "dropped": 0, "failed_flushes": 0,
+                         "lookup_hit": 0, "lookup_miss": 0, "lookup_error": 0, "lookup_skipped": 0}
+
+    # ---------------- writes ----------------
+    def record(self, entry):
+        """
+        Queue one history record; never blocks on the network.
+        """
+        if not self.enabled:
+            return
+        self.start()
+        with self._lock:
+            dropped = len(self._queue) == self._queue.maxlen
+            self._queue.append(entry)
+            self.counters["queued"] += 1
+            if dropped:
+                self.counters["dropped"] += 1
+            full = len(self._queue) >= self.batch_max
+        HISTORY_RECORDS.inc(outcome="queued")
+        if dropped:
+            HISTORY_RECORDS.inc(outcome="dropped")
+        if full:
+            self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._flush_loop, name="history-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            delay = self.flush_sec
+            if self.failures:
+                delay = min(HISTORY_BACKOFF_MAX_SEC, self.flush_sec * (2 ** self.failures))
+            self._wake.wait(delay)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"History flush failed: {e}")
+
+    def flush(self):
+        """
+        Send everything queued, batch_max records per request. On failure
+        the batch goes back to the front of the queue.
+        """
+        while True:
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_max, len(self._queue)))]
+            if not batch:
+                return
+            started = time.perf_counter()
+            try:
+                resp = self.session.post(self.base_url + "/history/bulk", json={"records": batch})
+                if 400 <= resp.status_code < 500 and resp.status_code not in (408, 429):
+                    # Rejected as malformed: retrying the same batch cannot help
+                    with self._lock:
+                        self.counters["dropped"] += len(batch)
+                    HISTORY_RECORDS.inc(len(batch), outcome="dropped")
+                    print(f"History flush of {len(batch)} records rejected: {resp.status_code} {resp.text[:200]}")
+                    continue
+                resp.raise_for_status()
+            except Exception as e:
+                with self._lock:
+                    # Put back what still fits; newer records win over older ones
+                    room = self._queue.maxlen - len(self._queue)
+                    kept = batch[-room:] if room else []
+                    self._queue.extendleft(reversed(kept))
+                    lost = len(batch) - len(kept)
+                    self.counters["dropped"] += lost
+                    self.counters["failed_flushes"] += 1
+                    self.failures += 1
+                HISTORY_RECORDS.inc(len(batch), outcome="failed")
+                if lost:
+                    HISTORY_RECORDS.inc(lost, outcome="dropped")
+                print(f"History flush of {len(batch)} records failed: {e}")
+                return
+            HISTORY_FLUSH_LATENCY.observe(time.perf_counter() - started)
+            HISTORY_RECORDS.inc(len(batch), outcome="flushed")
+            with self._lock:
+                self.counters["flushed"] += len(batch)
+                self.failures = 0
+
+    # ---------------- reads ----------------
+    def lookup(self, audio_sha256, key):
+        """
+        The stored record for this exact cache key, or None (also on any
+        error, when the lookup takes longer than lookup_timeout_sec, and
+        without asking while dbapi is failing).
+        """
+        if not self.lookup_enabled:
+            return None
+        with self._lock:
+            skip = self.failures > 0 or time.monotonic() < self._lookup_retry_at
+            if skip:
+                self.counters["lookup_skipped"] += 1
+        if skip:
+            HISTORY_LOOKUPS.inc(outcome="skipped")
+            return None
+        half = self.lookup_timeout_sec / 2
+        try:
+            resp = self.session.get(f"{self.base_url}/history/by-hash/{audio_sha256}", params={"key": key},
+                                    timeout=(half, half))
+            if resp.status_code == 404:
+                outcome, record = "miss", None
+            else:
+                resp.raise_for_status()
+                outcome, record = "hit", resp.json()
+        except Exception:
+            outcome, record = "error", None
+        with self._lock:
+            self.counters["lookup_" + outcome] += 1
+            if outcome == "error":
+                self.lookup_failures += 1
+                delay = min(HISTORY_BACKOFF_MAX_SEC, self.flush_sec * (2 ** (self.lookup_failures - 1)))
+                self._lookup_retry_at = time.monotonic() + delay
+            else:
+                self.lookup_failures = 0
+        HISTORY_LOOKUPS.inc(outcome=outcome)
+        return record
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, enabled=self.enabled, lookup_enabled=self.lookup_enabled,
+                        pending=len(self._queue), failures=self.failures,
+                        lookup_failures=self.lookup_failures, base_url=self.base_url)
+
+
+def history_entry(key, audio_sha256, model, params, body, elapsed_sec, audio_bytes=None):
+    """
+    History record for a successful transcription body.
+    """
+    return {
+        "key": key,
+        "audio_sha256": audio_sha256,
+        "model": model,
+        "params": params,
+        "transcription": body.get("transcription"),
+        "translation_en": body.get("translation_en"),
+        "preprocess": body.get("preprocess"),
+        "timings": {"transcribe_ms": int(elapsed_sec * 1000)},
+        "audio_bytes": audio_bytes,
+        "created_at": time.time(),
+    }
+
+
+def history_body(record):
+    """
+    Response body rebuilt from a stored record (same shape as a fresh result).
+    """
+    body = {"transcription": record.get("transcription")}
+    for name in ("translation_en", "preprocess"):
+        if record.get(name) is not None:
+            body[name] = record[name]
+    body["history"] = {"id": record.get("id"), "created_at": record.get("created_at")}
+    return body
@@ -0,0 +1,437 @@
+# jobs.py
+"""
+Asynchronous transcription jobs: submit returns a job id at once, a bounded
+pool of worker threads drains the queue, clients poll or long-poll status.
+
+Backends:
+  - "memory" (default): in-process queue; fine for a single worker process.
+  - "file": shared directory (JOBS_DIR) with atomic-rename claiming, so all
+    gunicorn workers on a host share one queue and any of them can answer a
+    status poll.
+  - "package.module:Class": any JobBackend implementation.
+"""
+import importlib
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): job updates are not serialized across processes
+    fcntl = None
+
+from uploads import AudioUpload, spool_stream
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+JOBS_BACKEND = os.getenv("JOBS_BACKEND", "memory").strip()
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(tempfile.gettempdir(), "stt-jobs"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))            # upstream calls in flight per process
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "100"))    # submit fails fast above this
+JOBS_TTL_SEC = float(os.getenv("JOBS_TTL_SEC", "900"))        # finished jobs kept this long
+JOBS_MAX_QUEUE_SEC = float(os.getenv("JOBS_MAX_QUEUE_SEC", "600"))  # queued jobs expire after this
+JOBS_MAX_WAIT_SEC = float(os.getenv("JOBS_MAX_WAIT_SEC", "30"))     # long-poll cap
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, EXPIRED = (
+    "queued", "running", "done", "failed", "cancelled", "expired",
+)
+FINAL_STATES = (DONE, FAILED, CANCELLED, EXPIRED)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def new_job(model, options=None):
+    return {
+        "job_id": uuid.uuid4().hex,
+        "model": model,
+        "options": options or {},
+        "status": QUEUED,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "result_status": None,
+    }
+
+
+def public_view(job):
+    view = {k: job[k] for k in (
+        "job_id", "model", "status", "created_at", "started_at", "finished_at",
+    )}
+    if job["status"] in FINAL_STATES:
+        view["result"] = job["result"]
+        view["result_status"] = job["result_status"]
+    return view
+
+
+# -----------------------------------------------------------------------------
+# Backends
+# -----------------------------------------------------------------------------
+class JobBackend:
+    """
+    Storage + queue for jobs. submit() must copy the upload (the request's
+    spool is closed when the request ends); claim() hands a queued job and
+    its audio to a worker. Every method may be called from any thread.
+    """
+
+    def submit(self, job, upload):
+        raise NotImplementedError
+
+    def claim(self, timeout):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def update(self, job):
+        raise NotImplementedError
+
+    def wait(self, job_id, timeout):
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        raise NotImplementedError
+
+    def reap(self, now):
+        raise NotImplementedError
+
+
+class MemoryJobBackend(JobBackend):
+    def __init__(self, max_queued=JOBS_MAX_QUEUED):
+        self._jobs = {}
+        self._audio = {}
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._max_queued = max_queued
+
+    def _queued(self):
+        return sum(1 for j in self._jobs.values() if j["status"] == QUEUED)
+
+    def submit(self, job, upload):
+        with self._cond:
+            queued = self._queued()
+        if queued >= self._max_queued:
+            raise QueueFull(f"{queued} jobs already queued")
+        # Copy outside _cond so a large upload does not hold up claim/get/wait;
+        # the limit is checked again before the job goes in
+        upload.file.seek(0)
+        audio = spool_stream(upload.file, max_bytes=upload.size)
+        with self._cond:
+            queued = self._queued()
+            if queued < self._max_queued:
+                self._audio[job["job_id"]] = audio
+                self._jobs[job["job_id"]] = dict(job)
+                audio = None
+        if audio is not None:
+            audio.close()
+            raise QueueFull(f"{queued} jobs already queued")
+        self._queue.put(job["job_id"])
+
+    def claim(self, timeout):
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._cond:
+            job = self._jobs.get(job_id)
+            upload = self._audio.pop(job_id, None)
+            if job is None or job["status"] != QUEUED:
+                if upload is not None:
+                    upload.close()
+                return None
+            job["status"] = RUNNING
+            job["started_at"] = time.time()
+            self._cond.notify_all()
+            return dict(job), upload
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job):
+        with self._cond:
+            current = self._jobs.get(job["job_id"])
+            # A cancel that raced with a running worker wins
+            if current is None or current["status"] == CANCELLED:
+                return
+            self._jobs[job["job_id"]] = dict(job)
+            self._cond.notify_all()
+
+    def wait(self, job_id, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] in FINAL_STATES:
+                    return dict(job) if job else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(job)
+                self._cond.wait(remaining)
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] not in FINAL_STATES:
+                job["status"] = CANCELLED
+                job["finished_at"] = time.time()
+                upload = self._audio.pop(job_id, None)
+                if upload is not None:
+                    upload.close()
+                self._cond.notify_all()
+            return dict(job)
+
+    def reap(self, now):
+        with self._cond:
+            for job_id, job in list(self._jobs.items()):
+                if job["status"] == QUEUED and now - job["created_at"] > JOBS_MAX_QUEUE_SEC:
+                    job["status"] = EXPIRED
+                    job["finished_at"] = now
+                    upload = self._audio.pop(job_id, None)
+                    if upload is not None:
+                        upload.close()
+                    self._cond.notify_all()
+                elif job["status"] in FINAL_STATES and now - (job["finished_at"] or now) > JOBS_TTL_SEC:
+                    del self._jobs[job_id]
+
+
+class FileJobBackend(JobBackend):
+    """
+    Jobs as JSON files under JOBS_DIR. A queued job is a marker file in
+    queue/; workers claim it with os.rename, which only one process wins.
+    Every read-check-write of a job file happens under that job's flock, so
+    a cancel cannot land between a claim's status check and its write.
+    """
+
+    POLL_SEC = 0.2
+
+    def __init__(self, root=JOBS_DIR, max_queued=JOBS_MAX_QUEUED):
+        self.root = root
+        self._max_queued = max_queued
+        for sub in ("jobs", "queue", "audio"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def _path(self, sub, name):
+        return os.path.join(self.root, sub, name)
+
+    @contextmanager
+    def _locked(self, job_id):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self._path("jobs", job_id + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)        # also releases the flock
+
+    def _write(self, job):
+        path = self._path("jobs", job["job_id"] + ".json")
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, path)
+
+    def submit(self, job, upload):
+        if len(os.listdir(self._path("queue", ""))) >= self._max_queued:
+            raise QueueFull("job queue is full")
+        with open(self._path("audio", job["job_id"]), "wb") as f:
+            for chunk in upload.iter_chunks():
+                f.write(chunk)
+        self._write(job)
+        marker = f"{job['created_at']:017.6f}-{job['job_id']}"
+        open(self._path("queue", marker), "w").close()
+
+    def claim(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            for marker in sorted(os.listdir(self._path("queue", ""))):
+                if marker.endswith(".claimed"):
+                    continue
+                claimed = self._path("queue", marker + ".claimed")
+                try:
+                    # Atomic: exactly one worker process wins the rename
+                    os.rename(self._path("queue", marker), claimed)
+                except OSError:
+                    continue
+                os.remove(claimed)
+                job_id = marker.split("-", 1)[1]
+                with self._locked(job_id):
+                    job = self.get(job_id)
+                    if job is None or job["status"] != QUEUED:
+                        continue
+                    try:
+                        f = open(self._path("audio", job_id), "rb")
+                    except FileNotFoundError:
+                        continue
+                    job["status"] = RUNNING
+                    job["started_at"] = time.time()
+                    self._write(job)
+                return job, AudioUpload(f, os.fstat(f.fileno()).st_size)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL_SEC)
+
+    def get(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path("jobs", job_id + ".json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def update(self, job):
+        with self._locked(job["job_id"]):
+            current = self.get(job["job_id"])
+            if current is None or current["status"] == CANCELLED:
+                return
+            self._write(job)
+        if job["status"] in FINAL_STATES:
+            self._remove_audio(job["job_id"])
+
+    def wait(self, job_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINAL_STATES or time.monotonic() >= deadline:
+                return job
+            time.sleep(self.POLL_SEC)
+
+    def cancel(self, job_id):
+        if self.get(job_id) is None:
+            return None
+        with self._locked(job_id):
+            job = self.get(job_id)
+            if job is None:
+                return None
+            if job["status"] not in FINAL_STATES:
+                job["status"] = CANCELLED
+                job["finished_at"] = time.time()
+                self._write(job)
+                self._remove_audio(job_id)
+        return job
+
+    def _remove_audio(self, job_id):
+        try:
+            os.remove(self._path("audio", job_id))
+        except FileNotFoundError:
+            pass
+
+    def reap(self, now):
+        for name in os.listdir(self._path("jobs", "")):
+            if not name.endswith(".json"):
+                continue
+            job = self.get(name[:-5])
+            if job is None:
+                continue
+            if job["status"] == QUEUED and now - job["created_at"] > JOBS_MAX_QUEUE_SEC:
+                with self._locked(job["job_id"]):
+                    job = self.get(job["job_id"])
+                    if job is None or job["status"] != QUEUED:
+                        continue
+                    job["status"] = EXPIRED
+                    job["finished_at"] = now
+                    self._write(job)
+                    self._remove_audio(job["job_id"])
+            elif job["status"] in FINAL_STATES and now - (job["finished_at"] or now) > JOBS_TTL_SEC:
+                for path in (self._path("jobs", name), self._path("jobs", job["job_id"] + ".lock")):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+
+def load_backend(spec=JOBS_BACKEND):
+    if spec in ("", "memory"):
+        return MemoryJobBackend()
+    if spec == "file":
+        return FileJobBackend()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+class JobRunner:
+    """
+    Bounded worker pool around a JobBackend. handler(upload, model, options)
+    returns (body, http_status) exactly like the synchronous route.
+    """
+
+    def __init__(self, handler, backend=None, workers=JOBS_WORKERS):
+        self.handler = handler
+        self.backend = backend or load_backend()
+        self.workers = workers
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._reap_loop, name="job-reaper", daemon=True).start()
+
+    def submit(self, upload, model, options=None):
+        self.start()
+        job = new_job(model, options)
+        self.backend.submit(job, upload)
+        return job
+
+    def get(self, job_id, wait=0.0):
+        wait = max(0.0, min(wait, JOBS_MAX_WAIT_SEC))
+        if wait:
+            return self.backend.wait(job_id, wait)
+        return self.backend.get(job_id)
+
+    def cancel(self, job_id):
+        return self.backend.cancel(job_id)
+
+    def _work(self):
+        while True:
+            try:
+                claimed = self.backend.claim(timeout=1.0)
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                time.sleep(1.0)
+                continue
+            if claimed is None:
+                continue
+            job, upload = claimed
+            try:
+                body, status = self.handler(upload, job["model"], job["options"])
+                job["status"] = DONE if status < 400 else FAILED
+            except Exception as e:
+                print(f"Job {job['job_id']} failed: {e}")
+                body, status = {"error": f"Unexpected server error: {e}"}, 500
+                job["status"] = FAILED
+            finally:
+                upload.close()
+            job["result"] = body
+            job["result_status"] = status
+            job["finished_at"] = time.time()
+            self.backend.update(job)
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(min(30.0, max(1.0, JOBS_TTL_SEC / 10)))
+            try:
+                self.backend.reap(time.time())
+            except Exception as e:
+                print(f"Job reaper failed: {e}")
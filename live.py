@@ -0,0 +1,192 @@
+# live.py
+"""
+Live microphone transcription: buffering for one WebSocket stream.
+
+The browser sends 16-bit mono PCM in small frames (~250 ms). LiveBuffer
+holds the utterance being spoken and tracks speech per VAD_FRAME_MS frame
+with an energy threshold. While speech continues, a partial window (the
+utterance so far) is due every LIVE_PARTIAL_SEC; a pause of
+LIVE_ENDPOINT_SILENCE_SEC, or LIVE_MAX_WINDOW_SEC of audio, cuts the
+utterance into a final window and starts the next one. Leading silence is
+dropped as it arrives, so a connection never holds more than one window of
+audio plus the finals waiting to be sent (LIVE_MAX_PENDING_SEGMENTS).
+
+Streams are not queued behind admission control (a late partial is
+worthless); LIVE_MAX_STREAMS caps them per worker process instead.
+"""
+import os
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # without numpy every frame counts as speech
+    np = None
+
+from audio import VAD_FRAME_MS, VAD_PAD_SEC, _wav_header
+from metrics import Counter, Gauge, Histogram
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+LIVE_MAX_STREAMS = int(os.getenv("LIVE_MAX_STREAMS", "8"))                  # per process; 0 = no limit
+LIVE_SAMPLE_RATE = int(os.getenv("LIVE_SAMPLE_RATE", "16000"))              # default ?sample_rate=
+LIVE_PARTIAL_SEC = float(os.getenv("LIVE_PARTIAL_SEC", "0.5"))              # new audio between partials
+LIVE_MAX_WINDOW_SEC = float(os.getenv("LIVE_MAX_WINDOW_SEC", "10"))         # force a final cut
+LIVE_ENDPOINT_SILENCE_SEC = float(os.getenv("LIVE_ENDPOINT_SILENCE_SEC", "0.6"))
+LIVE_SPEECH_DB = float(os.getenv("LIVE_SPEECH_DB", "-45"))                  # frame RMS counted as speech
+LIVE_MAX_FRAME_BYTES = int(os.getenv("LIVE_MAX_FRAME_BYTES", str(64 * 1024)))
+LIVE_MAX_PENDING_SEGMENTS = int(os.getenv("LIVE_MAX_PENDING_SEGMENTS", "2"))
+LIVE_IDLE_TIMEOUT_SEC = float(os.getenv("LIVE_IDLE_TIMEOUT_SEC", "30"))
+LIVE_LEAD_SEC = 0.3          # silence kept before the first speech of an utterance
+
+LIVE_STREAMS = Gauge(
+    "live_streams", "Open live transcription WebSockets")
+LIVE_LATENCY = Histogram(
+    "live_latency_seconds", "Last audio of a window received -> hypothesis sent (partial/final)",
+    ("kind",))
+LIVE_REJECTED = Counter(
+    "live_rejected_total", "Live streams refused or closed by the server (busy/frame_too_large/behind/idle)",
+    ("reason",))
+
+
+class LiveWindow:
+    """
+    One window to transcribe: a WAV of an utterance (or its prefix).
+    """
+
+    def __init__(self, segment, wav, start_sec, end_sec):
+        self.segment = segment
+        self.wav = wav
+        self.start_sec = start_sec
+        self.end_sec = end_sec
+        self.captured_at = time.monotonic()
+
+    def event(self, kind):
+        return {"event": kind, "segment": self.segment,
+                "start_sec": round(self.start_sec, 3), "end_sec": round(self.end_sec, 3)}
+
+
+class LiveBuffer:
+    def __init__(self, sample_rate=LIVE_SAMPLE_RATE, partial_sec=LIVE_PARTIAL_SEC,
+                 max_window_sec=LIVE_MAX_WINDOW_SEC, endpoint_silence_sec=LIVE_ENDPOINT_SILENCE_SEC,
+                 speech_db=LIVE_SPEECH_DB):
+        self.sample_rate = sample_rate
+        self.frame_bytes = max(1, int(sample_rate * VAD_FRAME_MS / 1000.0)) * 2
+        self.partial_bytes = int(partial_sec * sample_rate) * 2
+        self.max_window_bytes = int(max_window_sec * sample_rate) * 2
+        self.endpoint_frames = max(1, int(round(endpoint_silence_sec * 1000.0 / VAD_FRAME_MS)))
+        self.speech_db = speech_db
+        self.segment = 0             # index of the utterance being buffered
+        self.offset_sec = 0.0        # stream time at the start of pcm
+        self._reset()
+
+    def _reset(self):
+        self.pcm = bytearray()
+        self._analyzed = 0           # bytes of pcm already classified
+        self._speech = False         # any speech in this utterance yet
+        self._silent_frames = 0      # trailing non-speech frames
+        self._partial_at = 0         # len(pcm) when the last partial was taken
+
+    @property
+    def seconds(self):
+        return len(self.pcm) / 2.0 / self.sample_rate
+
+    def feed(self, data):
+        self.pcm += data
+        end = self._analyzed + (len(self.pcm) - self._analyzed) // self.frame_bytes * self.frame_bytes
+        if end > self._analyzed:
+            frames = (end - self._analyzed) // self.frame_bytes
+            if np is None:
+                last = frames - 1
+            else:
+                x = np.frombuffer(bytes(self.pcm[self._analyzed:end]), dtype="<i2")
+                x = x.reshape(frames, -1).astype(np.float32) / 32768.0
+                db = 10.0 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+                loud = np.flatnonzero(db >= self.speech_db)
+                last = int(loud[-1]) if len(loud) else -1
+            if last >= 0:
+                self._speech = True
+                self._silent_frames = frames - 1 - last
+            else:
+                self._silent_frames += frames
+            self._analyzed = end
+        if not self._speech:
+            self._drop_lead()
+
+    def _drop_lead(self):
+        # Nothing said yet: keep only the last LIVE_LEAD_SEC of room noise
+        keep = int(LIVE_LEAD_SEC * self.sample_rate) * 2 // self.frame_bytes * self.frame_bytes
+        excess = self._analyzed - keep
+        if excess >= self.frame_bytes * 10:
+            del self.pcm[:excess]
+            self._analyzed -= excess
+            self._partial_at = 0
+            self.offset_sec += excess / 2.0 / self.sample_rate
+
+    def final_due(self):
+        return self._speech and (self._silent_frames >= self.endpoint_frames
+                                 or len(self.pcm) >= self.max_window_bytes)
+
+    def partial_due(self):
+        return (self._speech and self._silent_frames < self.endpoint_frames
+                and len(self.pcm) - self._partial_at >= self.partial_bytes)
+
+    def _window(self, pcm):
+        n_frames = len(pcm) // 2
+        wav = _wav_header(n_frames, self.sample_rate) + bytes(pcm[:n_frames * 2])
+        return LiveWindow(self.segment, wav, self.offset_sec, self.offset_sec + n_frames / float(self.sample_rate))
+
+    def take_partial(self):
+        self._partial_at = len(self.pcm)
+        return self._window(self.pcm)
+
+    def cut(self):
+        """
+        Final window of the current utterance (trailing silence trimmed to
+        VAD_PAD_SEC); buffering starts over with the next utterance.
+        """
+        pad = int(VAD_PAD_SEC * 1000.0 / VAD_FRAME_MS)
+        trim = max(0, self._silent_frames - pad) * self.frame_bytes
+        window = self._window(self.pcm[:self._analyzed - trim] if trim else self.pcm)
+        self.offset_sec += self.seconds
+        self.segment += 1
+        self._reset()
+        return window
+
+    def flush(self):
+        """
+        Final window of whatever is buffered, or None if it holds no speech.
+        """
+        if not self._speech:
+            return None
+        return self.cut()
+
+
+class LiveStreams:
+    """
+    Counts open streams against LIVE_MAX_STREAMS.
+    """
+
+    def __init__(self, limit=LIVE_MAX_STREAMS):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.limit and self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def stats(self):
+        return {"active": self.active, "max_streams": self.limit}
+
+
+live_streams = LiveStreams()
+LIVE_STREAMS.set_function(lambda: live_streams.active)
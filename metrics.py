@@ -0,0 +1,382 @@
+# metrics.py
+"""
+Small Prometheus-text metrics registry shared by webapp.py and dbapi.py.
+
+Updates are a dict lookup + add under a per-metric lock, so they are cheap
+enough for the hot path. With METRICS_MULTIPROC_DIR set (gunicorn/uvicorn
+with several workers), every process writes a snapshot of its metrics to
+<dir>/<pid>.json every METRICS_FLUSH_SEC and on each scrape, and /metrics
+merges all of them: counters and histograms are summed across workers
+(including workers that have exited), gauges are combined per their mode
+over live workers only. A scrape folds the counters and histograms of
+exited workers into <dir>/exited.json and deletes their files, so the
+directory does not grow with every restart and a new worker that reuses a
+pid does not overwrite (and so roll back) the old worker's totals.
+"""
+import bisect
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): exited workers' snapshots stay as they are
+    fcntl = None
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "").strip()
+METRICS_FLUSH_SEC = float(os.getenv("METRICS_FLUSH_SEC", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0, 300.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics}
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    def snapshot(self):
+        return {
+            "type": self.type,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "samples": self._samples(),
+        }
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    mode decides how values from several worker processes are combined:
+    "sum" (e.g. in-flight requests), "max" or "min".
+    """
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, mode="sum"):
+        self.mode = mode
+        self._function = None
+        super().__init__(name, help, labelnames, registry)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn):
+        """
+        Unlabelled gauge computed at scrape/flush time; fn() may return None.
+        """
+        self._function = fn
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                value = None
+            if value is not None:
+                with self._lock:
+                    self._values[()] = float(value)
+        return super()._samples()
+
+    def snapshot(self):
+        snap = super().snapshot()
+        snap["mode"] = self.mode
+        return snap
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts + one overflow slot, sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def _samples(self):
+        with self._lock:
+            return [[list(k), {"counts": list(v[0]), "sum": v[1]}] for k, v in self._values.items()]
+
+    def snapshot(self):
+        snap = super().snapshot()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+# -----------------------------------------------------------------------------
+# Multi-process snapshots
+# -----------------------------------------------------------------------------
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_EXITED = "exited.json"            # counters/histograms of exited workers
+_snapshot_lock = threading.Lock()
+_snapshot_pid = None               # pid whose snapshot file this process has taken over
+
+
+def _write_json(directory, name, data):
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, os.path.join(directory, name))
+
+
+def _fold_exited(directory, names):
+    """
+    Add the counters and histograms of these exited workers' snapshot files
+    to exited.json and delete the files. Runs under an exclusive flock so
+    concurrent scrapes in different workers fold each file only once.
+    """
+    fd = os.open(os.path.join(directory, "exited.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        snaps, folded = [], []
+        for name in [_EXITED] + names:
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snaps.append((False, json.load(f)))
+            except FileNotFoundError:
+                continue            # already folded by another scrape
+            except ValueError:
+                pass                # torn or corrupt: nothing to keep
+            if name != _EXITED:
+                folded.append(name)
+        if not folded:
+            return
+        merged = _merge(snaps)      # gauges of exited workers are dropped
+        _write_json(directory, _EXITED, {
+            name: dict(m, samples=[[list(k), v] for k, v in m["samples"].items()])
+            for name, m in merged.items()
+        })
+        for name in folded:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    finally:
+        os.close(fd)        # also releases the flock
+
+
+def write_snapshot(registry=REGISTRY, directory=METRICS_MULTIPROC_DIR):
+    global _snapshot_pid
+    if not directory:
+        return
+    with _snapshot_lock:
+        os.makedirs(directory, exist_ok=True)
+        pid = os.getpid()
+        name = f"{pid}.json"
+        if _snapshot_pid != pid:
+            # A file under our pid was left by an exited process: keep its totals
+            if fcntl is not None and os.path.exists(os.path.join(directory, name)):
+                _fold_exited(directory, [name])
+            _snapshot_pid = pid
+        _write_json(directory, name, registry.snapshot())
+
+
+def _load_snapshots(registry, directory):
+    if not directory:
+        return [(True, registry.snapshot())]
+    write_snapshot(registry, directory)
+    pids = {}
+    for name in os.listdir(directory):
+        if name.endswith(".json") and name[:-5].isdigit():
+            pids[name] = _pid_alive(int(name[:-5]))
+    exited = [name for name, alive in pids.items() if not alive]
+    if exited and fcntl is not None:
+        _fold_exited(directory, exited)
+        pids = {name: alive for name, alive in pids.items() if alive}
+    pids[_EXITED] = False
+    snaps = []
+    for name, alive in pids.items():
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snaps.append((alive, json.load(f)))
+        except (ValueError, OSError):
+            continue
+    return snaps
+
+
+def _merge(snapshots):
+    merged = {}
+    for alive, snap in snapshots:
+        for name, m in snap.items():
+            if m["type"] == "gauge" and not alive:
+                continue
+            out = merged.setdefault(name, dict(m, samples={}))
+            for labels, value in m["samples"]:
+                key = tuple(labels)
+                if m["type"] == "histogram":
+                    cur = out["samples"].get(key)
+                    if cur is None:
+                        out["samples"][key] = {"counts": list(value["counts"]), "sum": value["sum"]}
+                    else:
+                        cur["counts"] = [a + b for a, b in zip(cur["counts"], value["counts"])]
+                        cur["sum"] += value["sum"]
+                elif m["type"] == "gauge" and key in out["samples"]:
+                    cur = out["samples"][key]
+                    mode = m.get("mode", "sum")
+                    out["samples"][key] = (max(cur, value) if mode == "max"
+                                           else min(cur, value) if mode == "min"
+                                           else cur + value)
+                else:
+                    out["samples"][key] = out["samples"].get(key, 0.0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(registry=REGISTRY, directory=METRICS_MULTIPROC_DIR):
+    """
+    Prometheus text exposition of this process, or of all workers when
+    METRICS_MULTIPROC_DIR is set.
+    """
+    merged = _merge(_load_snapshots(registry, directory))
+    lines = []
+    for name in sorted(merged):
+        m = merged[name]
+        lines.append(f"# HELP {name} {m['help']}")
+        lines.append(f"# TYPE {name} {m['type']}")
+        names = m["labelnames"]
+        for key in sorted(m["samples"]):
+            value = m["samples"][key]
+            if m["type"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(list(m["buckets"]) + [math.inf], value["counts"]):
+                    cumulative += count
+                    le = 'le="' + _num(bound) + '"'
+                    lines.append(f"{name}_bucket{_labels(names, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(names, key)} {_num(value['sum'])}")
+                lines.append(f"{name}_count{_labels(names, key)} {cumulative}")
+            else:
+                lines.append(f"{name}{_labels(names, key)} {_num(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _flush_loop(registry, directory):
+    while True:
+        time.sleep(METRICS_FLUSH_SEC)
+        try:
+            write_snapshot(registry, directory)
+        except OSError as e:
+            print(f"Metrics snapshot failed: {e}")
+
+
+def start_flusher(registry=REGISTRY, directory=METRICS_MULTIPROC_DIR):
+    """
+    Periodically publish this worker's snapshot so a scrape that lands on
+    another worker still sees it. No-op in single-process mode.
+    """
+    if not directory:
+        return
+    threading.Thread(target=_flush_loop, args=(registry, directory), daemon=True).start()
@@ -0,0 +1,280 @@
+# result_cache.py
+"""
+Content-addressed cache of transcription results.
+
+Key: sha256 of the decoded audio + model + effective upstream parameters.
+Tiers: a size-bounded in-memory LRU and an optional on-disk directory
+(RESULT_CACHE_DIR) that survives restarts. Identical requests that arrive
+while the first is still running wait for it instead of calling upstream.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESULT_CACHE_TTL_SEC = float(os.getenv("RESULT_CACHE_TTL_SEC", "0"))  # 0 = no expiry
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "").strip()          # empty = no disk tier
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def cache_key(audio_sha256, model, params):
+    raw = json.dumps(
+        {"audio": audio_sha256, "model": model, "params": params},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl_sec=RESULT_CACHE_TTL_SEC,
+                 disk_dir=RESULT_CACHE_DIR, disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES,
+                 enabled=RESULT_CACHE_ENABLED):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, size, value)
+        self._bytes = 0
+        self._inflight = {}
+        self._disk_bytes = 0
+        self._pruning = False
+        self.counters = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(e.stat().st_size for e in os.scandir(self.disk_dir)
+                                   if e.name.endswith(".json"))
+
+    # ---------------- memory tier ----------------
+    def _expired(self, stored_at):
+        return self.ttl_sec > 0 and time.time() - stored_at > self.ttl_sec
+
+    def _mem_get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[0]):
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _mem_put(self, key, value, size, stored_at):
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (stored_at, size, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.counters["evictions"] += 1
+
+    # ---------------- disk tier ----------------
+    # File I/O runs outside _lock; the lock only guards _disk_bytes and the
+    # counters, so memory hits never wait behind a slow disk.
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            stored_at = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        if self._expired(stored_at):
+            self._disk_remove(path)
+            return None
+        try:
+            return json.loads(raw), len(raw), stored_at
+        except ValueError:
+            self._disk_remove(path)
+            return None
+
+    def _disk_remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+
+    def _disk_put(self, key, raw):
+        if not self.disk_dir:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        path = self._disk_path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk_bytes += len(raw) - replaced
+            # One prune at a time; puts meanwhile just add to the total
+            prune = self._disk_bytes > self.disk_max_bytes and not self._pruning
+            if prune:
+                self._pruning = True
+        if prune:
+            try:
+                self._disk_prune()
+            finally:
+                with self._lock:
+                    self._pruning = False
+
+    def _disk_prune(self):
+        files = []
+        for e in os.scandir(self.disk_dir):
+            if not e.name.endswith(".json"):
+                continue
+            try:
+                st = e.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, e.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = self.disk_max_bytes * 0.9
+        evicted = freed = 0
+        for _, size, path in files:
+            if total - freed <= target:
+                break
+            try:
+                os.remove(path)
+                freed += size
+                evicted += 1
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            # Subtract rather than overwrite: puts during the scan still count
+            self._disk_bytes -= freed
+            self.counters["evictions"] += evicted
+
+    # ---------------- public ----------------
+    def get(self, key):
+        with self._lock:
+            value = self._mem_get(key)
+            if value is not None:
+                self.counters["hits_memory"] += 1
+                return value
+        found = self._disk_get(key)
+        if found is None:
+            return None
+        value, size, stored_at = found
+        with self._lock:
+            self._mem_put(key, value, size, stored_at)
+            self.counters["hits_disk"] += 1
+        return value
+
+    def put(self, key, value):
+        raw = json.dumps(value, separators=(",", ":")).encode()
+        with self._lock:
+            self._mem_put(key, value, len(raw), time.time())
+            self.counters["stores"] += 1
+        try:
+            self._disk_put(key, raw)
+        except OSError as e:
+            print(f"Result cache disk write failed: {e}")
+
+    def get_or_compute(self, key, compute, cacheable=lambda value: True):
+        """
+        Return the cached value for key, or run compute() once for all
+        concurrent callers with the same key. Returns (value, source) with
+        source in {"memory", "disk", "coalesced", "upstream"}.
+        """
+        if not self.enabled:
+            return compute(), "upstream"
+
+        with self._lock:
+            value = self._mem_get(key)
+            if value is not None:
+                self.counters["hits_memory"] += 1
+                return value, "memory"
+            leader = key not in self._inflight
+            if leader:
+                self._inflight[key] = _InFlight()
+            flight = self._inflight[key]
+
+        if not leader:
+            with self._lock:
+                self.counters["coalesced"] += 1
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, "coalesced"
+
+        try:
+            # Memory was checked above; this falls through to the disk tier
+            value = self.get(key)
+            if value is not None:
+                source = "disk"
+            else:
+                with self._lock:
+                    self.counters["misses"] += 1
+                value = compute()
+                source = "upstream"
+                if cacheable(value):
+                    self.put(key, value)
+            flight.value = value
+            return value, source
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["hits_memory"] + self.counters["hits_disk"]
+            lookups = hits + self.counters["misses"]
+            return dict(
+                self.counters,
+                enabled=self.enabled,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                disk_dir=self.disk_dir,
+                disk_bytes=self._disk_bytes if self.disk_dir else None,
+                hit_rate=round(hits / lookups, 4) if lookups else None,
+            )
+
+
+result_cache = ResultCache()
@@ -0,0 +1,317 @@
+# tracing.py
+"""
+Per-request tracing for /transcribe-audio.
+
+A request carries a trace ID: the client's TRACE_HEADER (or the trace-id
+of a W3C traceparent) when it sent a usable one, else a new one. The ID
+is echoed back and forwarded to the transcription backend in TRACE_HEADER.
+
+The trace is held in a context variable, so code anywhere under the route
+records stage spans without being passed it: parse, admission, history,
+preprocess, payload-N / upstream-N per upstream attempt (N counts JSON,
+form fallback, failover and hedge attempts in order) and normalize. Code
+running outside a traced request records nothing. Threads started for a
+request must be run in a copy of its context (contextvars.copy_context())
+to keep adding to its trace; asyncio tasks copy it by themselves.
+
+Finished traces become a Server-Timing header (and "server_timing" in the
+final stream event). A sample of them -- TRACE_SAMPLE_RATE, plus every
+failed request and every request slower than TRACE_SLOW_SEC -- is appended
+to a size-rotated JSONL file by a background thread.
+"""
+import atexit
+import contextvars
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): appends from several processes may interleave
+    fcntl = None
+
+from metrics import Counter
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Trace-Id")          # accepted, echoed, sent upstream
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SEC = float(os.getenv("TRACE_SLOW_SEC", "10"))        # always log slower traces; 0 = off
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(tempfile.gettempdir(), "stt-traces.jsonl"))
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+TRACE_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", "5"))
+TRACE_FLUSH_SEC = 1.0
+TRACE_QUEUE_MAX = 1000
+TRACE_SERVER_TIMING_MAX = 32         # spans in one Server-Timing header
+
+TRACES_LOGGED = Counter(
+    "traces_logged_total", "Traces written to the trace log by reason (sampled/slow/error/dropped)",
+    ("reason",))
+
+_TRACE_ID = re.compile(r"^[A-Za-z0-9_.-]{8,64}$")
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, trace_id, route):
+        self.trace_id = trace_id
+        self.route = route
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []
+        self.attrs = {}
+        self.deferred = False        # finished later by the streaming worker
+        self.finished = False
+        self._attempts = 0
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    def next_attempt(self):
+        with self._lock:
+            self._attempts += 1
+            return self._attempts
+
+    def add(self, name, seconds, started=None, **attrs):
+        start = started if started is not None else time.perf_counter() - seconds
+        span = {"name": name, "start_ms": round((start - self._t0) * 1000, 1),
+                "dur_ms": round(seconds * 1000, 1)}
+        span.update(attrs)
+        self.spans.append(span)
+        return span
+
+    def server_timing(self):
+        """
+        Server-Timing header value: one entry per span, then the total.
+        """
+        entries = []
+        for span in self.spans[:TRACE_SERVER_TIMING_MAX]:
+            entry = f"{span['name']};dur={span['dur_ms']}"
+            if span.get("desc"):
+                entry += ';desc="' + str(span["desc"]).replace('"', "'") + '"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed_ms()}")
+        return ", ".join(entries)
+
+    def to_dict(self, status, total_ms):
+        return {
+            "trace_id": self.trace_id,
+            "ts": self.started_at,
+            "route": self.route,
+            "status": status,
+            "total_ms": total_ms,
+            "attrs": self.attrs,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+def incoming_trace_id(headers):
+    """
+    The caller's trace ID (TRACE_HEADER, else a traceparent's trace-id),
+    or None when it sent nothing usable.
+    """
+    value = (headers.get(TRACE_HEADER) or "").strip()
+    if _TRACE_ID.match(value):
+        return value
+    match = _TRACEPARENT.match((headers.get("traceparent") or "").strip())
+    return match.group(1) if match else None
+
+
+def start(headers, route):
+    """
+    Begin a trace for this request in the current context. Returns it, or
+    None with tracing off.
+    """
+    if not TRACE_ENABLED:
+        return None
+    trace = Trace(incoming_trace_id(headers) or uuid.uuid4().hex, route)
+    _current.set(trace)
+    return trace
+
+
+def current():
+    return _current.get()
+
+
+def clear():
+    # Flask reuses threads across requests; drop the finished request's trace
+    _current.set(None)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the block as a span of the current trace (no-op outside one).
+    The span dict is yielded so the block can add attributes to it.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield {}
+        return
+    started = time.perf_counter()
+    extra = dict(attrs)
+    try:
+        yield extra
+    except BaseException as e:
+        extra["error"] = type(e).__name__
+        raise
+    finally:
+        trace.add(name, time.perf_counter() - started, started, **extra)
+
+
+def add(name, seconds, **attrs):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds, **attrs)
+
+
+def annotate(**attrs):
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def next_attempt():
+    """
+    Number of the next upstream attempt in this trace (1, 2, ...), or None.
+    """
+    trace = _current.get()
+    return trace.next_attempt() if trace is not None else None
+
+
+def upstream_headers():
+    trace = _current.get()
+    return {TRACE_HEADER: trace.trace_id} if trace is not None else {}
+
+
+def finish(trace, status):
+    """
+    Close the trace and hand it to the trace log if it is sampled. Returns
+    the Server-Timing value. Safe to call more than once.
+    """
+    if trace is None:
+        return None
+    timing = trace.server_timing()
+    if trace.finished:
+        return timing
+    trace.finished = True
+    total_ms = trace.elapsed_ms()
+    if status >= 500:
+        reason = "error"
+    elif TRACE_SLOW_SEC and total_ms >= TRACE_SLOW_SEC * 1000:
+        reason = "slow"
+    elif random.random() < TRACE_SAMPLE_RATE:
+        reason = "sampled"
+    else:
+        return timing
+    record = trace.to_dict(status, total_ms)
+    record["reason"] = reason
+    trace_log.write(record)
+    return timing
+
+
+class TraceLog:
+    """
+    Append-only JSONL trace file shared by all worker processes: each flush
+    appends under an exclusive flock and rotates the file (path.1 ..
+    path.N) once it passes max_bytes. Without flock the file is still
+    appended to and rotated, just not serialized across processes.
+    """
+
+    def __init__(self, path=TRACE_LOG_PATH, max_bytes=TRACE_LOG_MAX_BYTES, backups=TRACE_LOG_BACKUPS,
+                 flush_sec=TRACE_FLUSH_SEC, queue_max=TRACE_QUEUE_MAX):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_sec = flush_sec
+        self._queue = deque(maxlen=queue_max)
+        self._lock = threading.Lock()
+        self._started = False
+        self.counters = {"written": 0, "dropped": 0, "failed": 0}
+
+    def write(self, record):
+        self.start()
+        with self._lock:
+            if len(self._queue) == self._queue.maxlen:
+                self.counters["dropped"] += 1
+                TRACES_LOGGED.inc(reason="dropped")
+            self._queue.append(record)
+        TRACES_LOGGED.inc(reason=record["reason"])
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._flush_loop, name="trace-log", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_sec)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Trace log flush failed: {e}")
+
+    def flush(self):
+        with self._lock:
+            records = list(self._queue)
+            self._queue.clear()
+        if not records:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+                       for r in records).encode()
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except OSError:
+            with self._lock:
+                self.counters["failed"] += len(records)
+            raise
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, data)
+            if os.fstat(fd).st_size >= self.max_bytes:
+                self._rotate(fd)
+        finally:
+            os.close(fd)        # also releases the flock
+        with self._lock:
+            self.counters["written"] += len(records)
+
+    def _rotate(self, fd):
+        # Still holding the lock (if any); another process may have rotated first
+        try:
+            if os.stat(self.path).st_ino != os.fstat(fd).st_ino:
+                return
+        except FileNotFoundError:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            try:
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            except FileNotFoundError:
+                pass
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.truncate(self.path, 0)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, pending=len(self._queue), path=self.path,
+                        sample_rate=TRACE_SAMPLE_RATE, slow_sec=TRACE_SLOW_SEC)
+
+
+trace_log = TraceLog()
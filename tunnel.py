@@ -0,0 +1,326 @@
+# tunnel.py
+"""
+Tunnel (ngrok) URL resolution for the webapp.
+
+One resolver per process, shared by the background poller and the
+/get_ngrok_url endpoint: callers get the cached URL immediately while a
+stale value is revalidated in the background; concurrent refreshes are
+merged into one conditional (If-None-Match) request to the URL service,
+and failures back off exponentially while the cached URL keeps serving.
+
+The poller normally long-polls the service's /watch_ngrok_url instead,
+which answers as soon as a newer tunnel version is stored: a rotated URL
+arrives within a round trip and an idle watch costs one request per
+NGROK_WATCH_SEC. While a watch is healthy the cached URL counts as fresh.
+
+With a SharedTunnelState (tunnel_state.py) only the elected refresher
+process talks to the service; the resolvers of the other workers mirror
+its published state and never fetch.
+"""
+import os
+import threading
+import time
+
+from metrics import Counter
+from tunnel_state import NGROK_SHARED_SYNC_SEC
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+NGROK_FETCH_URL = os.getenv(
+    "NGROK_FETCH_URL",
+    "https://diamonwall-speech-to-text.onrender.com/get_ngrok_url"
+).strip()
+NGROK_FRESH_SEC = float(os.getenv("NGROK_FRESH_SEC", "5"))          # no revalidation below this age
+NGROK_BACKOFF_BASE_SEC = float(os.getenv("NGROK_BACKOFF_BASE_SEC", "1"))
+NGROK_BACKOFF_MAX_SEC = float(os.getenv("NGROK_BACKOFF_MAX_SEC", "60"))
+NGROK_WATCH_SEC = float(os.getenv("NGROK_WATCH_SEC", "25"))           # long-poll hold; 0 = poll only
+NGROK_WATCH_URL = os.getenv("NGROK_WATCH_URL", "").strip() or (
+    NGROK_FETCH_URL.rsplit("/get_ngrok_url", 1)[0].rstrip("/") + "/watch_ngrok_url")
+
+TUNNEL_REFRESHES = Counter(
+    "tunnel_url_refresh_total",
+    "Tunnel URL refresh attempts by outcome "
+    "(changed/unchanged/not_modified/error/merged/skipped_backoff/watch_timeout)",
+    ("outcome",))
+
+
+class TunnelResolver:
+    def __init__(self, session, fetch_url=NGROK_FETCH_URL, fixed_url=None, on_update=None,
+                 fresh_sec=NGROK_FRESH_SEC, backoff_base=NGROK_BACKOFF_BASE_SEC,
+                 backoff_max=NGROK_BACKOFF_MAX_SEC, watch_url=NGROK_WATCH_URL, shared=None):
+        self.session = session
+        self.fetch_url = fetch_url
+        self.watch_url = watch_url
+        self.fixed_url = fixed_url or None
+        self.on_update = on_update
+        self.fresh_sec = fresh_sec
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._inflight = None          # Event of the refresh in progress, if any
+        self.url = None
+        self.version = None            # tunnel record version, from services that send one
+        self.watching = False          # the last watch long-poll succeeded
+        self.watch_supported = bool(watch_url)
+        self.last_ok = 0.0             # epoch seconds of the last successful check
+        self.etag = None
+        self.failures = 0
+        self.next_attempt_at = 0.0     # monotonic; refreshes are skipped before this
+        self.last_error = None
+        self.counters = {"fetches": 0, "not_modified": 0, "changed": 0, "errors": 0,
+                         "merged": 0, "skipped_backoff": 0, "watches": 0}
+
+        self.shared = None if self.fixed_url else shared
+        self._shared_seq = None
+        if self.shared is not None:
+            # Serve the last known URL from the first request on
+            self.sync_shared()
+
+    # ---------------- shared state ----------------
+    @property
+    def follower(self):
+        return self.shared is not None and not self.shared.leader
+
+    def sync_shared(self):
+        """
+        Adopt the refresher's published state if it changed since the last
+        look (one lock-free read of its sequence number otherwise).
+        """
+        if self.shared.seq() == self._shared_seq:
+            return
+        seq, state = self.shared.read()
+        if state is None:
+            return
+        with self._lock:
+            changed = state["url"] != self.url
+            self._shared_seq = seq
+            self.url = state["url"]
+            self.version = state["version"]
+            self.last_ok = state["last_ok"]
+            self.failures = state["failures"]
+            self.last_error = state["error"]
+            self.watching = state["watching"]
+            self.etag = None
+        if changed and self.url is not None and self.on_update is not None:
+            self.on_update(self.url)
+
+    def follow(self, interval_sec=NGROK_SHARED_SYNC_SEC):
+        """
+        Mirror the shared state until this process becomes the refresher.
+        """
+        while self.follower:
+            try:
+                self.sync_shared()
+            except Exception as e:
+                print(f"Reading shared tunnel state failed: {e}")
+            time.sleep(interval_sec)
+
+    def become_refresher(self):
+        """
+        Block until elected, then take over from the latest published state.
+        """
+        self.shared.elect()
+        self.sync_shared()
+        self.shared.leader = True
+        self._publish()
+
+    def _publish(self):
+        if self.shared is None or not self.shared.leader:
+            return
+        with self._lock:
+            state = (self.url, self.version, self.last_ok, self.failures, self.watching, self.last_error)
+        self.shared.write(*state)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "ngrok_url": self.fixed_url or self.url,
+                "version": None if self.fixed_url else self.version,
+                "last_ok": self.last_ok,
+                "source": "env" if self.fixed_url else ("shared" if self.follower else "cache"),
+                "failures": self.failures,
+                "error": self.last_error,
+                "revalidating": self._inflight is not None,
+                "watching": self.watching,
+            }
+
+    def get(self, wait_sec=0.0):
+        """
+        Cached state right away; a stale entry is revalidated in the
+        background. Only when nothing is cached yet does this wait (up to
+        wait_sec) for the refresh to finish.
+        """
+        if self.fixed_url:
+            return self.snapshot()
+        if self.follower:
+            # The refresher keeps the shared state current; wait for it only when cold
+            self.sync_shared()
+            deadline = time.monotonic() + (wait_sec or 0.0)
+            while self.url is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+                self.sync_shared()
+            return self.snapshot()
+        done = None
+        with self._lock:
+            have_url = self.url is not None
+            # A live watch pushes changes; no need to ask again. Start a
+            # background refresh only when none is running and we are not
+            # backing off, so a burst of requests does not park a thread each.
+            if (have_url and not self.watching and time.time() - self.last_ok >= self.fresh_sec
+                    and self._inflight is None and time.monotonic() >= self.next_attempt_at):
+                done = self._inflight = threading.Event()
+        if not have_url:
+            self.refresh(wait_sec=wait_sec)
+        elif done is not None:
+            threading.Thread(target=self._lead, args=(done,), daemon=True).start()
+        return self.snapshot()
+
+    def refresh(self, wait_sec=None, force=False):
+        """
+        Single-flight refresh. A caller that finds one already running waits
+        for it (up to wait_sec, None = until done) instead of fetching again.
+        Returns True when the last completed refresh succeeded.
+        """
+        with self._lock:
+            if self._inflight is not None:
+                leader = False
+                done = self._inflight
+                self.counters["merged"] += 1
+                TUNNEL_REFRESHES.inc(outcome="merged")
+            elif not force and time.monotonic() < self.next_attempt_at:
+                self.counters["skipped_backoff"] += 1
+                TUNNEL_REFRESHES.inc(outcome="skipped_backoff")
+                return False
+            else:
+                leader = True
+                done = self._inflight = threading.Event()
+
+        if not leader:
+            done.wait(wait_sec)
+            with self._lock:
+                return self.failures == 0 and self.url is not None
+        return self._lead(done)
+
+    def _lead(self, done):
+        # Run the fetch for the refresh that owns done (already _inflight)
+        try:
+            ok = self._fetch()
+        finally:
+            with self._lock:
+                self._inflight = None
+            done.set()
+        return ok
+
+    def _fetch(self):
+        headers = {}
+        if self.etag and self.url:
+            headers["If-None-Match"] = self.etag
+        with self._lock:
+            self.counters["fetches"] += 1
+        try:
+            resp = self.session.get(self.fetch_url, headers=headers)
+            if resp.status_code == 304:
+                with self._lock:
+                    self.counters["not_modified"] += 1
+                return self._succeeded(self.url, self.etag, outcome="not_modified")
+            resp.raise_for_status()
+            url, version = self._parse(resp)
+            return self._succeeded(url, resp.headers.get("ETag"), version=version)
+        except Exception as e:
+            return self._failed(e)
+
+    @staticmethod
+    def _parse(resp):
+        data = resp.json()
+        url = data.get("ngrok_url")
+        if not (isinstance(url, str) and url):
+            raise ValueError("'ngrok_url' not found or empty in service response.")
+        version = data.get("version")
+        return url, version if isinstance(version, int) else None
+
+    def _failed(self, e):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(e)
+            self.watching = False
+            self.counters["errors"] += 1
+            TUNNEL_REFRESHES.inc(outcome="error")
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (self.failures - 1)))
+            self.next_attempt_at = time.monotonic() + delay
+        self._publish()
+        print(f"Failed to fetch ngrok URL from service: {e} (retry in {delay:.0f}s)")
+        return False
+
+    def watch(self, hold_sec=NGROK_WATCH_SEC):
+        """
+        One long-poll of the watch endpoint: returns as soon as the service
+        stores a version newer than ours, else after hold_sec. Returns
+        "changed", "unchanged", "error" (backing off, see next_attempt_at)
+        or "unsupported" (an older service; poll with refresh() instead).
+        """
+        with self._lock:
+            params = {"timeout": hold_sec}
+            if self.url is not None and self.version is not None:
+                params["version"] = self.version
+            before = self.url
+            self.counters["watches"] += 1
+        try:
+            resp = self.session.get(self.watch_url, params=params,
+                                    timeout=(self.session.timeout[0], hold_sec + self.session.timeout[1]))
+            if resp.status_code in (404, 405):
+                with self._lock:
+                    self.watch_supported = False
+                    self.watching = False
+                print(f"Tunnel watch endpoint unavailable ({resp.status_code}); polling instead")
+                return "unsupported"
+            if resp.status_code == 304:
+                TUNNEL_REFRESHES.inc(outcome="watch_timeout")
+                with self._lock:
+                    self.watching = self.url is not None
+                    if self.url is not None:
+                        self.last_ok = time.time()
+                self._publish()
+                return "unchanged"
+            resp.raise_for_status()
+            url, version = self._parse(resp)
+        except Exception as e:
+            self._failed(e)
+            return "error"
+        if version is None:
+            # Without versions every watch would answer at once
+            with self._lock:
+                self.watch_supported = False
+            return "unsupported"
+        # The watch answer has no ETag; the next conditional GET starts over
+        with self._lock:
+            self.watching = True
+        self._succeeded(url, None, version=version)
+        return "changed" if url != before else "unchanged"
+
+    def _succeeded(self, url, etag, outcome=None, version=None):
+        with self._lock:
+            if url != self.url:
+                self.counters["changed"] += 1
+                outcome = outcome or "changed"
+            self.url = url
+            self.etag = etag
+            if version is not None:
+                self.version = version
+            self.last_ok = time.time()
+            self.failures = 0
+            self.last_error = None
+            self.next_attempt_at = 0.0
+        TUNNEL_REFRESHES.inc(outcome=outcome or "unchanged")
+        self._publish()
+        if self.on_update is not None:
+            self.on_update(url)
+        return True
+
+    def stats(self):
+        snap = self.snapshot()
+        with self._lock:
+            stats = dict(self.counters, **snap)
+        stats["shared"] = self.shared.stats() if self.shared is not None else None
+        return stats
@@ -0,0 +1,163 @@
+# tunnel_state.py
+"""
+Tunnel URL state shared by all worker processes on a host.
+
+Every gunicorn/uvicorn worker imports the webapp, and each used to poll the
+URL service for itself. Now one worker -- whichever holds an exclusive
+flock on <path>.lock; the kernel hands it to the next waiter when that
+process exits -- is the refresher. It writes each result into a small
+mmap'd file. The others map the same file and read it without locks
+(seqlock: the writer makes a sequence number odd while it writes and even
+when done, and readers retry on an odd or changed number), so a read is
+one 8-byte compare when nothing changed.
+
+The file outlives the processes, so a freshly started worker serves the
+last known URL at once instead of answering 503 until its first poll.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): every process keeps its own state
+    fcntl = None
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+NGROK_SHARED_STATE = os.getenv("NGROK_SHARED_STATE", "1").strip().lower() in ("1", "true", "yes")
+NGROK_SHARED_STATE_DIR = os.getenv("NGROK_SHARED_STATE_DIR", tempfile.gettempdir())
+NGROK_SHARED_SYNC_SEC = float(os.getenv("NGROK_SHARED_SYNC_SEC", "0.25"))   # follower check interval
+
+# Layout: magic, seq | version, last_ok, updated_at, pid, failures, watching, url_len, error_len | url | error
+_MAGIC = b"TUN1"
+_HEAD = struct.Struct("<4sxxxxQ")
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 8
+_BODY = struct.Struct("<qddIIBxHH")
+_BODY_OFFSET = _HEAD.size
+_MAX_URL = 2048
+_MAX_ERROR = 512
+_SIZE = 4096
+_DATA_END = _BODY_OFFSET + _BODY.size + _MAX_URL + _MAX_ERROR
+_READ_ATTEMPTS = 1000
+
+
+class SharedTunnelState:
+    def __init__(self, path):
+        self.path = path
+        self.leader = False
+        self._lock_fd = None
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _SIZE:
+                os.ftruncate(fd, _SIZE)     # zero-filled: no state yet
+            self._mm = mmap.mmap(fd, _SIZE)
+        finally:
+            os.close(fd)                    # the mapping keeps the file
+        self.reads = 0
+        self.retries = 0
+        self.writes = 0
+
+    @classmethod
+    def for_url(cls, fetch_url, directory=NGROK_SHARED_STATE_DIR):
+        """
+        The state file for this URL service (deployments pointing at
+        different services never share one), or None when sharing is off
+        or unavailable.
+        """
+        if not NGROK_SHARED_STATE or fcntl is None:
+            return None
+        name = "stt-tunnel-" + hashlib.sha1(fetch_url.encode()).hexdigest()[:12] + ".state"
+        try:
+            return cls(os.path.join(directory, name))
+        except OSError as e:
+            print(f"Shared tunnel state unavailable ({e}); each worker polls on its own")
+            return None
+
+    # ---------------- readers (lock-free) ----------------
+    def seq(self):
+        return _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+
+    def read(self):
+        """
+        (seq, state dict), or (seq, None) when nothing was ever written or
+        no consistent copy could be taken (a refresher died mid-write; the
+        next one repairs it). Retries while the refresher is mid-write.
+        """
+        self.reads += 1
+        for _ in range(_READ_ATTEMPTS):
+            before = self.seq()
+            if before & 1:
+                self.retries += 1
+                time.sleep(0)
+                continue
+            data = self._mm[:_DATA_END]
+            if self.seq() == before:
+                break
+            self.retries += 1
+        else:
+            return before, None
+        magic, _ = _HEAD.unpack_from(data)
+        if magic != _MAGIC or before == 0:
+            return before, None
+        version, last_ok, updated_at, pid, failures, watching, url_len, error_len = \
+            _BODY.unpack_from(data, _BODY_OFFSET)
+        offset = _BODY_OFFSET + _BODY.size
+        return before, {
+            "url": data[offset:offset + url_len].decode() or None,
+            "version": version if version >= 0 else None,
+            "last_ok": last_ok,
+            "updated_at": updated_at,
+            "pid": pid,
+            "failures": failures,
+            "watching": bool(watching),
+            "error": data[offset + _MAX_URL:offset + _MAX_URL + error_len].decode("utf-8", "replace") or None,
+        }
+
+    # ---------------- refresher ----------------
+    def elect(self):
+        """
+        Block until this process holds the refresher lock (for as long as
+        it lives).
+        """
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._lock_fd = fd
+
+    def write(self, url, version, last_ok, failures, watching, error):
+        """
+        Publish the refresher's state. Only the lock holder writes, so
+        writers never race each other.
+        """
+        url_bytes = (url or "").encode()[:_MAX_URL]
+        error_bytes = (error or "").encode("utf-8", "replace")[:_MAX_ERROR]
+        body = _BODY.pack(-1 if version is None else version, last_ok, time.time(), os.getpid(),
+                          failures, 1 if watching else 0, len(url_bytes), len(error_bytes))
+        offset = _BODY_OFFSET + _BODY.size
+        seq = self.seq()
+        seq += 1 if seq % 2 == 0 else 2   # recover from a writer that died mid-write
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, seq)
+        self._mm[0:4] = _MAGIC
+        self._mm[_BODY_OFFSET:offset] = body
+        self._mm[offset:offset + len(url_bytes)] = url_bytes
+        self._mm[offset + _MAX_URL:offset + _MAX_URL + len(error_bytes)] = error_bytes
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, seq + 1)
+        self.writes += 1
+
+    def stats(self):
+        seq, state = self.read()
+        return {
+            "path": self.path,
+            "role": "refresher" if self.leader else "follower",
+            "seq": seq,
+            "refresher_pid": state["pid"] if state else None,
+            "updated_at": state["updated_at"] if state else None,
+            "reads": self.reads,
+            "read_retries": self.retries,
+            "writes": self.writes,
+        }
@@ -0,0 +1,137 @@
+# ui_assets.py
+"""
+Precompressed, cacheable delivery of the UI.
+
+The page is rendered once at startup. Its inline <script> is split out into
+a content-hashed asset (/assets/app.<hash>.js) that browsers may cache for a
+year, while the small HTML shell is revalidated on every load. Each asset is
+stored as identity, gzip and (when the brotli package is installed) br
+variants, each with its own strong ETag, so a request costs a header parse
+and a dict lookup.
+"""
+import gzip
+import hashlib
+import re
+
+try:
+    import brotli
+except ImportError:  # br variants are skipped without the brotli package
+    brotli = None
+
+ASSET_PREFIX = "/assets/"
+# Hashed file names never change content
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# The HTML names the current assets, so it must be revalidated
+PAGE_CACHE_CONTROL = "no-cache"
+# Compressing bodies smaller than this is not worth the CPU on the client
+MIN_COMPRESS_BYTES = 256
+
+_INLINE_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S)
+
+
+class StaticAsset:
+    def __init__(self, body, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.digest = digest
+        self.variants = {None: (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = (gz, f'"{digest}-gz"')
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.variants["br"] = (br, f'"{digest}-br"')
+        self.etags = frozenset(etag for _, etag in self.variants.values())
+
+    def sizes(self):
+        return {enc or "identity": len(body) for enc, (body, _) in self.variants.items()}
+
+
+def _accepted_encodings(header):
+    """
+    {coding: q} from an Accept-Encoding header.
+    """
+    accepted = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(asset, accept_encoding):
+    """
+    Best stored variant the client accepts: br, then gzip, then identity.
+    """
+    accepted = _accepted_encodings(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for coding in ("br", "gzip"):
+        if coding not in asset.variants:
+            continue
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def _if_none_match(header):
+    if not header:
+        return ()
+    if header.strip() == "*":
+        return ("*",)
+    # Tags may come back weakened (W/) by a compressing proxy
+    return tuple(t.strip()[2:] if t.strip().startswith("W/") else t.strip() for t in header.split(","))
+
+
+def asset_response(asset, accept_encoding, if_none_match):
+    """
+    (status, headers, body) for a GET of the asset. A 304 is sent when the
+    client holds any variant: the bytes decode to the same content.
+    """
+    encoding = choose_encoding(asset, accept_encoding)
+    body, etag = asset.variants[encoding]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": asset.cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    tags = _if_none_match(if_none_match)
+    if "*" in tags or asset.etags.intersection(tags):
+        return 304, headers, b""
+    headers["Content-Type"] = asset.content_type
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return 200, headers, body
+
+
+def build_ui(html):
+    """
+    Split the rendered page into (page, {path: asset}): each inline script
+    becomes an immutable /assets/app.<hash>.js referenced from the page.
+    """
+    assets = {}
+
+    def extract(match):
+        script = StaticAsset(match.group(1).encode("utf-8"), "text/javascript; charset=utf-8",
+                             IMMUTABLE_CACHE_CONTROL)
+        path = f"{ASSET_PREFIX}app.{script.digest[:12]}.js"
+        assets[path] = script
+        return f'<script src="{path}"></script>'
+
+    html = _INLINE_SCRIPT.sub(extract, html)
+    page = StaticAsset(html.encode("utf-8"), "text/html; charset=utf-8", PAGE_CACHE_CONTROL)
+    return page, assets
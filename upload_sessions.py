@@ -0,0 +1,247 @@
+# upload_sessions.py
+"""
+Resumable chunked uploads for large recordings.
+
+A session is a directory under UPLOAD_SESSIONS_DIR holding meta.json, the
+audio file being assembled (preallocated to its final size) and one marker
+file per chunk that has been written completely. Chunks are streamed from
+the request straight to their offset in the audio file, so they may arrive
+in any order, in parallel and from any worker process; a chunk is only
+marked present after its last byte is on disk, so a dropped connection
+just leaves that chunk missing. Idle sessions expire after
+UPLOAD_SESSION_TTL_SEC.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from uploads import AudioUpload, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+UPLOAD_SESSIONS_DIR = os.getenv("UPLOAD_SESSIONS_DIR", os.path.join(tempfile.gettempdir(), "stt-uploads"))
+UPLOAD_SESSION_CHUNK_BYTES = int(os.getenv("UPLOAD_SESSION_CHUNK_BYTES", str(4 * 1024 * 1024)))
+UPLOAD_SESSION_MAX_CHUNK_BYTES = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_BYTES", str(32 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_SEC = float(os.getenv("UPLOAD_SESSION_TTL_SEC", "3600"))   # since last activity
+
+
+class SessionError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadSessionStore:
+    def __init__(self, root=UPLOAD_SESSIONS_DIR, ttl_sec=UPLOAD_SESSION_TTL_SEC):
+        self.root = root
+        self.ttl_sec = ttl_sec
+        self._reaper_started = False
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # ---------------- layout ----------------
+    def _dir(self, upload_id):
+        if not upload_id.isalnum():
+            raise SessionError("Upload session not found", 404)
+        return os.path.join(self.root, upload_id)
+
+    def _meta(self, upload_id):
+        try:
+            with open(os.path.join(self._dir(upload_id), "meta.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            raise SessionError("Upload session not found", 404)
+
+    def _touch(self, upload_id):
+        # Directory mtime = last activity, read by the reaper
+        try:
+            os.utime(self._dir(upload_id))
+        except FileNotFoundError:
+            pass
+
+    # ---------------- API ----------------
+    def create(self, size, chunk_size=None, model=None, options=None, filename=None, content_type=None):
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise SessionError("size must be a positive integer")
+        if size > MAX_UPLOAD_BYTES:
+            raise SessionError(f"Audio too large (max {MAX_UPLOAD_BYTES} bytes)", 413)
+        if chunk_size is None:
+            chunk_size = UPLOAD_SESSION_CHUNK_BYTES
+        if (not isinstance(chunk_size, int) or isinstance(chunk_size, bool)
+                or not 0 < chunk_size <= UPLOAD_SESSION_MAX_CHUNK_BYTES):
+            raise SessionError(f"chunk_size must be an integer 1..{UPLOAD_SESSION_MAX_CHUNK_BYTES}")
+        self.start()
+
+        upload_id = uuid.uuid4().hex
+        path = self._dir(upload_id)
+        os.makedirs(os.path.join(path, "chunks"))
+        with open(os.path.join(path, "audio"), "wb") as f:
+            f.truncate(size)        # sparse; chunks fill it in place
+        meta = {
+            "upload_id": upload_id,
+            "size": size,
+            "chunk_size": chunk_size,
+            "total_chunks": (size + chunk_size - 1) // chunk_size,
+            "model": model,
+            "options": options or {},
+            "filename": filename,
+            "content_type": content_type,
+            "created_at": time.time(),
+        }
+        fd, tmp = tempfile.mkstemp(dir=path)
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+        return meta
+
+    def chunk_range(self, meta, index):
+        if not 0 <= index < meta["total_chunks"]:
+            raise SessionError(f"Chunk index must be 0..{meta['total_chunks'] - 1}")
+        start = index * meta["chunk_size"]
+        return start, min(start + meta["chunk_size"], meta["size"])
+
+    def write_chunk(self, upload_id, index, stream, length, sha256=None):
+        """
+        Stream one chunk from a file-like body to its offset. The chunk must
+        have exactly its expected length; with sha256 (hex) it is verified
+        before being marked present. The body is staged in a temporary file
+        and only copied into place once it passed both checks, so a bad
+        re-send leaves the chunk missing instead of corrupting it.
+        """
+        meta = self._meta(upload_id)
+        if self._finalizing(upload_id):
+            raise SessionError("Upload is being finalized", 409)
+        start, end = self.chunk_range(meta, index)
+        if length is not None and length != end - start:
+            raise SessionError(f"Chunk {index} must be {end - start} bytes, got {length}")
+        path = self._dir(upload_id)
+        marker = os.path.join(path, "chunks", str(index))
+        # Missing until the new copy is verified and in place
+        try:
+            os.remove(marker)
+        except FileNotFoundError:
+            pass
+        digest = hashlib.sha256()
+        written = 0
+        with tempfile.TemporaryFile(dir=path) as staged:
+            while written < end - start:
+                piece = stream.read(min(UPLOAD_CHUNK_BYTES, end - start - written))
+                if not piece:
+                    break
+                staged.write(piece)
+                digest.update(piece)
+                written += len(piece)
+            if written == end - start and stream.read(1):
+                written += 1
+            if written != end - start:
+                raise SessionError(f"Chunk {index} must be {end - start} bytes")
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise SessionError(f"Chunk {index} checksum mismatch", 422)
+            staged.seek(0)
+            with open(os.path.join(path, "audio"), "r+b") as f:
+                f.seek(start)
+                shutil.copyfileobj(staged, f, UPLOAD_CHUNK_BYTES)
+        open(marker, "w").close()
+        self._touch(upload_id)
+        return self.status(upload_id, meta)
+
+    def status(self, upload_id, meta=None):
+        """
+        Which chunks (and so which byte ranges) are on disk.
+        """
+        meta = meta or self._meta(upload_id)
+        try:
+            present = sorted(int(n) for n in os.listdir(os.path.join(self._dir(upload_id), "chunks")))
+        except FileNotFoundError:
+            raise SessionError("Upload session not found", 404)
+        have = set(present)
+        missing = [i for i in range(meta["total_chunks"]) if i not in have]
+        ranges = []
+        for i in present:
+            start, end = self.chunk_range(meta, i)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        received = sum(end - start for start, end in ranges)
+        return {
+            "upload_id": upload_id,
+            "size": meta["size"],
+            "chunk_size": meta["chunk_size"],
+            "total_chunks": meta["total_chunks"],
+            "received_chunks": present,
+            "missing_chunks": missing,
+            "received_ranges": ranges,
+            "bytes_received": received,
+            "complete": not missing,
+            "model": meta["model"],
+        }
+
+    def _finalizing(self, upload_id):
+        return os.path.exists(os.path.join(self._dir(upload_id), "finalizing"))
+
+    def finalize(self, upload_id):
+        """
+        (meta, upload) for a complete session, claimed so that only one
+        caller gets it. Call release() if the transcription should be
+        retryable, discard() once the session is no longer needed.
+        """
+        meta = self._meta(upload_id)
+        state = self.status(upload_id, meta)
+        if not state["complete"]:
+            raise SessionError(f"Upload incomplete: {len(state['missing_chunks'])} chunk(s) missing", 409)
+        try:
+            fd = os.open(os.path.join(self._dir(upload_id), "finalizing"), os.O_CREAT | os.O_EXCL)
+            os.close(fd)
+        except FileExistsError:
+            raise SessionError("Upload is already being finalized", 409)
+        self._touch(upload_id)
+        f = open(os.path.join(self._dir(upload_id), "audio"), "rb")
+        return meta, AudioUpload(f, meta["size"], content_type=meta["content_type"],
+                                 filename=meta["filename"])
+
+    def release(self, upload_id):
+        try:
+            os.remove(os.path.join(self._dir(upload_id), "finalizing"))
+        except FileNotFoundError:
+            pass
+        self._touch(upload_id)
+
+    def discard(self, upload_id):
+        # Open handles (a transcription still reading) keep the data alive
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    # ---------------- expiry ----------------
+    def start(self):
+        with self._lock:
+            if self._reaper_started:
+                return
+            self._reaper_started = True
+        threading.Thread(target=self._reap_loop, name="upload-session-reaper", daemon=True).start()
+
+    def reap(self, now):
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                idle = now - os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if idle > self.ttl_sec:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(min(60.0, max(1.0, self.ttl_sec / 10)))
+            try:
+                self.reap(time.time())
+            except Exception as e:
+                print(f"Upload session reaper failed: {e}")
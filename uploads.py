@@ -0,0 +1,330 @@
+# uploads.py
+"""
+Audio upload handling for /transcribe-audio: bounded-memory spooling of the
+incoming body and streaming encoders for the upstream request body.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import json
+import os
+import tempfile
+from urllib.parse import urlencode
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))      # decoded audio
+UPLOAD_SPOOL_MAX_MEMORY = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY", str(1024 * 1024)))  # then disk
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(64 * 1024)))
+
+# Raw read size for base64 encoding; a multiple of 3 so chunks concatenate
+_B64_RAW_CHUNK = 3 * 16 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidAudio(Exception):
+    pass
+
+
+class AudioUpload:
+    """
+    Decoded audio bytes held in a SpooledTemporaryFile: in memory while small,
+    on disk above UPLOAD_SPOOL_MAX_MEMORY.
+    """
+
+    def __init__(self, fileobj, size, content_type=None, filename=None, sha256=None,
+                 borrowed=False):
+        self.file = fileobj
+        self.size = size
+        self.content_type = content_type
+        self.filename = filename
+        self._sha256 = sha256
+        # True when the file belongs to the request (closed when it ends)
+        self.borrowed = borrowed
+
+    def sha256(self):
+        """
+        Hex digest of the decoded audio (computed while spooling when possible).
+        """
+        if self._sha256 is None:
+            h = hashlib.sha256()
+            for chunk in self.iter_chunks():
+                h.update(chunk)
+            self._sha256 = h.hexdigest()
+        return self._sha256
+
+    def iter_chunks(self, chunk_size=UPLOAD_CHUNK_BYTES):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_base64(self):
+        for raw in self.iter_chunks(_B64_RAW_CHUNK):
+            yield base64.b64encode(raw)
+
+    def base64_len(self):
+        return 4 * ((self.size + 2) // 3)
+
+    def read_all(self):
+        self.file.seek(0)
+        return self.file.read()
+
+    def clone(self):
+        """
+        A second reader of the same bytes with its own position and
+        lifetime, which another thread may read alongside this one (e.g. a
+        hedged duplicate request). Small uploads are copied; a file on disk
+        is shared through a duplicated descriptor read with pread. Taking a
+        clone may move this upload's position, but cloning a clone never
+        does, so clone once up front and hand clones of it to other threads.
+        """
+        if isinstance(self.file, io.BytesIO):
+            fileobj = io.BytesIO(self.file.getvalue())     # does not move the position
+        elif self.size <= UPLOAD_SPOOL_MAX_MEMORY:
+            fileobj = io.BytesIO(self.read_all())
+        else:
+            try:
+                fileobj = _PreadFile(os.dup(self.file.fileno()))
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                fileobj = io.BytesIO(self.read_all())
+        return AudioUpload(fileobj, self.size, content_type=self.content_type,
+                           filename=self.filename, sha256=self._sha256)
+
+    def close(self):
+        try:
+            self.file.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _PreadFile:
+    """
+    Read-only file over its own descriptor with a private offset (pread),
+    so it never disturbs other readers of the same file.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.pos = 0
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            pos += os.fstat(self.fd).st_size
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(os.fstat(self.fd).st_size - self.pos, 0)
+        data = os.pread(self.fd, size, self.pos)
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _new_spool():
+    return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+
+
+class Spooler:
+    """
+    Incremental spooling for callers that receive the body in pieces (e.g.
+    an ASGI request stream): write() each chunk, then finish() -> AudioUpload.
+    """
+
+    def __init__(self, max_bytes=MAX_UPLOAD_BYTES, content_type=None, filename=None):
+        self.max_bytes = max_bytes
+        self.content_type = content_type
+        self.filename = filename
+        self.size = 0
+        self._spool = _new_spool()
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.abort()
+            raise UploadTooLarge(f"Audio exceeds {self.max_bytes} bytes")
+        self._hash.update(chunk)
+        self._spool.write(chunk)
+
+    def finish(self):
+        return AudioUpload(self._spool, self.size, content_type=self.content_type,
+                           filename=self.filename, sha256=self._hash.hexdigest())
+
+    def abort(self):
+        self._spool.close()
+
+
+def spool_stream(stream, max_bytes=MAX_UPLOAD_BYTES, content_type=None, filename=None):
+    """
+    Copy a readable stream into a spool in bounded chunks, enforcing max_bytes.
+    """
+    spooler = Spooler(max_bytes, content_type=content_type, filename=filename)
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            spooler.write(chunk)
+    except Exception:
+        spooler.abort()
+        raise
+    return spooler.finish()
+
+
+def wrap_file(fileobj, max_bytes=MAX_UPLOAD_BYTES, content_type=None, filename=None):
+    """
+    Use an already-spooled, seekable file (e.g. a multipart part that werkzeug
+    buffered) without copying it again.
+    """
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    if size > max_bytes:
+        raise UploadTooLarge(f"Audio exceeds {max_bytes} bytes")
+    return AudioUpload(fileobj, size, content_type=content_type, filename=filename, borrowed=True)
+
+
+def detach(upload):
+    """
+    An upload that may outlive the request: borrowed files are copied into
+    a spool of our own, owned ones are returned as-is.
+    """
+    if not upload.borrowed:
+        return upload
+    upload.file.seek(0)
+    return spool_stream(upload.file, max_bytes=upload.size,
+                        content_type=upload.content_type, filename=upload.filename)
+
+
+def from_bytes(data, content_type=None):
+    """
+    Small in-memory upload (e.g. one window of a longer clip).
+    """
+    return AudioUpload(io.BytesIO(data), len(data), content_type=content_type)
+
+
+def spool_base64(audio_b64, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Legacy JSON path: decode an audio_base64 string into a spool.
+    """
+    if isinstance(audio_b64, str):
+        audio_b64 = audio_b64.encode("ascii", "ignore")
+    if (len(audio_b64) * 3) // 4 > max_bytes + 2:
+        raise UploadTooLarge(f"Audio exceeds {max_bytes} bytes")
+    spool = _new_spool()
+    try:
+        raw = base64.b64decode(audio_b64, validate=False)
+    except (binascii.Error, ValueError) as e:
+        spool.close()
+        raise InvalidAudio(f"Invalid audio_base64: {e}")
+    spool.write(raw)
+    return AudioUpload(spool, len(raw), sha256=hashlib.sha256(raw).hexdigest())
+
+
+# -----------------------------------------------------------------------------
+# Streaming request bodies
+# -----------------------------------------------------------------------------
+class StreamingBody:
+    """
+    File-like request body of known length built from an iterator of byte
+    parts. requests sends it with a Content-Length and reads it piecewise,
+    so the full body never exists in memory.
+    """
+
+    def __init__(self, parts, length):
+        self._parts = iter(parts)
+        self._buf = b""
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            out = self._buf + b"".join(self._parts)
+            self._buf = b""
+            return out
+        while len(self._buf) < size:
+            try:
+                self._buf += next(self._parts)
+            except StopIteration:
+                break
+        out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+
+def json_body(upload, params):
+    """
+    Stream {"audio_base64": "<b64>", **params} as the JSON upstream body.
+    """
+    head = b'{"audio_base64": "'
+    rest = json.dumps(params).encode()
+    tail = b'", ' + rest[1:] if len(rest) > 2 else b'"}'
+
+    def parts():
+        yield head
+        yield from upload.iter_base64()
+        yield tail
+
+    return StreamingBody(parts(), len(head) + upload.base64_len() + len(tail))
+
+
+def _form_quote_b64(chunk):
+    return chunk.replace(b"+", b"%2B").replace(b"/", b"%2F").replace(b"=", b"%3D")
+
+
+def form_body(upload, params):
+    """
+    Stream the same payload urlencoded (booleans/numbers -> strings).
+    """
+    head = b"audio_base64="
+    fields = {k: (str(v).lower() if isinstance(v, bool) else str(v)) for k, v in params.items()}
+    tail = (b"&" + urlencode(fields).encode()) if fields else b""
+
+    # Quoting grows the body by 2 bytes per '+', '/' and '='; count them first
+    quoted_len = 0
+    for chunk in upload.iter_base64():
+        quoted_len += len(chunk) + 2 * (chunk.count(b"+") + chunk.count(b"/") + chunk.count(b"="))
+
+    def parts():
+        yield head
+        for chunk in upload.iter_base64():
+            yield _form_quote_b64(chunk)
+        yield tail
+
+    return StreamingBody(parts(), len(head) + quoted_len + len(tail))
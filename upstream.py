@@ -0,0 +1,259 @@
+# upstream.py
+"""
+Shared, connection-pooled HTTP sessions for the webapp's outbound calls
+(transcription backend through ngrok, and the ngrok URL service).
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+UPSTREAM_POOL_CONNECTIONS = int(os.getenv("UPSTREAM_POOL_CONNECTIONS", "4"))   # hosts kept pooled
+UPSTREAM_POOL_MAXSIZE = int(os.getenv("UPSTREAM_POOL_MAXSIZE", "16"))          # connections per host
+UPSTREAM_POOL_BLOCK = os.getenv("UPSTREAM_POOL_BLOCK", "0").strip().lower() in ("1", "true", "yes")
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "120"))
+SERVICE_CONNECT_TIMEOUT = float(os.getenv("SERVICE_CONNECT_TIMEOUT", "5"))
+SERVICE_READ_TIMEOUT = float(os.getenv("SERVICE_READ_TIMEOUT", "10"))
+
+
+def origin_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class SessionPool:
+    """
+    One keep-alive requests.Session shared by all threads of a worker.
+
+    urllib3's pools are thread-safe, so threads share the session; rebuild()
+    swaps in a fresh one (e.g. when ngrok_url points at a new tunnel) while
+    requests already running finish on the old one.
+    """
+
+    def __init__(self, name, pool_connections, pool_maxsize, connect_timeout, read_timeout,
+                 pool_block=False):
+        self.name = name
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._origins = frozenset()
+        self._rebuilds = 0
+        # connection/request totals of sessions that were already retired
+        self._retired = {"connections": 0, "requests": 0}
+        self._session = self._build()
+
+    def _build(self):
+        s = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+        )
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        return s
+
+    @staticmethod
+    def _counts(session):
+        conns = reqs = 0
+        # http:// and https:// are mounted on the same adapter; count it once
+        adapters = {id(a): a for a in session.adapters.values()}.values()
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                conns += getattr(pool, "num_connections", 0)
+                reqs += getattr(pool, "num_requests", 0)
+        return conns, reqs
+
+    def rebuild(self):
+        with self._lock:
+            old = self._session
+            conns, reqs = self._counts(old)
+            self._retired["connections"] += conns
+            self._retired["requests"] += reqs
+            self._session = self._build()
+            self._rebuilds += 1
+        old.close()
+
+    def use_origin(self, url):
+        """
+        Rebuild when the target origin changes (new tunnel), so we never keep
+        dead keep-alive sockets to an old ngrok host around.
+        """
+        self.use_origins([url])
+
+    def use_origins(self, urls):
+        """
+        Several backends at once: rebuild only when a previously used origin
+        went away, and keep at least one pooled host per origin.
+        """
+        origins = frozenset(origin_of(u) for u in urls)
+        with self._lock:
+            if self._origins == origins:
+                return
+            changed = bool(self._origins - origins)
+            self._origins = origins
+            if len(origins) > self.pool_connections:
+                self.pool_connections = len(origins)
+                changed = True
+        if changed:
+            self.rebuild()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            conns, reqs = self._counts(self._session)
+            conns += self._retired["connections"]
+            reqs += self._retired["requests"]
+            rebuilds = self._rebuilds
+            origins = sorted(self._origins)
+        reused = max(reqs - conns, 0)
+        return {
+            "name": self.name,
+            "origin": origins[0] if len(origins) == 1 else None,
+            "origins": origins,
+            "requests": reqs,
+            "new_connections": conns,
+            "reused_connections": reused,
+            "reuse_rate": round(reused / reqs, 4) if reqs else None,
+            "rebuilds": rebuilds,
+            "pool_maxsize": self.pool_maxsize,
+            "timeout": {"connect": self.timeout[0], "read": self.timeout[1]},
+        }
+
+
+# Transcription backend (through the ngrok tunnel)
+upstream_http = SessionPool(
+    "upstream",
+    UPSTREAM_POOL_CONNECTIONS,
+    UPSTREAM_POOL_MAXSIZE,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    pool_block=UPSTREAM_POOL_BLOCK,
+)
+
+# ngrok URL service (dbapi)
+service_http = SessionPool(
+    "service",
+    1,
+    UPSTREAM_POOL_MAXSIZE,
+    SERVICE_CONNECT_TIMEOUT,
+    SERVICE_READ_TIMEOUT,
+)
+
+
+# -----------------------------------------------------------------------------
+# Upstream protocol memory
+# -----------------------------------------------------------------------------
+JSON, FORM = "json", "form"
+# Statuses that mean "wrong body encoding for this backend"
+ENCODING_REJECTED = (400, 415)
+UPSTREAM_PROTOCOL_PROBE = os.getenv("UPSTREAM_PROTOCOL_PROBE", "0").strip().lower() in ("1", "true", "yes")
+
+
+class ProtocolMemory:
+    """
+    Remembers which body encoding (JSON or form) each upstream endpoint
+    accepted, so form-only backends are not sent every clip twice.
+    Keyed by origin + path; reset when ngrok_url moves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._learned = {}
+        self.counters = {"requests": 0, "fallbacks": 0, "learned": 0, "resets": 0, "probes": 0}
+
+    @staticmethod
+    def key(target):
+        parts = urlsplit(target)
+        return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+    def order(self, target):
+        """
+        Encodings to try, learned one first (JSON when nothing is known).
+        """
+        with self._lock:
+            self.counters["requests"] += 1
+            first = self._learned.get(self.key(target), JSON)
+        return (first, FORM if first == JSON else JSON)
+
+    def learn(self, target, encoding):
+        with self._lock:
+            k = self.key(target)
+            if self._learned.get(k) != encoding:
+                self._learned[k] = encoding
+                self.counters["learned"] += 1
+
+    def forget(self, origin):
+        """
+        Drop what was learned for one backend (its tunnel moved).
+        """
+        with self._lock:
+            for k in [k for k in self._learned if origin_of(k) == origin]:
+                del self._learned[k]
+
+    def record_fallback(self):
+        with self._lock:
+            self.counters["fallbacks"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._learned.clear()
+            self.counters["resets"] += 1
+
+    def probe(self, base, paths, session):
+        """
+        Learn each endpoint's encoding up front with two tiny requests (an
+        empty clip as JSON, then as form) instead of a real upload. Only a
+        2xx, or a 415 for exactly one of the two encodings, counts; any
+        other answer (an empty clip may well get 400/422/500) leaves the
+        endpoint unlearned, to be learned from real traffic.
+        """
+        for path in paths:
+            target = base + path
+            with self._lock:
+                self.counters["probes"] += 1
+            try:
+                as_json = session.post(target, json={"audio_base64": ""}).status_code
+                if 200 <= as_json < 300:
+                    self.learn(target, JSON)
+                    continue
+                as_form = session.post(target, data={"audio_base64": ""}).status_code
+                if 200 <= as_form < 300:
+                    self.learn(target, FORM)
+                elif (as_json == 415) != (as_form == 415):
+                    self.learn(target, FORM if as_json == 415 else JSON)
+            except requests.exceptions.RequestException as e:
+                print(f"Protocol probe failed for {target}: {e}")
+
+    def stats(self):
+        with self._lock:
+            reqs = self.counters["requests"]
+            return dict(
+                self.counters,
+                fallback_rate=round(self.counters["fallbacks"] / reqs, 4) if reqs else None,
+                learned_endpoints=dict(self._learned),
+            )
+
+
+upstream_protocol = ProtocolMemory()
@@ -1,76 +1,238 @@
 # app.py
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, Response, make_response, render_template_string, request, jsonify, g
 from flask_cors import CORS
 import requests
 import os
-from threading import Thread
+import json
+import contextvars
+import queue
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
+from urllib.parse import urlsplit
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from upstream import (
+    upstream_http, service_http, upstream_protocol, origin_of,
+    JSON, FORM, ENCODING_REJECTED, UPSTREAM_PROTOCOL_PROBE,
+)
+from backends import (
+    BackendPool, registry_url, BACKENDS_FETCH_URL, BACKENDS_REFRESH_SEC,
+    BACKEND_FAILOVER_ATTEMPTS, UNHEALTHY_STATUSES,
+)
+from jobs import JobRunner, QueueFull, public_view
+from admission import admission, AdmissionRejected, estimate_audio_sec
+from batch import BatchRun, BatchItem, manifest_items, BATCH_MAX_ITEMS, RETRYABLE_STATUSES
+from upload_sessions import UploadSessionStore, SessionError
+from result_cache import result_cache, cache_key
+from ui_assets import build_ui, asset_response, ASSET_PREFIX
+from live import live_streams
+from hedging import hedger
+import tracing
+from history import HistoryWriter, history_base_url, history_entry, history_body, HISTORY_URL
+from tunnel import TunnelResolver, NGROK_FETCH_URL, NGROK_WATCH_SEC
+from tunnel_state import SharedTunnelState
+from uploads import (
+    MAX_UPLOAD_BYTES, UploadTooLarge, InvalidAudio,
+    spool_stream, spool_base64, wrap_file, from_bytes, detach, json_body, form_body,
+)
+from audio import (
+    wav_info, plan_windows, read_window_wav, normalize_upload, trim_silence, map_time,
+    NORMALIZE_ENABLED,
+)
+import metrics
+from metrics import Counter, Gauge, Histogram, BYTES_BUCKETS
 
 # -----------------------------------------------------------------------------
 # Flask app
 # -----------------------------------------------------------------------------
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["Server-Timing", tracing.TRACE_HEADER])
+# Whole-body cap; legacy JSON bodies carry base64 (+33%) around the audio
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES * 4 // 3 + 1024 * 1024
+
+# -----------------------------------------------------------------------------
+# Transcription config
+# -----------------------------------------------------------------------------
+# Upstream endpoints (probed for JSON/form support when UPSTREAM_PROTOCOL_PROBE=1)
+UPSTREAM_PATHS = ("/transcribe", "/transcribe-2step")
+# Server-side fan-out of long PCM WAV clips (transcribe-2step): windows of
+# chunk_sec with overlap_sec are sent upstream concurrently
+FANOUT_ENABLED = os.getenv("FANOUT_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+FANOUT_PARALLELISM = int(os.getenv("FANOUT_PARALLELISM", "4"))
+# Longest run of words repeated across a window boundary that is de-duplicated
+OVERLAP_DEDUP_MAX_WORDS = int(os.getenv("OVERLAP_DEDUP_MAX_WORDS", "12"))
+# Idle interval after which a streaming response sends a heartbeat event
+STREAM_HEARTBEAT_SEC = float(os.getenv("STREAM_HEARTBEAT_SEC", "15"))
+# Voice-activity trimming before the upstream call (?vad=1/0 per request).
+# Leading/trailing silence is always cut; with max_gap_sec, internal pauses
+# longer than that are shortened to keep_gap_sec as well (None keeps them).
+VAD_ENABLED = os.getenv("VAD_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+VAD_MAX_GAP_SEC = float(os.getenv("VAD_MAX_GAP_SEC", "2.0"))
+VAD_MODEL_SETTINGS = {
+    "transcribe": {"enabled": VAD_ENABLED, "max_gap_sec": None},
+    "transcribe-2step": {"enabled": VAD_ENABLED, "max_gap_sec": VAD_MAX_GAP_SEC, "keep_gap_sec": 0.5},
+}
+
+# -----------------------------------------------------------------------------
+# Metrics (Prometheus text at /metrics; METRICS_MULTIPROC_DIR merges workers)
+# -----------------------------------------------------------------------------
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ("route", "method", "status"))
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests currently being handled", ("route",))
+HTTP_REQUEST_BYTES = Histogram(
+    "http_request_bytes", "Request body size", ("route",), buckets=BYTES_BUCKETS)
+HTTP_RESPONSE_BYTES = Histogram(
+    "http_response_bytes", "Response body size (non-streamed)", ("route",), buckets=BYTES_BUCKETS)
+TRANSCRIBE_LATENCY = Histogram(
+    "transcribe_duration_seconds", "End-to-end transcription latency by model",
+    ("model", "status"))
+TRANSCRIBE_IN_FLIGHT = Gauge(
+    "transcribe_in_flight", "Transcriptions in progress", ("model",))
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Upstream call latency", ("endpoint", "encoding"))
+UPSTREAM_RESPONSES = Counter(
+    "upstream_responses_total", "Upstream responses by status (or timeout/error)",
+    ("endpoint", "status"))
+UPSTREAM_FORM_FALLBACKS = Counter(
+    "upstream_encoding_fallbacks_total", "Retries with the other body encoding after 400/415",
+    ("endpoint",))
+AUDIO_NORMALIZE = Counter(
+    "audio_normalize_total", "Uploads by normalization outcome (normalized/passthrough/...)",
+    ("action",))
+AUDIO_NORMALIZE_BYTES = Counter(
+    "audio_normalize_bytes_total", "Audio bytes before (in) and after (out) normalization",
+    ("direction",))
+AUDIO_VAD = Counter(
+    "audio_vad_total", "Uploads by silence-trimming outcome (trimmed/no_gain/no_speech/...)",
+    ("model", "action"))
+AUDIO_VAD_SECONDS = Counter(
+    "audio_vad_seconds_total", "Audio seconds seen (in) and cut (removed) by silence trimming",
+    ("model", "direction"))
+TUNNEL_URL_AGE = Gauge(
+    "tunnel_url_age_seconds", "Seconds since ngrok_url was last confirmed", mode="min")
+TUNNEL_URL_AGE.set_function(lambda: time.time() - ngrok_url_last_ok if ngrok_url_last_ok else None)
+metrics.start_flusher()
 
 # -----------------------------------------------------------------------------
 # Ngrok URL state (cached, but we can fetch fresh on demand)
 # -----------------------------------------------------------------------------
 ngrok_url = None
 ngrok_url_last_ok = 0.0  # epoch seconds when last successfully updated
+_backend_origins = set()
+_backend_origins_lock = Lock()
 
-def get_ngrok_tunnel_url_from_service():
+def _backends_changed(urls):
     """
-    Fetch ngrok URL from external service endpoint that returns:
-      { "ngrok_url": "https://abcd-1234.ngrok-free.app" }
+    A backend was added/removed or its tunnel moved. Pooled upstream
+    connections to vanished origins are dropped and the learned JSON/form
+    encoding of those origins is forgotten (new ones optionally probed).
     """
-    fetch_url = os.getenv(
-        "NGROK_FETCH_URL",
-        "https://diamonwall-speech-to-text.onrender.com/get_ngrok_url"
-    ).strip()
-
-    try:
-        resp = requests.get(fetch_url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        url = data.get("ngrok_url")
-        if isinstance(url, str) and url:
-            return url
-        print("Error: 'ngrok_url' not found or empty in service response.")
-        return None
-    except Exception as e:
-        print(f"Failed to fetch ngrok URL from service: {e}")
-        return None
+    global _backend_origins
+    origins = {origin_of(u) for u in urls}
+    with _backend_origins_lock:
+        previous, _backend_origins = _backend_origins, origins
+    upstream_http.use_origins(urls)
+    for gone in previous - origins:
+        upstream_protocol.forget(gone)
+    if UPSTREAM_PROTOCOL_PROBE:
+        for origin in origins - previous:
+            Thread(
+                target=upstream_protocol.probe,
+                args=(origin, UPSTREAM_PATHS, upstream_http),
+                daemon=True,
+            ).start()
+
+# Backends from dbapi's registry plus the tunnel URL below as "default"
+backend_pool = BackendPool(on_change=_backends_changed)
+
+def set_ngrok_url(url):
+    """
+    Record a freshly resolved tunnel URL; it is routed to as backend
+    "default" alongside the registered ones.
+    """
+    global ngrok_url, ngrok_url_last_ok
+    ngrok_url = url
+    ngrok_url_last_ok = time.time()
+    backend_pool.set_default(url)
+
+# One resolver per process, shared by the poller and /get_ngrok_url; across
+# the worker processes of a host it mirrors one elected refresher.
+# NGROK_URL (env) pins the URL and disables fetching.
+tunnel_resolver = TunnelResolver(
+    service_http,
+    fixed_url=os.getenv("NGROK_URL", "").strip(),
+    on_update=set_ngrok_url,
+    shared=SharedTunnelState.for_url(NGROK_FETCH_URL),
+)
 
 def fetch_ngrok_url_periodically():
     """
-    Optional: keep polling in the background.
+    Keep the tunnel URL current in the background: long-poll dbapi's
+    /watch_ngrok_url (a rotation arrives within a round trip), or poll
+    every NGROK_REFRESH_SEC when the service has no watch endpoint.
+    With shared state only the elected worker does this; the others
+    follow what it publishes until they are elected in turn.
     If NGROK_URL is set, prefer it and do not poll.
     """
-    global ngrok_url, ngrok_url_last_ok
-
-    fixed = os.getenv("NGROK_URL", "").strip()
-    if fixed:
-        ngrok_url = fixed
-        ngrok_url_last_ok = time.time()
+    if tunnel_resolver.fixed_url:
+        set_ngrok_url(tunnel_resolver.fixed_url)
         print(f"Using NGROK_URL from environment: {ngrok_url}")
         return
 
+    if tunnel_resolver.shared is not None:
+        Thread(target=tunnel_resolver.follow, daemon=True).start()
+        tunnel_resolver.become_refresher()
+        print(f"Elected ngrok URL refresher (pid {os.getpid()})")
+
+    if NGROK_WATCH_SEC > 0:
+        print("Starting ngrok URL watch...")
+        while tunnel_resolver.watch_supported:
+            outcome = tunnel_resolver.watch()
+            if outcome == "changed":
+                print(f"Updated ngrok URL (watch): {ngrok_url}")
+            elif outcome == "error":
+                time.sleep(max(0.0, tunnel_resolver.next_attempt_at - time.monotonic()))
+
     interval_sec = int(os.getenv("NGROK_REFRESH_SEC", "30"))
     print("Starting ngrok URL poller...")
     while True:
-        url = get_ngrok_tunnel_url_from_service()
-        if url:
-            ngrok_url = url
-            ngrok_url_last_ok = time.time()
+        if tunnel_resolver.refresh():
             print(f"Updated ngrok URL (poller): {ngrok_url}")
         else:
             print("Poller: could not update ngrok URL. Retrying...")
         time.sleep(interval_sec)
 
-# Start poller as a convenience (safe to keep; endpoint also fetches fresh)
+# Start poller as a convenience (shares the resolver with /get_ngrok_url)
 url_fetch_thread = Thread(target=fetch_ngrok_url_periodically, daemon=True)
 url_fetch_thread.start()
 
+def fetch_backends_periodically():
+    """
+    Keep the backend registry in sync with dbapi (conditional GETs). A pinned
+    NGROK_URL means local development; the registry is then only polled
+    when BACKENDS_FETCH_URL is set explicitly.
+    """
+    if BACKENDS_REFRESH_SEC <= 0 or (tunnel_resolver.fixed_url and not BACKENDS_FETCH_URL):
+        return
+    fetch_url = registry_url(NGROK_FETCH_URL)
+    while True:
+        backend_pool.refresh(service_http, fetch_url)
+        time.sleep(BACKENDS_REFRESH_SEC)
+
+backends_fetch_thread = Thread(target=fetch_backends_periodically, daemon=True)
+backends_fetch_thread.start()
+
+# Transcription history in dbapi (write-behind). Like the registry, a pinned
+# NGROK_URL only talks to dbapi when HISTORY_URL is set explicitly.
+transcription_history = HistoryWriter(
+    service_http,
+    history_base_url(NGROK_FETCH_URL) if HISTORY_URL or not tunnel_resolver.fixed_url else None,
+)
+
 # -----------------------------------------------------------------------------
 # HTML (UI)
 # -----------------------------------------------------------------------------
@@ -183,6 +345,11 @@ HTML_TEMPLATE = r"""
                 <polygon points="5 3 19 12 5 21 5 3"/>
               </svg>
             </button>
+            <button type="button" id="liveButton" onclick="live ? stopLive() : startLive()"
+                    title="Transcribe while you speak"
+                    class="flex items-center justify-center h-12 px-4 rounded-full bg-emerald-500 hover:bg-emerald-600 text-white text-sm font-semibold shadow-lg transition-all duration-300">
+              Live
+            </button>
           </div>
           <p id="recordingStatus" class="mt-2 text-sm text-red-500 animate-pulse" style="display: none;">Recording...</p>
           <div id="audioPlayerContainer" class="mt-4 w-full" style="display: none;">
@@ -232,6 +399,7 @@ HTML_TEMPLATE = r"""
           <div class="inline-flex items-center px-2 py-0.5 text-xs font-semibold rounded-full bg-emerald-100 text-emerald-700">EN (Two-step)</div>
           <p id="translationEnText" class="mt-2 text-gray-700 whitespace-pre-wrap"></p>
         </div>
+        <p id="timingMeta" class="text-xs text-gray-500 whitespace-pre-line"></p>
       </div>
     </div>
   </div>
@@ -243,7 +411,12 @@ HTML_TEMPLATE = r"""
            viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
         <path d="M21 12a9 9 0 1 1-6.219-8.56"/>
       </svg>
-      <span class="font-semibold text-gray-700">Processing… please wait</span>
+      <span id="waitingText" class="font-semibold text-gray-700">Processing… please wait</span>
+      <button type="button" id="cancelJobButton" onclick="cancelJob()"
+              class="ml-2 px-3 py-1.5 rounded-lg bg-gray-200 hover:bg-gray-300 text-gray-700 text-sm font-medium transition"
+              style="display: none;">
+        Cancel
+      </button>
     </div>
   </div>
 
@@ -254,7 +427,17 @@ HTML_TEMPLATE = r"""
   let recordedAudioBlob = null;
   let mediaRecorder = null;
   let audioChunks = [];
+  let currentJobId = null;
+  let live = null;
   const API_BASE_URL = window.location.origin;
+  const JOB_POLL_WAIT_SEC = 25;  // server-side long-poll per status request
+  // Files above this go up as a resumable session of chunks
+  const RESUMABLE_THRESHOLD_BYTES = 8 * 1024 * 1024;
+  const RESUMABLE_PARALLEL = 3;
+  const RESUMABLE_CHUNK_RETRIES = 5;
+  // Live mode: 16 kHz 16-bit PCM over a WebSocket, ~250 ms per frame
+  const LIVE_SAMPLE_RATE = 16000;
+  const LIVE_FRAME_SEC = 0.25;
 
   // -------------------- DOM --------------------
   const fileInput = document.getElementById('file-upload');
@@ -273,11 +456,15 @@ HTML_TEMPLATE = r"""
   const transcriptionText = document.getElementById('transcriptionText');
   const translationEnBox = document.getElementById('translationEnBox');
   const translationEnText = document.getElementById('translationEnText');
+  const timingMeta = document.getElementById('timingMeta');
   const ngrokUrlElement = document.getElementById('apiUrl');
   const apiUrlMeta = document.getElementById('apiUrlMeta');
   const modelSelect = document.getElementById('model');
   const waitingOverlay = document.getElementById('waitingOverlay');
+  const waitingText = document.getElementById('waitingText');
+  const cancelJobButton = document.getElementById('cancelJobButton');
   const playUploadedBtn = document.getElementById('playUploadedBtn');
+  const liveButton = document.getElementById('liveButton');
 
   // -------------------- Init --------------------
   updateSubmitButtonState();
@@ -450,50 +637,62 @@ HTML_TEMPLATE = r"""
       </svg>`;
 
     try {
-      const reader = new FileReader();
-      reader.readAsDataURL(audioSource);
-      reader.onloadend = async () => {
-        const base64Audio = reader.result.split(',')[1];
-        const model = modelSelect.value;
-
-        const resp = await fetch(`${API_BASE_URL}/transcribe-audio`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ audio_base64: base64Audio, model })
-        });
-
-        const data = await resp.json();
-        if (data.transcription) {
-          transcriptionText.textContent = data.transcription;
-        } else {
-          transcriptionText.textContent = 'Error: ' + (data.error || 'Unknown error');
-        }
-
-        // Show English (two-step) if provided
-        if (data.translation_en) {
-          translationEnText.textContent = data.translation_en;
-          translationEnBox.style.display = 'block';
-        } else {
-          translationEnBox.style.display = 'none';
-        }
+      // Binary multipart upload: the browser streams the blob as-is
+      // (no base64 / JSON re-encoding of the audio).
+      const model = modelSelect.value;
+      const formData = new FormData();
+      formData.append('model', model);
+      formData.append('audio', audioSource, audioSource.name || 'recording.wav');
+
+      // Stream mode renders each chunk as it is transcribed; browsers without
+      // streaming fetch bodies use job mode (submit, then long-poll status).
+      timingMeta.textContent = '';
+      const streaming = window.ReadableStream && 'getReader' in ReadableStream.prototype;
+      let data;
+      if (audioSource.size > RESUMABLE_THRESHOLD_BYTES) {
+        // Large file: chunks survive a dropped connection; finalize transcribes
+        const uploadId = await uploadResumable(audioSource, model);
+        const finalizeUrl = `${API_BASE_URL}/uploads/${uploadId}/finalize`;
+        waitingText.textContent = 'Processing… please wait';
+        data = streaming
+          ? await runTranscriptionStream(null, `${finalizeUrl}?mode=stream`)
+          : await runTranscriptionJob(null, `${finalizeUrl}?mode=job`);
+        if (!data.error) forgetResumable(audioSource);
+      } else {
+        data = streaming
+          ? await runTranscriptionStream(formData)
+          : await runTranscriptionJob(formData);
+      }
+      if (data.transcription) {
+        transcriptionText.textContent = data.transcription;
+      } else {
+        transcriptionText.textContent = 'Error: ' + (data.error || 'Unknown error');
+      }
+
+      // Show English (two-step) if provided
+      if (data.translation_en) {
+        translationEnText.textContent = data.translation_en;
+        translationEnBox.style.display = 'block';
+      } else {
+        translationEnBox.style.display = 'none';
+      }
 
-        transcriptionOutput.style.display = 'block';
+      transcriptionOutput.style.display = 'block';
 
-        updateSubmitButtonState();
-        submitText.textContent = 'Transcribe Audio';
-        submitIcon.innerHTML = `
-          <svg xmlns="http://www.w3.org/2000/svg" width="24" height="24"
-               viewBox="0 0 24 24" fill="none" stroke="currentColor"
-               stroke-width="2" stroke-linecap="round" stroke-linejoin="round"
-               class="mr-2">
-            <path d="M15 2H6a2 2 0 0 0-2 2v16a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V7Z"/>
-            <path d="M14 2v4a2 2 0 0 0 2 2h4"/>
-            <line x1="16" x2="8" y1="13" y2="13"/>
-            <line x1="16" x2="8" y1="17" y2="17"/>
-            <line x1="10" x2="8" y1="9" y2="9"/>
-          </svg>`;
-        toggleWaiting(false);
-      };
+      updateSubmitButtonState();
+      submitText.textContent = 'Transcribe Audio';
+      submitIcon.innerHTML = `
+        <svg xmlns="http://www.w3.org/2000/svg" width="24" height="24"
+             viewBox="0 0 24 24" fill="none" stroke="currentColor"
+             stroke-width="2" stroke-linecap="round" stroke-linejoin="round"
+             class="mr-2">
+          <path d="M15 2H6a2 2 0 0 0-2 2v16a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V7Z"/>
+          <path d="M14 2v4a2 2 0 0 0 2 2h4"/>
+          <line x1="16" x2="8" y1="13" y2="13"/>
+          <line x1="16" x2="8" y1="17" y2="17"/>
+          <line x1="10" x2="8" y1="9" y2="9"/>
+        </svg>`;
+      toggleWaiting(false);
     } catch (error) {
       console.error('Error during transcription:', error);
       transcriptionText.textContent = 'An unexpected error occurred.';
@@ -513,199 +712,1369 @@ HTML_TEMPLATE = r"""
     }
   });
 
+  // ------------- Streaming -------------
+  function renderPartial(ev) {
+    if (ev.transcription_so_far) transcriptionText.textContent = ev.transcription_so_far;
+    if (ev.translation_en_so_far) {
+      translationEnText.textContent = ev.translation_en_so_far;
+      translationEnBox.style.display = 'block';
+    }
+    timingMeta.textContent = `chunk ${ev.index + 1}/${ev.total} • ${ev.elapsed_ms} ms`;
+    transcriptionOutput.style.display = 'block';
+  }
+
+  // "parse;dur=12.5, upstream-1;dur=340;desc=\"json host\", total;dur=360"
+  // -> "parse 13 • upstream-1 340 • total 360 ms"
+  function formatServerTiming(header) {
+    if (!header) return '';
+    return header.split(',').map((entry) => {
+      const [name, ...params] = entry.trim().split(';');
+      const dur = params.map((p) => p.trim()).find((p) => p.startsWith('dur='));
+      return dur ? `${name} ${Math.round(parseFloat(dur.slice(4)))}` : name;
+    }).join(' • ') + ' ms';
+  }
+
+  function showServerTiming(header, traceId) {
+    if (!header) return;
+    timingMeta.textContent += (timingMeta.textContent ? '\n' : '') + 'server: ' + formatServerTiming(header);
+    timingMeta.title = traceId ? `trace ${traceId}` : '';
+  }
+
+  async function runTranscriptionStream(formData, url = `${API_BASE_URL}/transcribe-audio?mode=stream`) {
+    const started = performance.now();
+    let firstTextMs = null;
+    const resp = await fetch(url, {
+      method: 'POST',
+      body: formData
+    });
+    // Headers arrive once the server has read the whole upload
+    const headersMs = Math.round(performance.now() - started);
+    const ctype = resp.headers.get('Content-Type') || '';
+    if (!resp.ok || !ctype.includes('ndjson')) {
+      showServerTiming(resp.headers.get('Server-Timing'), resp.headers.get('X-Trace-Id'));
+      return await resp.json();
+    }
+
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    let final = null;
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffered += decoder.decode(value, { stream: true });
+      let nl;
+      while ((nl = buffered.indexOf('\n')) >= 0) {
+        const line = buffered.slice(0, nl).trim();
+        buffered = buffered.slice(nl + 1);
+        if (!line) continue;
+        const ev = JSON.parse(line);
+        if (ev.event === 'partial') {
+          if (firstTextMs === null) {
+            firstTextMs = Math.round(performance.now() - started);
+            // text is on screen now; stop blocking the page
+            waitingOverlay.classList.add('hidden');
+            waitingOverlay.classList.remove('flex');
+          }
+          renderPartial(ev);
+        } else if (ev.event === 'final' || ev.event === 'error') {
+          final = ev;
+        }
+      }
+    }
+    if (!final) return { error: 'Stream ended before a result was received' };
+    const totalMs = Math.round(performance.now() - started);
+    if (firstTextMs === null) firstTextMs = totalMs;
+    timingMeta.textContent =
+      `upload: ${headersMs} ms • first text: ${firstTextMs} ms • total: ${totalMs} ms` +
+      (final.time_to_first_text_ms != null
+        ? ` (server: ${final.time_to_first_text_ms} / ${final.total_ms} ms)` : '');
+    showServerTiming(final.server_timing, final.trace_id);
+    return final;
+  }
+
+  // ------------- Jobs -------------
+  async function runTranscriptionJob(formData, url = `${API_BASE_URL}/transcribe-audio?mode=job`) {
+    const submitResp = await fetch(url, {
+      method: 'POST',
+      body: formData
+    });
+    const submitted = await submitResp.json();
+    if (!submitted.job_id) return submitted;
+
+    currentJobId = submitted.job_id;
+    cancelJobButton.style.display = 'inline-flex';
+    try {
+      while (true) {
+        const resp = await fetch(`${API_BASE_URL}/jobs/${submitted.job_id}?wait=${JOB_POLL_WAIT_SEC}`);
+        const job = await resp.json();
+        if (!resp.ok) return job;
+        if (job.status === 'queued') waitingText.textContent = 'Queued… please wait';
+        if (job.status === 'running') waitingText.textContent = 'Processing… please wait';
+        if (job.status === 'done' || job.status === 'failed') return job.result || {};
+        if (job.status === 'cancelled') return { error: 'Cancelled' };
+        if (job.status === 'expired') return { error: 'Job expired before it could run' };
+      }
+    } finally {
+      currentJobId = null;
+      cancelJobButton.style.display = 'none';
+      waitingText.textContent = 'Processing… please wait';
+    }
+  }
+
+  // ------------- Resumable uploads -------------
+  // The session id is remembered per file, so re-submitting after a failure
+  // (or a reload) only sends the chunks the server does not have yet.
+  function resumableKey(blob) {
+    return `upload:${blob.name || 'recording'}:${blob.size}:${blob.lastModified || 0}`;
+  }
+
+  function forgetResumable(blob) {
+    try { localStorage.removeItem(resumableKey(blob)); } catch (e) {}
+  }
+
+  async function resumeSession(blob, model) {
+    let saved = null;
+    try { saved = JSON.parse(localStorage.getItem(resumableKey(blob)) || 'null'); } catch (e) {}
+    if (!saved || saved.model !== model) return null;
+    const resp = await fetch(`${API_BASE_URL}/uploads/${saved.upload_id}`);
+    if (!resp.ok) return null;
+    const status = await resp.json();
+    return { ...status, missing: status.missing_chunks };
+  }
+
+  async function putChunk(blob, session, index) {
+    const start = index * session.chunk_size;
+    const body = blob.slice(start, Math.min(blob.size, start + session.chunk_size));
+    for (let attempt = 0; ; attempt++) {
+      let retryable = true;
+      try {
+        const resp = await fetch(`${API_BASE_URL}/uploads/${session.upload_id}/chunks/${index}`, {
+          method: 'PUT',
+          body
+        });
+        if (resp.ok) return;
+        retryable = resp.status >= 500 || resp.status === 429;
+        if (!retryable) {
+          const err = await resp.json().catch(() => ({}));
+          throw new Error(err.error || `Chunk ${index} rejected (${resp.status})`);
+        }
+      } catch (err) {
+        if (!retryable || attempt >= RESUMABLE_CHUNK_RETRIES) throw err;
+      }
+      await new Promise(r => setTimeout(r, 500 * 2 ** attempt));
+    }
+  }
+
+  async function uploadResumable(blob, model) {
+    let session = await resumeSession(blob, model);
+    if (!session) {
+      const resp = await fetch(`${API_BASE_URL}/uploads`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          size: blob.size, model,
+          filename: blob.name || 'recording.wav', content_type: blob.type || null
+        })
+      });
+      const created = await resp.json();
+      if (!created.upload_id) throw new Error(created.error || 'Could not start the upload');
+      session = { ...created, missing: [...Array(created.total_chunks).keys()] };
+      try {
+        localStorage.setItem(resumableKey(blob), JSON.stringify({ upload_id: created.upload_id, model }));
+      } catch (e) {}
+    }
+
+    const todo = session.missing.slice();
+    let done = session.total_chunks - todo.length;
+    async function worker() {
+      while (todo.length) {
+        await putChunk(blob, session, todo.shift());
+        done++;
+        waitingText.textContent = `Uploading… ${Math.round(100 * done / session.total_chunks)}%`;
+      }
+    }
+    await Promise.all(Array.from({ length: Math.min(RESUMABLE_PARALLEL, todo.length) }, worker));
+
+    // Anything still missing on the server (e.g. a lost response) goes again
+    const check = await (await fetch(`${API_BASE_URL}/uploads/${session.upload_id}`)).json();
+    for (const index of check.missing_chunks || []) await putChunk(blob, session, index);
+    return session.upload_id;
+  }
+
+  // ------------- Live (WebSocket) -------------
+  function downsample(input, fromRate, toRate) {
+    // Average each output sample's span of input samples, as 16-bit PCM
+    const ratio = fromRate / toRate;
+    const out = new Int16Array(Math.floor(input.length / ratio));
+    for (let i = 0; i < out.length; i++) {
+      const start = Math.floor(i * ratio);
+      const end = Math.max(start + 1, Math.min(input.length, Math.floor((i + 1) * ratio)));
+      let sum = 0;
+      for (let j = start; j < end; j++) sum += input[j];
+      out[i] = Math.max(-1, Math.min(1, sum / (end - start))) * 0x7fff;
+    }
+    return out;
+  }
+
+  function renderLive(session, ev) {
+    if (ev.event === 'error') {
+      timingMeta.textContent = 'Live: ' + ev.error;
+      return;
+    }
+    if (ev.event === 'final') {
+      session.finals[ev.segment] = ev.transcription || '';
+      if (ev.translation_en) session.finalsEn[ev.segment] = ev.translation_en;
+      if (session.partial && session.partial.segment <= ev.segment) session.partial = null;
+    } else if (ev.event === 'partial') {
+      if (session.finals[ev.segment] === undefined) session.partial = ev;
+    } else {
+      return;
+    }
+    const texts = session.finals.filter(t => t);
+    const en = session.finalsEn.filter(t => t);
+    if (session.partial) {
+      texts.push(session.partial.transcription || '');
+      if (session.partial.translation_en) en.push(session.partial.translation_en);
+    }
+    transcriptionText.textContent = texts.join(' ');
+    translationEnText.textContent = en.join(' ');
+    translationEnBox.style.display = en.length ? 'block' : 'none';
+    timingMeta.textContent = `live • ${ev.event} ${ev.latency_ms} ms after speech`;
+    transcriptionOutput.style.display = 'block';
+  }
+
+  async function startLive() {
+    let stream;
+    try {
+      stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+    } catch (error) {
+      console.error('Error accessing microphone:', error);
+      alert('Could not access microphone. Please check your permissions.');
+      return;
+    }
+    const ctx = new AudioContext();
+    const rate = Math.min(ctx.sampleRate, LIVE_SAMPLE_RATE);
+    const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const ws = new WebSocket(`${scheme}://${window.location.host}/live` +
+      `?model=${encodeURIComponent(modelSelect.value)}&sample_rate=${rate}`);
+    ws.binaryType = 'arraybuffer';
+    const source = ctx.createMediaStreamSource(stream);
+    const node = ctx.createScriptProcessor(4096, 1, 1);
+    let pending = [];
+    let pendingLen = 0;
+    node.onaudioprocess = (e) => {
+      if (ws.readyState !== WebSocket.OPEN) return;
+      const pcm = downsample(e.inputBuffer.getChannelData(0), ctx.sampleRate, rate);
+      pending.push(pcm);
+      pendingLen += pcm.length;
+      if (pendingLen < rate * LIVE_FRAME_SEC) return;
+      const frame = new Int16Array(pendingLen);
+      let offset = 0;
+      for (const p of pending) { frame.set(p, offset); offset += p.length; }
+      ws.send(frame.buffer);
+      pending = [];
+      pendingLen = 0;
+    };
+    source.connect(node);
+    node.connect(ctx.destination);
+
+    live = { ws, ctx, stream, finals: [], finalsEn: [], partial: null, opened: false };
+    const session = live;
+    ws.onopen = () => { session.opened = true; };
+    // Finals still arrive after Stop, until the server closes
+    ws.onmessage = (msg) => renderLive(session, JSON.parse(msg.data));
+    ws.onclose = () => {
+      if (!session.opened) {
+        timingMeta.textContent = 'Live mode needs the async server (uvicorn webapp_async:app).';
+        transcriptionOutput.style.display = 'block';
+      }
+      if (live === session) stopLive();
+    };
+
+    transcriptionText.textContent = '';
+    translationEnText.textContent = '';
+    translationEnBox.style.display = 'none';
+    timingMeta.textContent = 'live • listening…';
+    transcriptionOutput.style.display = 'block';
+    liveButton.textContent = 'Stop';
+    liveButton.classList.remove('bg-emerald-500', 'hover:bg-emerald-600');
+    liveButton.classList.add('bg-red-500', 'hover:bg-red-600');
+    recordButton.disabled = true;
+  }
+
+  function stopLive() {
+    if (!live) return;
+    const { ws, ctx, stream } = live;
+    stream.getTracks().forEach(t => t.stop());
+    ctx.close();
+    // The server sends the last final, then 'done', then closes
+    if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'stop' }));
+    live = null;
+    liveButton.textContent = 'Live';
+    liveButton.classList.remove('bg-red-500', 'hover:bg-red-600');
+    liveButton.classList.add('bg-emerald-500', 'hover:bg-emerald-600');
+    recordButton.disabled = false;
+  }
+
+  function cancelJob() {
+    if (!currentJobId) return;
+    fetch(`${API_BASE_URL}/jobs/${currentJobId}`, { method: 'DELETE' })
+      .catch(err => console.error('Error cancelling job:', err));
+  }
+
   // expose functions for inline handlers
   window.handleFileChange = handleFileChange;
   window.startRecording = startRecording;
   window.stopRecording = stopRecording;
   window.playRecording = playRecording;
   window.playUploaded = playUploaded;
+  window.cancelJob = cancelJob;
+  window.startLive = startLive;
+  window.stopLive = stopLive;
 </script>
 </body>
 </html>
 """
 
+# Rendered and compressed once at startup; the inline script becomes a
+# hashed, immutable /assets/app.<hash>.js
+with app.app_context():
+    UI_PAGE, UI_ASSETS = build_ui(render_template_string(HTML_TEMPLATE))
+
 # -----------------------------------------------------------------------------
 # Routes
 # -----------------------------------------------------------------------------
+def _send_asset(asset):
+    status, headers, body = asset_response(
+        asset, request.headers.get("Accept-Encoding"), request.headers.get("If-None-Match"))
+    return Response(body, status=status, headers=headers)
+
 @app.route("/")
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    return _send_asset(UI_PAGE)
+
+@app.route(ASSET_PREFIX + "<name>")
+def ui_asset(name):
+    asset = UI_ASSETS.get(ASSET_PREFIX + name)
+    if asset is None:
+        return jsonify({"error": "Not found"}), 404
+    return _send_asset(asset)
+
+def _merge_overlap(prev, nxt, max_overlap):
+    """
+    Drop the longest prefix of nxt (up to max_overlap items) that repeats the
+    tail of prev; works on word lists or on strings (character-level).
+    """
+    limit = min(len(prev), len(nxt), max_overlap)
+    for k in range(limit, 0, -1):
+        if prev[-k:] == nxt[:k]:
+            return nxt[k:]
+    return nxt
+
+def _stitch_texts(texts, max_overlap_words=OVERLAP_DEDUP_MAX_WORDS):
+    """
+    Join per-window texts in order, removing text repeated across the
+    window overlaps. Space-separated text is matched word by word; text
+    without spaces (e.g. Thai) character by character.
+    """
+    out = ""
+    for text in texts:
+        text = (text or "").strip()
+        if not text:
+            continue
+        if not out:
+            out = text
+        elif " " in text or " " in out:
+            words = _merge_overlap(out.split(), text.split(), max_overlap_words)
+            if words:
+                out = out + " " + " ".join(words)
+        else:
+            out = out + _merge_overlap(out, text, max_overlap_words * 4)
+    return out
+
+def _segment_text(seg):
+    if isinstance(seg, str):
+        return seg
+    if isinstance(seg, dict) and isinstance(seg.get("text"), str):
+        return seg["text"]
+    return None
 
 def _join_english_segments(body):
     """
     For two-step responses, join the English 'segments' list into a single string.
+    Server-side fan-out responses carry 'window_segments' instead (one list
+    per overlapping window, in order); text repeated across a window
+    boundary is de-duplicated.
     """
     try:
+        windows = body.get("window_segments")
+        if isinstance(windows, list):
+            texts = [
+                " ".join(t for t in map(_segment_text, segs or []) if t)
+                for segs in windows
+            ]
+            joined = _stitch_texts(texts).strip()
+            return joined if joined else None
         segs = body.get("segments")
         if isinstance(segs, list):
-            joined = " ".join(s for s in segs if isinstance(s, str)).strip()
+            joined = " ".join(t for t in map(_segment_text, segs) if t).strip()
             return joined if joined else None
     except Exception:
         pass
     return None
 
-@app.route("/transcribe-audio", methods=["POST"])
-def transcribe_audio():
+def _read_audio_request():
     """
-    Receives base64 audio + model from the UI,
-    forwards to external transcription service via ngrok,
-    normalizes response, bubbles upstream errors.
+    Read audio + model from any supported upload mode:
+      - multipart/form-data: 'audio' file part + 'model' field (UI default)
+      - raw body (audio/*, application/octet-stream): model in ?model=
+      - JSON (legacy): { "audio_base64": ..., "model": ... }
+    Returns (upload, model); upload is None when no audio was sent.
     """
-    if not ngrok_url:
-        return jsonify({"error": "Ngrok URL is not yet available."}), 503
+    ctype = (request.mimetype or "").lower()
+
+    if ctype == "multipart/form-data":
+        model = request.form.get("model") or request.args.get("model")
+        part = request.files.get("audio")
+        if part is None:
+            return None, model
+        return wrap_file(part.stream, content_type=part.mimetype, filename=part.filename), model
+
+    if ctype == "application/octet-stream" or ctype.startswith("audio/"):
+        model = request.args.get("model")
+        if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"Audio exceeds {MAX_UPLOAD_BYTES} bytes")
+        upload = spool_stream(request.stream, content_type=ctype)
+        return (upload if upload.size else None), model
+
+    incoming = request.get_json(silent=True) or {}
+    audio_b64 = incoming.get("audio_base64")
+    model = incoming.get("model")
+    if not audio_b64:
+        return None, model
+    return spool_base64(audio_b64), model
+
+def _flag(value):
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+def _request_options():
+    """
+    Per-request preprocessing switches from the query string or form
+    fields: ?normalize=0 skips 16 kHz mono re-encoding, ?vad=1/0 turns
+    silence trimming on or off regardless of the model's default.
+    """
+    options = {}
+    for name in ("normalize", "vad"):
+        value = request.args.get(name)
+        if value is None and request.mimetype == "multipart/form-data":
+            value = request.form.get(name)
+        if value is not None:
+            options[name] = _flag(value)
+    return options
+
+MODELS = ("transcribe", "transcribe-2step")
+
+def _normalize_text(body):
+    if isinstance(body, dict):
+        if isinstance(body.get("result"), dict) and "text" in body["result"]:
+            return body["result"]["text"]
+        if "text" in body:
+            return body["text"]
+        if "translation" in body:
+            return body["translation"]
+    return None
 
-    try:
-        incoming = request.get_json(silent=True) or {}
-        audio_b64 = incoming.get("audio_base64")
-        model = incoming.get("model")
-        if not audio_b64 or not model:
-            return jsonify({"error": "Missing audio data or model"}), 400
+def _success_body(body, include_segments=False):
+    text = _normalize_text(body)
+    result = {"transcription": text} if text is not None else {}
+    if include_segments:
+        en_joined = _join_english_segments(body)
+        if en_joined:
+            result["translation_en"] = en_joined
+    if result:
+        return result, 200
+    # If we got here, body shape is unexpected
+    return {
+        "error": "Unexpected response shape from transcription service",
+        "upstream_body": body
+    }, 502
+
+def _upstream_payload(model):
+    """
+    Endpoint path + effective parameters for a model. audio_base64 is not
+    included; it is streamed in from the spooled upload when the body is sent.
+    Returns (None, None) for an unknown model.
+    """
+    # Base JSON payload (true JSON types)
+    payload_json = {
+        "use_chunked": False,
+        "num_beams": 1,
+        "max_new_tokens": 256,
+    }
 
-        # Ensure scheme on tunnel URL
-        base = ngrok_url.strip()
-        if not base.startswith(("http://", "https://")):
-            base = "https://" + base
-
-        # Base JSON payload (true JSON types)
-        payload_json = {
-            "audio_base64": audio_b64,
-            "use_chunked": False,
-            "num_beams": 1,
-            "max_new_tokens": 256,
-        }
+    if model == "transcribe":
+        payload_json["tgt_lang"] = "tha"
+        return "/transcribe", payload_json
+    if model == "transcribe-2step":
+        payload_json.update({
+            "s2tt_tgt_lang": "eng",
+            "mt_src_lang_code": "eng_Latn",
+            "use_chunked": True,
+            "chunk_sec": 30.0,
+            "overlap_sec": 1.0,
+            "use_spectral_nr": True,
+        })
+        return "/transcribe-2step", payload_json
+    return None, None
+
+def _post_backend(target, upload, payload_json):
+    """
+    Send the clip in the encoding this endpoint is known to accept (JSON
+    until learned otherwise); on 400/415 retry once with the other encoding
+    (booleans/numbers -> strings for form) and remember what worked.
+    Returns (upstream_status, upstream_json, None) on success, else
+    (upstream_status, None, (error_body, http_status)).
+    """
+    order = upstream_protocol.order(target)
+    endpoint = urlsplit(target).path
+    for attempt, encoding in enumerate(order):
+        n = tracing.next_attempt()
+        with tracing.span(f"payload-{n}", desc=encoding):
+            if encoding == JSON:
+                data = json_body(upload, payload_json)
+                headers = {"Content-Type": "application/json"}
+            else:
+                data = form_body(upload, payload_json)
+                headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        headers.update(tracing.upstream_headers())
+        started = time.perf_counter()
+        try:
+            with tracing.span(f"upstream-{n}", desc=f"{encoding} {urlsplit(target).netloc}") as span:
+                resp = upstream_http.post(target, data=data, headers=headers)
+                span["status"] = resp.status_code
+        except requests.exceptions.Timeout:
+            UPSTREAM_RESPONSES.inc(endpoint=endpoint, status="timeout")
+            raise
+        except requests.exceptions.RequestException:
+            UPSTREAM_RESPONSES.inc(endpoint=endpoint, status="error")
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, encoding=encoding)
+        UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=resp.status_code)
+        try:
+            body = resp.json()
+        except ValueError:
+            body = None
+
+        # 400/415 often indicates wrong content type for this backend -> try the other
+        if resp.status_code in ENCODING_REJECTED and attempt == 0:
+            upstream_protocol.record_fallback()
+            UPSTREAM_FORM_FALLBACKS.inc(endpoint=endpoint)
+            continue
+
+        suffix = " (form)" if encoding == FORM else ""
+        if resp.ok:
+            upstream_protocol.learn(target, encoding)
+        if resp.ok and body is not None:
+            return resp.status_code, body, None
+        if resp.ok:
+            # ok but not JSON
+            return resp.status_code, None, ({
+                "error": f"Unexpected non-JSON response from transcription service{suffix}",
+                "upstream_body": resp.text
+            }, 502)
+        return resp.status_code, None, ({
+            "error": f"Transcription service error{suffix}",
+            "upstream_status": resp.status_code,
+            "upstream_body": body if body is not None else resp.text
+        }, 502)
+
+def _post_upstream(path, model, upload, payload_json):
+    """
+    Send one clip upstream (_post_upstream_once). Once the clip has been
+    waiting longer than the hedge delay for its model and length, a
+    duplicate goes to the least-loaded backend and the first good answer
+    is returned (see hedging.py).
+    Returns (upstream_json, None) on success, else (None, (error_body, http_status)).
+    """
+    key = hedger.key(model, estimate_audio_sec(upload))
+    delay = hedger.plan(key)
+    return hedger.run(key, model, delay, lambda view: _post_upstream_once(path, model, view, payload_json),
+                      upload, succeeded=lambda result: result[1] is None)
 
-        if model == "transcribe":
-            target = f"{base}/transcribe"
-            payload_json["tgt_lang"] = "tha"
-        elif model == "transcribe-2step":
-            target = f"{base}/transcribe-2step"
-            payload_json.update({
-                "s2tt_tgt_lang": "eng",
-                "mt_src_lang_code": "eng_Latn",
-                "use_chunked": True,
-                "chunk_sec": 30.0,
-                "overlap_sec": 1.0,
-                "use_spectral_nr": True,
-            })
-        else:
-            return jsonify({"error": "Invalid model selected"}), 400
+def _post_upstream_once(path, model, upload, payload_json):
+    """
+    Send one clip to the least-loaded healthy backend serving model. Connection
+    errors, timeouts and 5xx answers count against that backend's circuit
+    breaker and are retried on another backend (BACKEND_FAILOVER_ATTEMPTS).
+    Returns (upstream_json, None) on success, else (None, (error_body, http_status)).
+    """
+    tried = []
+    last_error = last_exc = None
+    for _ in range(BACKEND_FAILOVER_ATTEMPTS + 1):
+        backend = backend_pool.acquire(model, exclude=tried)
+        if backend is None:
+            break
+        tried.append(backend.id)
+        started = time.perf_counter()
+        try:
+            status, body, error = _post_backend(backend.url + path, upload, payload_json)
+        except requests.exceptions.RequestException as e:
+            backend_pool.release(backend, "failure")
+            last_exc = e
+            continue
+        except BaseException:
+            # Interrupted, not failed: says nothing about the backend
+            backend_pool.release(backend, "neutral")
+            raise
+        if status in UNHEALTHY_STATUSES:
+            backend_pool.release(backend, "failure")
+            last_error, last_exc = error, None
+            continue
+        backend_pool.release(backend, "ok" if error is None else "neutral",
+                             latency=time.perf_counter() - started)
+        return body, error
+
+    if last_exc is not None:
+        raise last_exc
+    if last_error is not None:
+        return None, last_error
+    return None, ({"error": "No healthy transcription backend available"}, 503)
+
+def _fanout_windows(upload, payload_json):
+    """
+    Overlapping windows for server-side fan-out, or None when the clip should
+    go upstream in one request (fan-out off, not PCM WAV, or short enough).
+    """
+    if not FANOUT_ENABLED or not payload_json.get("use_chunked"):
+        return None
+    info = wav_info(upload)
+    if info is None:
+        return None
+    window_sec = float(payload_json.get("chunk_sec") or 30.0)
+    overlap_sec = float(payload_json.get("overlap_sec") or 0.0)
+    windows = plan_windows(info.n_frames, info.sample_rate, window_sec, overlap_sec)
+    return windows if len(windows) > 1 else None
 
-        def normalize_text(body):
-            if isinstance(body, dict):
-                if isinstance(body.get("result"), dict) and "text" in body["result"]:
-                    return body["result"]["text"]
-                if "text" in body:
-                    return body["text"]
-                if "translation" in body:
-                    return body["translation"]
-            return None
-
-        def success_response(body, include_segments=False):
-            text = normalize_text(body)
-            result = {"transcription": text} if text is not None else {}
-            if include_segments:
-                en_joined = _join_english_segments(body)
-                if en_joined:
-                    result["translation_en"] = en_joined
-            if result:
-                return jsonify(result)
-            # If we got here, body shape is unexpected
-            return jsonify({
-                "error": "Unexpected response shape from transcription service",
-                "upstream_body": body
-            }), 502
+def _window_result(body):
+    segs = body.get("segments") if isinstance(body, dict) else None
+    return _normalize_text(body), (segs if isinstance(segs, list) else [])
+
+def _transcribe_fanout(path, model, upload, payload_json, windows, sample_rate, on_partial=None):
+    """
+    Send each window upstream concurrently (at most FANOUT_PARALLELISM at a
+    time) and stitch the results back in order. on_partial, if given, is
+    called as each window finishes.
+    """
+    # Each window is already short; the backend must not re-chunk it
+    window_payload = dict(payload_json, use_chunked=False)
+
+    # Windows are read from the shared spool one at a time (file position)
+    read_lock = Lock()
+
+    def run_locked(window):
+        with read_lock:
+            data = read_window_wav(upload, *window)
+        with from_bytes(data, content_type="audio/wav") as part:
+            return _post_upstream(path, model, part, window_payload)
+
+    results = [None] * len(windows)
+    with ThreadPoolExecutor(max_workers=min(FANOUT_PARALLELISM, len(windows))) as pool:
+        # Each window thread adds its upstream spans to this request's trace
+        futures = {pool.submit(contextvars.copy_context().run, run_locked, w): i
+                   for i, w in enumerate(windows)}
+        for fut in as_completed(futures):
+            body, error = fut.result()
+            if error is not None:
+                for other in futures:
+                    other.cancel()
+                return None, error
+            i = futures[fut]
+            results[i] = _window_result(body)
+            if on_partial is not None:
+                on_partial(_partial_event(i, windows, sample_rate, results))
+
+    texts = [text for text, _ in results]
+    window_segments = [segs for _, segs in results]
+    return {"text": _stitch_texts(texts), "window_segments": window_segments}, None
+
+def _partial_event(index, windows, sample_rate, results):
+    """
+    Streamed per-window result plus the stitched text of the windows
+    finished so far in order (the contiguous prefix).
+    """
+    text, segs = results[index]
+    prefix = []
+    for r in results:
+        if r is None:
+            break
+        prefix.append(r)
+    start, end = windows[index]
+    return {
+        "event": "partial",
+        "index": index,
+        "total": len(windows),
+        "start_sec": round(start / float(sample_rate), 3),
+        "end_sec": round(end / float(sample_rate), 3),
+        "text": text,
+        "translation_en": _join_english_segments({"segments": segs}),
+        "transcription_so_far": _stitch_texts([t for t, _ in prefix]),
+        "translation_en_so_far": _join_english_segments({"window_segments": [s for _, s in prefix]}),
+    }
 
-        # Attempt 1: JSON
+def _normalized(upload, options):
+    """
+    (upload_to_send, report): 16 kHz mono PCM WAV when the request allows
+    it and it makes the body smaller, else the upload itself.
+    """
+    if not options.get("normalize", NORMALIZE_ENABLED):
+        return upload, {"action": "skipped"}
+    started = time.perf_counter()
+    prepared, report = normalize_upload(upload)
+    report["normalize_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    AUDIO_NORMALIZE.inc(action=report["action"])
+    AUDIO_NORMALIZE_BYTES.inc(report["original_bytes"], direction="in")
+    AUDIO_NORMALIZE_BYTES.inc(report["sent_bytes"], direction="out")
+    return prepared, report
+
+def _vad_settings(model, options):
+    """
+    trim_silence() keyword arguments for this model and request, or None
+    when trimming is off.
+    """
+    settings = dict(VAD_MODEL_SETTINGS.get(model) or {"enabled": VAD_ENABLED})
+    if not options.get("vad", settings.pop("enabled")):
+        return None
+    return settings
+
+def _trimmed(upload, model, options):
+    settings = _vad_settings(model, options)
+    if settings is None:
+        return upload, {"action": "skipped"}
+    started = time.perf_counter()
+    prepared, report = trim_silence(upload, **settings)
+    report["vad_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    AUDIO_VAD.inc(model=model, action=report["action"])
+    if report["seconds_in"]:
+        AUDIO_VAD_SECONDS.inc(report["seconds_in"], model=model, direction="in")
+        AUDIO_VAD_SECONDS.inc(report["seconds_removed"], model=model, direction="removed")
+    return prepared, report
+
+def _preprocess(upload, model, options):
+    """
+    Normalize, then trim silence. Returns (upload_to_send, report,
+    temporaries); the caller closes the temporaries.
+    """
+    temporaries = []
+    normalized, normalize_report = _normalized(upload, options)
+    if normalized is not upload:
+        temporaries.append(normalized)
+    trimmed, vad_report = _trimmed(normalized, model, options)
+    if trimmed is not normalized:
+        temporaries.append(trimmed)
+    return trimmed, {"normalize": normalize_report, "vad": vad_report}, temporaries
+
+def _original_times(on_partial, report):
+    """
+    Wrap on_partial so window times refer to the untrimmed recording.
+    """
+    timemap = report["vad"].get("timemap")
+    if on_partial is None or not timemap:
+        return on_partial
+
+    def remapped(event):
+        if "start_sec" in event:
+            event["start_sec"] = round(map_time(timemap, event["start_sec"]), 3)
+            event["end_sec"] = round(map_time(timemap, event["end_sec"], end=True), 3)
+        on_partial(event)
+    return remapped
+
+def _transcribe_prepared(path, model, upload, payload_json, include_segments, options, on_partial,
+                         patient=False):
+    # One admission slot per transcription (fan-out windows share it);
+    # shorter clips are admitted first
+    waited = time.perf_counter()
+    with admission.slot(estimate_audio_sec(upload), patient=patient):
+        tracing.add("admission", time.perf_counter() - waited)
+        with tracing.span("preprocess"):
+            prepared, report, temporaries = _preprocess(upload, model, options)
         try:
-            resp = requests.post(target, json=payload_json, timeout=120)
-            try:
-                body = resp.json()
-            except ValueError:
-                body = None
-
-            if resp.ok and body is not None:
-                return success_response(body, include_segments=(model == "transcribe-2step"))
-            elif resp.ok:
-                # ok but not JSON
-                return jsonify({
-                    "error": "Unexpected non-JSON response from transcription service",
-                    "upstream_body": resp.text
-                }), 502
-            else:
-                # 400/415 often indicates wrong content type for this backend -> try form
-                if resp.status_code in (400, 415):
-                    raise RuntimeError("fallback-to-form")
-                return jsonify({
-                    "error": "Transcription service error",
-                    "upstream_status": resp.status_code,
-                    "upstream_body": body if body is not None else resp.text
-                }), 502
-
-        except RuntimeError as r:
-            if str(r) != "fallback-to-form":
-                raise
-
-            # Attempt 2: form-encoded (booleans/numbers -> strings)
-            payload_form = {
-                k: (str(v).lower() if isinstance(v, bool) else str(v))
-                for k, v in payload_json.items()
-            }
-            resp2 = requests.post(target, data=payload_form, timeout=120)
-            try:
-                body2 = resp2.json()
-            except ValueError:
-                body2 = None
-
-            if resp2.ok and body2 is not None:
-                return success_response(body2, include_segments=(model == "transcribe-2step"))
-            elif resp2.ok:
-                return jsonify({
-                    "error": "Unexpected non-JSON response from transcription service (form)",
-                    "upstream_body": resp2.text
-                }), 502
-            else:
-                return jsonify({
-                    "error": "Transcription service error (form)",
-                    "upstream_status": resp2.status_code,
-                    "upstream_body": body2 if body2 is not None else resp2.text
-                }), 502
+            body, status = _transcribe_once(path, model, prepared, payload_json, include_segments,
+                                            _original_times(on_partial, report))
+        finally:
+            for temp in temporaries:
+                temp.close()
+    if status == 200:
+        body = dict(body, preprocess=report)
+    return body, status
+
+def _transcribe_once(path, model, upload, payload_json, include_segments, on_partial=None):
+    windows = _fanout_windows(upload, payload_json)
+    if windows:
+        sample_rate = wav_info(upload).sample_rate
+        body, error = _transcribe_fanout(path, model, upload, payload_json, windows, sample_rate, on_partial)
+    else:
+        body, error = _post_upstream(path, model, upload, payload_json)
+        if error is None and on_partial is not None:
+            text, segs = _window_result(body)
+            on_partial({
+                "event": "partial", "index": 0, "total": 1,
+                "text": text,
+                "translation_en": _join_english_segments({"segments": segs}),
+                "transcription_so_far": text,
+                "translation_en_so_far": _join_english_segments({"segments": segs}),
+            })
+    if error is not None:
+        return error
+    with tracing.span("normalize"):
+        return _success_body(body, include_segments)
+
+def transcribe_upload(upload, model, options=None, on_partial=None, patient=False):
+    """
+    Forward a spooled upload to a transcription backend and normalize the
+    answer. Returns (body, http_status); shared by the
+    synchronous route, the streaming route and the job workers.
 
+    Successful results are cached by audio hash + model + parameters, and
+    identical concurrent requests share one upstream call. on_partial
+    receives per-chunk results when this call is the one talking upstream.
+
+    options: {"normalize": bool, "vad": bool} -- re-encode WAV as 16 kHz
+    mono and trim silence before sending (defaults NORMALIZE_ENABLED and
+    VAD_MODEL_SETTINGS). The result reports bytes saved, seconds removed
+    and the trimmed-to-original timemap under "preprocess".
+
+    patient: wait for an admission slot however long the queue is (job
+    workers), instead of answering 429/503 like a live request.
+    """
+    if not backend_pool.has_backends():
+        return {"error": "Ngrok URL is not yet available."}, 503
+
+    path, payload_json = _upstream_payload(model)
+    if path is None:
+        return {"error": "Invalid model selected"}, 400
+
+    started = time.perf_counter()
+    TRANSCRIBE_IN_FLIGHT.inc(model=model)
+    body, status = _transcribe_upload(upload, model, path, payload_json, options or {}, on_partial, patient)
+    TRANSCRIBE_IN_FLIGHT.dec(model=model)
+    TRANSCRIBE_LATENCY.observe(time.perf_counter() - started, model=model, status=status)
+    return body, status
+
+def _resolved_options(model, options):
+    """
+    Request options with defaults filled in, so equal effective settings
+    share a cache entry.
+    """
+    return {
+        "normalize": bool(options.get("normalize", NORMALIZE_ENABLED)),
+        "vad": _vad_settings(model, options) is not None,
+    }
+
+def _history_or_transcribe(key, upload, model, params, compute):
+    """
+    A result the history store already holds for this exact key, else
+    compute(); fresh successes are queued for the history store.
+    """
+    with tracing.span("history") as span:
+        record = transcription_history.lookup(upload.sha256(), key)
+        span["hit"] = record is not None
+    if record is not None:
+        return history_body(record), 200
+    started = time.perf_counter()
+    body, status = compute()
+    if status == 200:
+        transcription_history.record(history_entry(
+            key, upload.sha256(), model, params, body, time.perf_counter() - started, upload.size))
+    return body, status
+
+def _transcribe_upload(upload, model, path, payload_json, options, on_partial, patient=False):
+    try:
+        include_segments = (model == "transcribe-2step")
+
+        options = _resolved_options(model, options)
+        params = dict(payload_json, preprocess=options)
+        key = cache_key(upload.sha256(), model, params)
+        (body, status), source = result_cache.get_or_compute(
+            key,
+            lambda: _history_or_transcribe(key, upload, model, params, lambda: _transcribe_prepared(
+                path, model, upload, payload_json, include_segments, options, on_partial, patient)),
+            cacheable=lambda value: value[1] == 200,
+        )
+        tracing.annotate(model=model, cache=source, audio_bytes=upload.size)
+        return body, status
+
+    except AdmissionRejected as e:
+        return e.body(), e.status
     except requests.exceptions.Timeout:
-        return jsonify({"error": "Transcription service timed out"}), 504
+        return {"error": "Transcription service timed out"}, 504
     except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Failed to connect to the transcription service: {e}"}), 502
+        return {"error": f"Failed to connect to the transcription service: {e}"}, 502
+    except Exception as e:
+        print(f"Unhandled server error: {e}")
+        return {"error": f"Unexpected server error: {str(e)}"}, 500
+
+def _format_event(event, sse):
+    data = json.dumps(event, ensure_ascii=False)
+    if sse:
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+def _stream_transcription(upload, model, options, sse, on_done=None):
+    """
+    Streaming mode: NDJSON (or SSE) events -- 'accepted', one 'partial' per
+    finished chunk, then 'final' (or 'error') with time-to-first-text and
+    total latency measured separately. The upstream work runs on its own
+    thread, which owns and closes the upload, then calls on_done(status).
+    """
+    started = time.monotonic()
+    events = queue.Queue()
+    first_text_at = []
+    trace = tracing.current()
+    if trace is not None:
+        trace.deferred = True    # finished by the worker, after the upstream call
+
+    def on_partial(event):
+        if not first_text_at:
+            first_text_at.append(time.monotonic())
+        event["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+        events.put(event)
+
+    def work():
+        try:
+            body, status = transcribe_upload(upload, model, options, on_partial=on_partial)
+        except Exception as e:
+            body, status = {"error": f"Unexpected server error: {e}"}, 500
+        finally:
+            upload.close()
+        if on_done is not None:
+            on_done(status)
+        finished = time.monotonic()
+        # A cache hit has no partials; its first text is the final result
+        first = first_text_at[0] if first_text_at else finished
+        final = {"event": "final" if status == 200 else "error", "status": status}
+        final.update(body)
+        final.update({
+            "time_to_first_text_ms": int((first - started) * 1000) if status == 200 else None,
+            "total_ms": int((finished - started) * 1000),
+        })
+        if trace is not None:
+            final.update(trace_id=trace.trace_id, server_timing=tracing.finish(trace, status))
+        events.put(final)
+        events.put(None)
+
+    Thread(target=contextvars.copy_context().run, args=(work,), daemon=True).start()
+
+    def generate():
+        yield _format_event({"event": "accepted", "model": model}, sse)
+        while True:
+            try:
+                event = events.get(timeout=STREAM_HEARTBEAT_SEC)
+            except queue.Empty:
+                # keeps proxies (ngrok, nginx) from closing an idle stream
+                yield _format_event({"event": "heartbeat"}, sse)
+                continue
+            if event is None:
+                return
+            yield _format_event(event, sse)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Accepted jobs wait out admission instead of failing with 429/503
+job_runner = JobRunner(lambda upload, model, options: transcribe_upload(upload, model, options, patient=True))
+upload_sessions = UploadSessionStore()
+
+def _json_response(body, status):
+    """
+    jsonify + Retry-After for answers from admission control.
+    """
+    response = jsonify(body)
+    response.status_code = status
+    if isinstance(body, dict) and body.get("retry_after"):
+        response.headers["Retry-After"] = str(body["retry_after"])
+    return response
+
+@app.route("/transcribe-audio", methods=["POST"])
+def transcribe_audio():
+    """
+    Receives audio + model from the UI (multipart, raw body or legacy base64
+    JSON) and either transcribes it synchronously, with ?mode=stream streams
+    partial results as NDJSON (SSE with Accept: text/event-stream or
+    ?format=sse), or with ?mode=job queues it and answers 202 with a job id
+    to poll at /jobs/<id>.
+
+    Every request is traced (tracing.py): the answer carries its trace ID
+    and a Server-Timing header of the stages so far; a stream's final event
+    repeats the complete timings.
+    """
+    trace = tracing.start(request.headers, "/transcribe-audio")
+    try:
+        response = make_response(_transcribe_audio())
+    finally:
+        tracing.clear()
+    if trace is not None:
+        response.headers[tracing.TRACE_HEADER] = trace.trace_id
+        response.headers["Server-Timing"] = (
+            trace.server_timing() if trace.deferred else tracing.finish(trace, response.status_code))
+    return response
+
+def _transcribe_audio():
+    mode = request.args.get("mode", "sync")
+    tracing.annotate(mode=mode)
+    if mode in ("sync", "stream") and not backend_pool.has_backends():
+        return jsonify({"error": "Ngrok URL is not yet available."}), 503
+    rejected = admission.check() if mode in ("sync", "stream") else None
+    if rejected is not None:
+        # Fail fast, before reading the upload
+        return _json_response(rejected.body(), rejected.status)
+
+    upload = None
+    try:
+        with tracing.span("parse", desc=request.mimetype):
+            upload, model = _read_audio_request()
+        if not upload or not model:
+            return jsonify({"error": "Missing audio data or model"}), 400
+        if model not in MODELS:
+            return jsonify({"error": "Invalid model selected"}), 400
+        options = _request_options()
+
+        if mode == "job":
+            job = job_runner.submit(upload, model, options)
+            return jsonify({
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "status_url": f"/jobs/{job['job_id']}",
+            }), 202
+
+        if mode == "stream":
+            sse = (request.args.get("format") == "sse"
+                   or "text/event-stream" in request.headers.get("Accept", ""))
+            owned = detach(upload)
+            if owned is not upload:
+                upload.close()
+            # the streaming worker owns the upload from here on
+            upload = None
+            return _stream_transcription(owned, model, options, sse)
+
+        body, status = transcribe_upload(upload, model, options)
+        return _json_response(body, status)
+
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return jsonify({"error": f"Audio too large (max {MAX_UPLOAD_BYTES} bytes)"}), 413
+    except InvalidAudio as e:
+        return jsonify({"error": str(e)}), 400
+    except QueueFull as e:
+        return jsonify({"error": f"Too many queued jobs: {e}"}), 429
     except Exception as e:
         print(f"Unhandled server error: {e}")
         return jsonify({"error": f"Unexpected server error: {str(e)}"}), 500
+    finally:
+        if upload is not None:
+            upload.close()
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    Job status/result. ?wait=N long-polls up to N seconds for completion.
+    """
+    try:
+        wait = float(request.args.get("wait", "0"))
+    except ValueError:
+        wait = 0.0
+    job = job_runner.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_view(job))
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = job_runner.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_view(job))
+
+def _batch_items():
+    """
+    (model, items, options) from a multipart batch (one 'audio' part per clip,
+    'model' field) or a JSON manifest:
+      { "model": ..., "paths": ["a.wav", {"path": "b.wav", "model": ...}],
+        "normalize": bool, "vad": bool }
+    Manifest paths are resolved under BATCH_ROOT_DIR.
+    """
+    options = _request_options()
+    if request.mimetype == "multipart/form-data":
+        model = request.form.get("model") or request.args.get("model")
+        parts = request.files.getlist("audio")
+        if len(parts) > BATCH_MAX_ITEMS:
+            raise ValueError(f"Too many items (max {BATCH_MAX_ITEMS})")
+        items = []
+        try:
+            for i, part in enumerate(parts):
+                borrowed = wrap_file(part.stream, content_type=part.mimetype, filename=part.filename)
+                # Items outlive the request; take copies the batch owns
+                items.append(BatchItem(i, part.filename, model, upload=detach(borrowed)))
+        except Exception:
+            for item in items:
+                item.close()
+            raise
+        return model, items, options
+
+    manifest = request.get_json(silent=True)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("paths"), list):
+        raise ValueError("Expected multipart 'audio' parts or a JSON manifest with 'paths'")
+    if len(manifest["paths"]) > BATCH_MAX_ITEMS:
+        raise ValueError(f"Too many items (max {BATCH_MAX_ITEMS})")
+    for name in ("normalize", "vad"):
+        if name in manifest:
+            options[name] = bool(manifest[name])
+    model = manifest.get("model") or request.args.get("model")
+    return model, manifest_items(manifest["paths"], model, MODELS), options
+
+@app.route("/transcribe-batch", methods=["POST"])
+def transcribe_batch():
+    """
+    Bulk transcription. Streams NDJSON: 'accepted', one 'item' event per
+    clip as it finishes (index, name, status, attempts, plus the same body
+    /transcribe-audio would return), heartbeats while waiting, and a final
+    'summary'. Failed items are reported and the batch carries on.
+    """
+    if not backend_pool.has_backends():
+        return jsonify({"error": "Ngrok URL is not yet available."}), 503
+    try:
+        model, items, options = _batch_items()
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return jsonify({"error": f"Batch too large (max {MAX_UPLOAD_BYTES} bytes per clip)"}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not items or model not in MODELS:
+        for item in items:
+            item.close()
+        error = "No audio items" if not items else "Invalid model selected"
+        return jsonify({"error": error}), 400
+
+    run = BatchRun(items, transcribe_upload, options, heartbeat_sec=STREAM_HEARTBEAT_SEC)
+
+    def generate():
+        yield _format_event({"event": "accepted", "model": model, "total": len(items)}, False)
+        for event in run:
+            yield _format_event(event, False)
+
+    response = Response(
+        generate(),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Client gone (or done): cancel items not yet started, free their audio
+    response.call_on_close(run.close)
+    return response
+
+# ---------------- resumable uploads ----------------
+@app.route("/uploads", methods=["POST"])
+def create_upload_session():
+    """
+    Start a resumable upload:
+      { "size": bytes, "model": ..., "chunk_size"?: bytes, "filename"?,
+        "content_type"?, "normalize"?: bool, "vad"?: bool }
+    Then PUT /uploads/<id>/chunks/<n> (any order, in parallel), check
+    GET /uploads/<id>, and POST /uploads/<id>/finalize?mode=sync|stream|job.
+    """
+    params = request.get_json(silent=True)
+    if not isinstance(params, dict):
+        return jsonify({"error": "Expected a JSON body"}), 400
+    if params.get("model") not in MODELS:
+        return jsonify({"error": "Invalid model selected"}), 400
+    options = _request_options()
+    for name in ("normalize", "vad"):
+        if name in params:
+            options[name] = bool(params[name])
+    try:
+        meta = upload_sessions.create(
+            params.get("size"), params.get("chunk_size"), model=params["model"], options=options,
+            filename=params.get("filename"), content_type=params.get("content_type"))
+    except SessionError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({
+        "upload_id": meta["upload_id"],
+        "chunk_size": meta["chunk_size"],
+        "total_chunks": meta["total_chunks"],
+        "expires_after_idle_sec": upload_sessions.ttl_sec,
+        "status_url": f"/uploads/{meta['upload_id']}",
+    }), 201
+
+@app.route("/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def put_upload_chunk(upload_id, index):
+    """
+    Raw chunk body, streamed to disk. Optional X-Chunk-Sha256 is verified.
+    """
+    try:
+        state = upload_sessions.write_chunk(upload_id, index, request.stream, request.content_length,
+                                            sha256=request.headers.get("X-Chunk-Sha256"))
+    except SessionError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Chunk too large"}), 413
+    return jsonify({"index": index, "bytes_received": state["bytes_received"],
+                    "missing_chunks": len(state["missing_chunks"]), "complete": state["complete"]})
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def get_upload_session(upload_id):
+    try:
+        return jsonify(upload_sessions.status(upload_id))
+    except SessionError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route("/uploads/<upload_id>", methods=["DELETE"])
+def delete_upload_session(upload_id):
+    try:
+        upload_sessions.status(upload_id)
+    except SessionError as e:
+        return jsonify({"error": str(e)}), e.status
+    upload_sessions.discard(upload_id)
+    return jsonify({"upload_id": upload_id, "deleted": True})
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload_session(upload_id):
+    """
+    Transcribe a complete upload; answers like /transcribe-audio in the
+    same modes. The session is removed once the result is final; after a
+    retryable failure (429/5xx) it stays and finalize can be called again.
+    """
+    mode = request.args.get("mode", "sync")
+    if mode not in ("sync", "stream", "job"):
+        return jsonify({"error": "mode must be sync, stream or job"}), 400
+    if mode != "job" and not backend_pool.has_backends():
+        return jsonify({"error": "Ngrok URL is not yet available."}), 503
+    rejected = admission.check() if mode != "job" else None
+    if rejected is not None:
+        return _json_response(rejected.body(), rejected.status)
+    try:
+        meta, upload = upload_sessions.finalize(upload_id)
+    except SessionError as e:
+        return jsonify({"error": str(e)}), e.status
+    model, options = meta["model"], meta["options"]
+
+    def done(status):
+        if status in RETRYABLE_STATUSES:
+            upload_sessions.release(upload_id)
+        else:
+            upload_sessions.discard(upload_id)
+
+    if mode == "stream":
+        sse = (request.args.get("format") == "sse"
+               or "text/event-stream" in request.headers.get("Accept", ""))
+        return _stream_transcription(upload, model, options, sse, on_done=done)
+
+    try:
+        if mode == "job":
+            try:
+                job = job_runner.submit(upload, model, options)
+            except QueueFull as e:
+                done(429)
+                return jsonify({"error": f"Too many queued jobs: {e}"}), 429
+            # The job backend keeps its own copy of the audio
+            done(202)
+            return jsonify({
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "status_url": f"/jobs/{job['job_id']}",
+            }), 202
+        body, status = transcribe_upload(upload, model, options)
+        done(status)
+        return _json_response(body, status)
+    except Exception:
+        done(500)
+        raise
+    finally:
+        upload.close()
 
 @app.route("/get_ngrok_url", methods=["GET"])
 def get_ngrok_url_endpoint():
     """
-    Always try to fetch a FRESH URL from the external service when this endpoint
-    is hit (e.g., page refresh). Fallback to env override or cached value.
+    Answer from the shared resolver right away (stale-while-revalidate): a
+    stale URL is refreshed in the background, concurrent refreshes are
+    merged, and only a cold cache waits for the URL service. 206 means the
+    last refresh failed and the cached URL is being served.
     """
-    global ngrok_url, ngrok_url_last_ok
+    snap = tunnel_resolver.get(wait_sec=tunnel_resolver.session.timeout[1])
+    body, status = ngrok_url_body(snap)
+    return jsonify(body), status
 
-    # Highest priority: explicit env override
-    fixed = os.getenv("NGROK_URL", "").strip()
-    if fixed:
-        ngrok_url = fixed
-        ngrok_url_last_ok = time.time()
-        return jsonify({"ngrok_url": ngrok_url, "last_ok": int(ngrok_url_last_ok), "source": "env"})
-
-    # Try fresh fetch every time this endpoint is called
-    fresh = get_ngrok_tunnel_url_from_service()
-    if fresh:
-        ngrok_url = fresh
-        ngrok_url_last_ok = time.time()
-        return jsonify({"ngrok_url": ngrok_url, "last_ok": int(ngrok_url_last_ok), "source": "fresh"})
-
-    # Fallback to cache if fresh fetch failed
-    if ngrok_url:
-        return jsonify({"ngrok_url": ngrok_url, "last_ok": int(ngrok_url_last_ok), "source": "cache"}), 206
-
-    # Nothing available
-    return jsonify({"error": "URL not available"}), 503
+def ngrok_url_body(snap):
+    """
+    (body, status) for a resolver snapshot; shared with webapp_async.
+    """
+    if not snap["ngrok_url"]:
+        # Nothing available
+        return {"error": "URL not available"}, 503
+
+    body = {
+        "ngrok_url": snap["ngrok_url"],
+        "last_ok": int(snap["last_ok"] or ngrok_url_last_ok),
+        "source": snap["source"],
+        "version": snap["version"],
+        "revalidating": snap["revalidating"],
+        "watching": snap["watching"],
+    }
+    return body, (206 if snap["failures"] else 200)
+
+@app.before_request
+def _metrics_before_request():
+    g.metrics_route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(route=g.metrics_route)
+
+@app.after_request
+def _metrics_after_request(response):
+    route = g.get("metrics_route", "unmatched")
+    if "metrics_started" in g:
+        HTTP_LATENCY.observe(time.perf_counter() - g.metrics_started,
+                             route=route, method=request.method, status=response.status_code)
+    if request.content_length:
+        HTTP_REQUEST_BYTES.observe(request.content_length, route=route)
+    if not response.is_streamed:
+        HTTP_RESPONSE_BYTES.observe(response.calculate_content_length() or 0, route=route)
+    return response
+
+@app.teardown_request
+def _metrics_teardown_request(_exc):
+    if "metrics_route" in g:
+        HTTP_IN_FLIGHT.dec(route=g.metrics_route)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus text exposition (all gunicorn workers when METRICS_MULTIPROC_DIR is set).
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/upstream_stats", methods=["GET"])
+def upstream_stats_endpoint():
+    """
+    Per-worker connection reuse of the pooled HTTP sessions.
+    """
+    return jsonify({
+        "pid": os.getpid(),
+        "pools": [upstream_http.stats(), service_http.stats()],
+        "protocol": upstream_protocol.stats(),
+        "tunnel": tunnel_resolver.stats(),
+        "backends": backend_pool.stats(),
+        "admission": admission.stats(),
+        "live": live_streams.stats(),
+        "hedging": hedger.stats(),
+        "traces": tracing.trace_log.stats(),
+    })
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats_endpoint():
+    """
+    Per-worker hit/miss counters of the transcription result cache.
+    """
+    return jsonify(dict(result_cache.stats(), pid=os.getpid(), history=transcription_history.stats()))
 
 # -----------------------------------------------------------------------------
 # Run
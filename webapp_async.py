@@ -0,0 +1,714 @@
+# webapp_async.py
+"""
+Asyncio serving mode for the transcription path (ASGI):
+
+    uvicorn webapp_async:app --host 0.0.0.0 --port 5000
+
+/transcribe-audio (sync and stream modes) and /get_ngrok_url are served
+with non-blocking upstream I/O (aiohttp), so a transcription waiting on the
+GPU box costs a coroutine and its spooled upload instead of a worker
+thread. The live microphone WebSocket (/live) exists only in this mode.
+Every other route (UI, jobs, stats, /metrics) is the Flask app from
+webapp.py mounted underneath; the routing state -- tunnel resolver, backend
+pool, protocol memory, result cache, metrics -- is shared with it.
+
+Needs: fastapi, aiohttp, python-multipart, websockets (for /live under
+uvicorn) and a2wsgi, optional, for the mounted Flask app; starlette's
+deprecated WSGIMiddleware is used otherwise.
+"""
+import asyncio
+import json
+import os
+import time
+import warnings
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # pragma: no cover - optional dependency
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from starlette.middleware.wsgi import WSGIMiddleware
+
+import webapp
+from webapp import (
+    backend_pool, tunnel_resolver, ngrok_url_body,
+    _upstream_payload, _success_body, _fanout_windows, _window_result,
+    _partial_event, _join_english_segments, _stitch_texts, _format_event, _flag,
+    _preprocess, _original_times, _resolved_options, transcription_history,
+    MODELS, FANOUT_PARALLELISM, STREAM_HEARTBEAT_SEC,
+    HTTP_LATENCY, HTTP_IN_FLIGHT, TRANSCRIBE_LATENCY, TRANSCRIBE_IN_FLIGHT,
+    UPSTREAM_LATENCY, UPSTREAM_RESPONSES, UPSTREAM_FORM_FALLBACKS,
+)
+from backends import BACKEND_FAILOVER_ATTEMPTS, UNHEALTHY_STATUSES
+from upstream import (
+    upstream_protocol, JSON, FORM, ENCODING_REJECTED,
+    UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+)
+from result_cache import result_cache, cache_key
+from history import history_entry, history_body
+from admission import admission, AdmissionRejected, estimate_audio_sec
+from uploads import (
+    MAX_UPLOAD_BYTES, UploadTooLarge, InvalidAudio, Spooler,
+    spool_base64, wrap_file, from_bytes, detach, json_body, form_body,
+)
+from audio import wav_info, read_window_wav
+from hedging import hedger
+import tracing
+from live import (
+    LiveBuffer, live_streams, LIVE_SAMPLE_RATE, LIVE_MAX_FRAME_BYTES, LIVE_MAX_PENDING_SEGMENTS,
+    LIVE_IDLE_TIMEOUT_SEC, LIVE_LATENCY, LIVE_REJECTED,
+)
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+ASYNC_UPSTREAM_MAX_CONNECTIONS = int(os.getenv("ASYNC_UPSTREAM_MAX_CONNECTIONS", "512"))
+MAX_BODY_BYTES = webapp.app.config["MAX_CONTENT_LENGTH"]
+
+# -----------------------------------------------------------------------------
+# Upstream client (one per process, created in lifespan)
+# -----------------------------------------------------------------------------
+upstream_client = None
+
+@asynccontextmanager
+async def lifespan(_app):
+    global upstream_client
+    upstream_client = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(sock_connect=UPSTREAM_CONNECT_TIMEOUT, sock_read=UPSTREAM_READ_TIMEOUT),
+        connector=aiohttp.TCPConnector(limit=ASYNC_UPSTREAM_MAX_CONNECTIONS),
+    )
+    yield
+    await upstream_client.close()
+
+app = FastAPI(title="Speech-to-text webapp (async)", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["Server-Timing", tracing.TRACE_HEADER])
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    # Only the async routes; the mounted Flask app records its own
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    if isinstance(route, APIRoute):
+        HTTP_LATENCY.observe(time.perf_counter() - started, route=route.path,
+                             method=request.method, status=response.status_code)
+    return response
+
+async def _aiter(body):
+    # Spool reads are local (memory or page cache); fine on the event loop
+    for chunk in body:
+        yield chunk
+
+# -----------------------------------------------------------------------------
+# Upstream calls (async twins of webapp._post_backend/_post_upstream)
+# -----------------------------------------------------------------------------
+async def _post_backend(target, upload, payload_json):
+    """
+    Same encoding memory and fallback as webapp._post_backend.
+    Returns (upstream_status, upstream_json, error).
+    """
+    order = upstream_protocol.order(target)
+    endpoint = urlsplit(target).path
+    for attempt, encoding in enumerate(order):
+        n = tracing.next_attempt()
+        with tracing.span(f"payload-{n}", desc=encoding):
+            if encoding == JSON:
+                body = json_body(upload, payload_json)
+                ctype = "application/json"
+            else:
+                body = form_body(upload, payload_json)
+                ctype = "application/x-www-form-urlencoded"
+        headers = {"Content-Type": ctype, "Content-Length": str(len(body))}
+        headers.update(tracing.upstream_headers())
+        started = time.perf_counter()
+        try:
+            # An explicit Content-Length keeps aiohttp from chunking the body
+            with tracing.span(f"upstream-{n}", desc=f"{encoding} {urlsplit(target).netloc}") as span:
+                async with upstream_client.post(target, data=_aiter(body), headers=headers) as resp:
+                    status = span["status"] = resp.status
+                    text = (await resp.read()).decode("utf-8", "replace")
+        except asyncio.TimeoutError:
+            UPSTREAM_RESPONSES.inc(endpoint=endpoint, status="timeout")
+            raise
+        except aiohttp.ClientError:
+            UPSTREAM_RESPONSES.inc(endpoint=endpoint, status="error")
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, encoding=encoding)
+        UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=status)
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+
+        if status in ENCODING_REJECTED and attempt == 0:
+            upstream_protocol.record_fallback()
+            UPSTREAM_FORM_FALLBACKS.inc(endpoint=endpoint)
+            continue
+
+        suffix = " (form)" if encoding == FORM else ""
+        ok = 200 <= status < 300
+        if ok:
+            upstream_protocol.learn(target, encoding)
+        if ok and data is not None:
+            return status, data, None
+        if ok:
+            return status, None, ({
+                "error": f"Unexpected non-JSON response from transcription service{suffix}",
+                "upstream_body": text
+            }, 502)
+        return status, None, ({
+            "error": f"Transcription service error{suffix}",
+            "upstream_status": status,
+            "upstream_body": data if data is not None else text
+        }, 502)
+
+async def _post_upstream(path, model, upload, payload_json):
+    key = hedger.key(model, estimate_audio_sec(upload))
+    delay = hedger.plan(key)
+    # The slower attempt is cancelled, releasing its backend as neutral
+    return await hedger.run_async(key, model, delay,
+                                  lambda view: _post_upstream_once(path, model, view, payload_json),
+                                  upload, succeeded=lambda result: result[1] is None)
+
+async def _post_upstream_once(path, model, upload, payload_json):
+    tried = []
+    last_error = last_exc = None
+    for _ in range(BACKEND_FAILOVER_ATTEMPTS + 1):
+        backend = backend_pool.acquire(model, exclude=tried)
+        if backend is None:
+            break
+        tried.append(backend.id)
+        started = time.perf_counter()
+        try:
+            status, body, error = await _post_backend(backend.url + path, upload, payload_json)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            backend_pool.release(backend, "failure")
+            last_exc = e
+            continue
+        except BaseException:
+            # Cancelled (client went away): says nothing about the backend
+            backend_pool.release(backend, "neutral")
+            raise
+        if status in UNHEALTHY_STATUSES:
+            backend_pool.release(backend, "failure")
+            last_error, last_exc = error, None
+            continue
+        backend_pool.release(backend, "ok" if error is None else "neutral",
+                             latency=time.perf_counter() - started)
+        return body, error
+
+    if last_exc is not None:
+        raise last_exc
+    if last_error is not None:
+        return None, last_error
+    return None, ({"error": "No healthy transcription backend available"}, 503)
+
+async def _transcribe_fanout(path, model, upload, payload_json, windows, sample_rate, on_partial=None):
+    window_payload = dict(payload_json, use_chunked=False)
+    gate = asyncio.Semaphore(FANOUT_PARALLELISM)
+
+    async def run(i, window):
+        async with gate:
+            # No other coroutine touches the spool between these two calls
+            data = read_window_wav(upload, *window)
+            with from_bytes(data, content_type="audio/wav") as part:
+                return i, await _post_upstream(path, model, part, window_payload)
+
+    results = [None] * len(windows)
+    tasks = [asyncio.ensure_future(run(i, w)) for i, w in enumerate(windows)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            i, (body, error) = await fut
+            if error is not None:
+                return None, error
+            results[i] = _window_result(body)
+            if on_partial is not None:
+                on_partial(_partial_event(i, windows, sample_rate, results))
+    finally:
+        for t in tasks:
+            t.cancel()
+
+    texts = [text for text, _ in results]
+    return {"text": _stitch_texts(texts), "window_segments": [segs for _, segs in results]}, None
+
+async def _transcribe_once(path, model, upload, payload_json, include_segments, on_partial=None):
+    windows = _fanout_windows(upload, payload_json)
+    if windows:
+        sample_rate = wav_info(upload).sample_rate
+        body, error = await _transcribe_fanout(path, model, upload, payload_json, windows,
+                                               sample_rate, on_partial)
+    else:
+        body, error = await _post_upstream(path, model, upload, payload_json)
+        if error is None and on_partial is not None:
+            text, segs = _window_result(body)
+            en = _join_english_segments({"segments": segs})
+            on_partial({
+                "event": "partial", "index": 0, "total": 1, "text": text, "translation_en": en,
+                "transcription_so_far": text, "translation_en_so_far": en,
+            })
+    if error is not None:
+        return error
+    with tracing.span("normalize"):
+        return _success_body(body, include_segments)
+
+# Identical requests in flight share one upstream call (per event loop)
+_inflight = {}
+
+async def _cached_transcription(key, compute):
+    value = result_cache.get(key)
+    if value is not None:
+        return value
+    fut = _inflight.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+    fut = _inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        value = await compute()
+        if value[1] == 200:
+            result_cache.put(key, value)
+        fut.set_result(value)
+        return value
+    except BaseException as e:
+        fut.set_exception(e)
+        # Mark retrieved so a future nobody else awaited does not warn
+        fut.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+async def _history_or_transcribe(key, upload, model, params, compute):
+    """
+    Same as webapp._history_or_transcribe; the lookup runs on a thread.
+    """
+    with tracing.span("history") as span:
+        record = await asyncio.to_thread(transcription_history.lookup, upload.sha256(), key)
+        span["hit"] = record is not None
+    if record is not None:
+        return history_body(record), 200
+    started = time.perf_counter()
+    body, status = await compute()
+    if status == 200:
+        transcription_history.record(history_entry(
+            key, upload.sha256(), model, params, body, time.perf_counter() - started, upload.size))
+    return body, status
+
+async def _transcribe_prepared(path, model, upload, payload_json, include_segments, options, on_partial):
+    # Shares admission slots with the Flask routes of this process
+    waited = time.perf_counter()
+    async with admission.slot_async(estimate_audio_sec(upload)):
+        tracing.add("admission", time.perf_counter() - waited)
+        # Decoding, resampling and VAD are CPU work; keep them off the event loop
+        with tracing.span("preprocess"):
+            prepared, report, temporaries = await asyncio.to_thread(_preprocess, upload, model, options)
+        try:
+            body, status = await _transcribe_once(path, model, prepared, payload_json, include_segments,
+                                                  _original_times(on_partial, report))
+        finally:
+            for temp in temporaries:
+                temp.close()
+    if status == 200:
+        body = dict(body, preprocess=report)
+    return body, status
+
+async def transcribe_upload(upload, model, options=None, on_partial=None):
+    """
+    Async counterpart of webapp.transcribe_upload; returns (body, http_status).
+    """
+    if not backend_pool.has_backends():
+        return {"error": "Ngrok URL is not yet available."}, 503
+    path, payload_json = _upstream_payload(model)
+    if path is None:
+        return {"error": "Invalid model selected"}, 400
+
+    started = time.perf_counter()
+    TRANSCRIBE_IN_FLIGHT.inc(model=model)
+    try:
+        options = _resolved_options(model, options or {})
+        params = dict(payload_json, preprocess=options)
+        key = cache_key(upload.sha256(), model, params)
+        tracing.annotate(model=model, audio_bytes=upload.size)
+        body, status = await _cached_transcription(key, lambda: _history_or_transcribe(
+            key, upload, model, params, lambda: _transcribe_prepared(
+                path, model, upload, payload_json, model == "transcribe-2step", options, on_partial)))
+    except AdmissionRejected as e:
+        body, status = e.body(), e.status
+    except asyncio.TimeoutError:
+        body, status = {"error": "Transcription service timed out"}, 504
+    except aiohttp.ClientError as e:
+        body, status = {"error": f"Failed to connect to the transcription service: {e}"}, 502
+    except Exception as e:
+        print(f"Unhandled server error: {e}")
+        body, status = {"error": f"Unexpected server error: {str(e)}"}, 500
+    finally:
+        TRANSCRIBE_IN_FLIGHT.dec(model=model)
+    TRANSCRIBE_LATENCY.observe(time.perf_counter() - started, model=model, status=status)
+    return body, status
+
+def _json_response(body, status):
+    headers = {"Retry-After": str(body["retry_after"])} if body.get("retry_after") else None
+    return JSONResponse(body, status_code=status, headers=headers)
+
+# -----------------------------------------------------------------------------
+# Request parsing
+# -----------------------------------------------------------------------------
+def _capped_request(request, max_bytes=MAX_BODY_BYTES):
+    """
+    The same request with its body counted as it is received: UploadTooLarge
+    once more than max_bytes arrived, whatever Content-Length said (or with
+    chunked transfer encoding). Stands in for Flask's MAX_CONTENT_LENGTH;
+    request.form() and request.body() read through it.
+    """
+    receive = request.receive
+    received = 0
+
+    async def capped_receive():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise UploadTooLarge("request body too large")
+        return message
+
+    return Request(request.scope, capped_receive)
+
+async def _read_audio_request(request):
+    """
+    Same upload modes as webapp._read_audio_request. Returns (upload, model).
+    The request should come from _capped_request().
+    """
+    ctype = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    if int(request.headers.get("content-length") or 0) > MAX_BODY_BYTES:
+        raise UploadTooLarge("request body too large")
+
+    if ctype == "multipart/form-data":
+        form = await request.form()
+        model = form.get("model") or request.query_params.get("model")
+        part = form.get("audio")
+        if part is None or isinstance(part, str):
+            return None, model
+        return wrap_file(part.file, content_type=part.content_type, filename=part.filename), model
+
+    if ctype.startswith("audio/") or ctype == "application/octet-stream":
+        spooler = Spooler(content_type=ctype)
+        try:
+            async for chunk in request.stream():
+                spooler.write(chunk)
+        except UploadTooLarge:
+            raise
+        except BaseException:
+            spooler.abort()
+            raise
+        upload = spooler.finish()
+        if upload.size == 0:
+            upload.close()
+            return None, request.query_params.get("model")
+        return upload, request.query_params.get("model")
+
+    try:
+        data = json.loads(await request.body() or b"{}")
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    audio_b64 = data.get("audio_base64")
+    if not audio_b64:
+        return None, data.get("model")
+    return spool_base64(audio_b64), data.get("model")
+
+async def _request_options(request):
+    """
+    Same switches as webapp._request_options (?normalize=, ?vad= or form fields).
+    """
+    options = {}
+    ctype = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    for name in ("normalize", "vad"):
+        value = request.query_params.get(name)
+        if value is None and ctype == "multipart/form-data":
+            value = (await request.form()).get(name)   # parsed once, cached by starlette
+        if isinstance(value, str):
+            options[name] = _flag(value)
+    return options
+
+# -----------------------------------------------------------------------------
+# Routes
+# -----------------------------------------------------------------------------
+def _stream_transcription(upload, model, options, sse):
+    started = time.monotonic()
+    events = asyncio.Queue()
+    first_text_at = []
+    trace = tracing.current()
+    if trace is not None:
+        trace.deferred = True
+
+    def on_partial(event):
+        if not first_text_at:
+            first_text_at.append(time.monotonic())
+        event["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+        events.put_nowait(event)
+
+    async def work():
+        try:
+            body, status = await transcribe_upload(upload, model, options, on_partial=on_partial)
+        finally:
+            upload.close()
+        finished = time.monotonic()
+        first = first_text_at[0] if first_text_at else finished
+        final = {"event": "final" if status == 200 else "error", "status": status}
+        final.update(body)
+        final.update({
+            "time_to_first_text_ms": int((first - started) * 1000) if status == 200 else None,
+            "total_ms": int((finished - started) * 1000),
+        })
+        if trace is not None:
+            final.update(trace_id=trace.trace_id, server_timing=tracing.finish(trace, status))
+        events.put_nowait(final)
+        events.put_nowait(None)
+
+    # Runs to completion (and fills the cache) even if the client goes away
+    task = asyncio.ensure_future(work())
+
+    async def generate():
+        yield _format_event({"event": "accepted", "model": model}, sse)
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), STREAM_HEARTBEAT_SEC)
+            except asyncio.TimeoutError:
+                yield _format_event({"event": "heartbeat"}, sse)
+                continue
+            if event is None:
+                await task
+                return
+            yield _format_event(event, sse)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/transcribe-audio")
+async def transcribe_audio(request: Request):
+    """
+    Async /transcribe-audio: sync and stream modes. ?mode=job is handed to
+    the Flask job queue. Traced like the Flask route.
+    """
+    # Each request runs in its own context; the trace ends with it
+    trace = tracing.start(request.headers, "/transcribe-audio")
+    response = await _transcribe_audio(request)
+    if trace is not None:
+        response.headers[tracing.TRACE_HEADER] = trace.trace_id
+        response.headers["Server-Timing"] = (
+            trace.server_timing() if trace.deferred else tracing.finish(trace, response.status_code))
+    return response
+
+async def _transcribe_audio(request):
+    mode = request.query_params.get("mode", "sync")
+    tracing.annotate(mode=mode)
+    if mode not in ("sync", "stream"):
+        return JSONResponse({"error": "Only mode=sync and mode=stream are served asynchronously; "
+                                      "use the Flask app for jobs"}, status_code=400)
+    if not backend_pool.has_backends():
+        return JSONResponse({"error": "Ngrok URL is not yet available."}, status_code=503)
+    rejected = admission.check()
+    if rejected is not None:
+        return _json_response(rejected.body(), rejected.status)
+
+    HTTP_IN_FLIGHT.inc(route="/transcribe-audio")
+    request = _capped_request(request)
+    upload = None
+    try:
+        with tracing.span("parse", desc=request.headers.get("content-type", "").split(";")[0]):
+            upload, model = await _read_audio_request(request)
+        if not upload or not model:
+            return JSONResponse({"error": "Missing audio data or model"}, status_code=400)
+        if model not in MODELS:
+            return JSONResponse({"error": "Invalid model selected"}, status_code=400)
+        options = await _request_options(request)
+
+        if mode == "stream":
+            sse = (request.query_params.get("format") == "sse"
+                   or "text/event-stream" in request.headers.get("accept", ""))
+            owned = detach(upload)
+            if owned is not upload:
+                upload.close()
+            upload = None
+            return _stream_transcription(owned, model, options, sse)
+
+        body, status = await transcribe_upload(upload, model, options)
+        return _json_response(body, status)
+
+    except UploadTooLarge:
+        return JSONResponse({"error": f"Audio too large (max {MAX_UPLOAD_BYTES} bytes)"}, status_code=413)
+    except InvalidAudio as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    finally:
+        HTTP_IN_FLIGHT.dec(route="/transcribe-audio")
+        if upload is not None:
+            upload.close()
+
+@app.get("/get_ngrok_url")
+async def get_ngrok_url_endpoint():
+    if tunnel_resolver.snapshot()["ngrok_url"]:
+        # Cached: answers at once, a stale URL is revalidated on a thread
+        snap = tunnel_resolver.get()
+    else:
+        # Cold cache: wait for the resolver on a worker thread, not the loop
+        snap = await asyncio.to_thread(tunnel_resolver.get, tunnel_resolver.session.timeout[1])
+    body, status = ngrok_url_body(snap)
+    return JSONResponse(body, status_code=status)
+
+# -----------------------------------------------------------------------------
+# Live microphone streaming
+# -----------------------------------------------------------------------------
+async def _live_session(ws, model, path, payload_json, buf):
+    """
+    Feed frames into buf until the client stops or goes away. Finals are
+    transcribed one at a time in order; at most one partial is in flight,
+    and a partial whose utterance has been cut meanwhile is dropped.
+    """
+    include_segments = model == "transcribe-2step"
+    send_lock = asyncio.Lock()
+    finals = asyncio.Queue(LIVE_MAX_PENDING_SEGMENTS)
+    partial = None
+
+    async def send(event):
+        try:
+            async with send_lock:
+                await ws.send_json(event)
+        except (WebSocketDisconnect, RuntimeError):
+            pass    # client gone; the receive loop notices
+
+    async def hypothesis(kind, window):
+        try:
+            with from_bytes(window.wav, content_type="audio/wav") as part:
+                body, error = await _post_upstream(path, model, part, payload_json)
+            body, status = error if error is not None else _success_body(body, include_segments)
+        except asyncio.TimeoutError:
+            body, status = {"error": "Transcription service timed out"}, 504
+        except aiohttp.ClientError as e:
+            body, status = {"error": f"Failed to connect to the transcription service: {e}"}, 502
+        except Exception as e:
+            # Anything else must not kill run_finals and end the session silently
+            print(f"Unhandled live transcription error: {e}")
+            body, status = {"error": f"Unexpected server error: {str(e)}"}, 500
+        if kind == "partial" and window.segment != buf.segment:
+            return
+        latency = time.monotonic() - window.captured_at
+        event = window.event(kind if status == 200 else "error")
+        event.update(body, status=status, latency_ms=int(latency * 1000))
+        if status == 200:
+            LIVE_LATENCY.observe(latency, kind=kind)
+        await send(event)
+
+    async def run_finals():
+        while True:
+            window = await finals.get()
+            if window is None:
+                return
+            await hypothesis("final", window)
+
+    async def close(code, reason=None):
+        if reason:
+            LIVE_REJECTED.inc(reason=reason)
+        try:
+            await ws.close(code)
+        except RuntimeError:
+            pass
+
+    worker = asyncio.ensure_future(run_finals())
+    await send({"event": "ready", "model": model, "sample_rate": buf.sample_rate})
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(ws.receive(), LIVE_IDLE_TIMEOUT_SEC)
+            except asyncio.TimeoutError:
+                await send({"event": "error", "error": "No audio received, closing"})
+                return await close(1000, "idle")
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                try:
+                    control = json.loads(message.get("text") or "{}")
+                except ValueError:
+                    control = {}
+                if isinstance(control, dict) and control.get("type") == "stop":
+                    break
+                continue
+            if len(data) > LIVE_MAX_FRAME_BYTES:
+                await send({"event": "error", "error": f"Frame too large (max {LIVE_MAX_FRAME_BYTES} bytes)"})
+                return await close(1009, "frame_too_large")
+            buf.feed(data)
+            if buf.final_due():
+                if partial is not None:
+                    partial.cancel()
+                try:
+                    finals.put_nowait(buf.cut())
+                except asyncio.QueueFull:
+                    await send({"event": "error", "error": "Transcription is falling behind the audio"})
+                    return await close(1013, "behind")
+            elif buf.partial_due() and (partial is None or partial.done()):
+                partial = asyncio.ensure_future(hypothesis("partial", buf.take_partial()))
+
+        # Stopped: finish the last utterance, then say goodbye
+        if partial is not None:
+            partial.cancel()
+        window = buf.flush()
+        if window is not None:
+            await finals.put(window)
+        await finals.put(None)
+        await worker
+        await send({"event": "done", "segments": buf.segment})
+        await close(1000)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        worker.cancel()
+        if partial is not None:
+            partial.cancel()
+
+@app.websocket("/live")
+async def live_transcription(ws: WebSocket):
+    """
+    Live microphone transcription. The client sends binary frames of 16-bit
+    little-endian mono PCM at ?sample_rate= (default 16000) and a text
+    frame {"type": "stop"} when done. The server sends JSON events: ready;
+    partial (the utterance so far, replaced by the next partial or final);
+    final (one per utterance, cut at a pause); error; done.
+    """
+    await ws.accept()
+    model = ws.query_params.get("model", "transcribe")
+    path, payload_json = _upstream_payload(model)
+    try:
+        sample_rate = int(ws.query_params.get("sample_rate", LIVE_SAMPLE_RATE))
+    except ValueError:
+        sample_rate = 0
+    if path is None or not 8000 <= sample_rate <= 48000:
+        await ws.send_json({"event": "error", "error": "Invalid model or sample_rate"})
+        return await ws.close(1008)
+    if not backend_pool.has_backends():
+        await ws.send_json({"event": "error", "error": "Ngrok URL is not yet available."})
+        return await ws.close(1013)
+    if not live_streams.acquire():
+        LIVE_REJECTED.inc(reason="busy")
+        await ws.send_json({"event": "error", "error": "Too many live streams, try again later"})
+        return await ws.close(1013)
+    try:
+        # Each window is one utterance; the backend must not re-chunk it
+        await _live_session(ws, model, path, dict(payload_json, use_chunked=False), LiveBuffer(sample_rate))
+    finally:
+        live_streams.release()
+
+# Everything else (UI, jobs, stats, /metrics) is the Flask app
+app.mount("/", WSGIMiddleware(webapp.app))